@@ -0,0 +1,62 @@
+"""
+Measures the cost of preparing notifications: formatting toast, tile, tile
+template and raw notifications from scratch, with repeated, unique and
+escaped texts, and re-addressing a prepared one with forUri.
+
+Usage: PYTHONPATH=. python benchmarks/formatting.py [iterations]
+"""
+import itertools
+import sys
+import timeit
+
+from mpns.notifications import (
+    CycleTileNotification,
+    FlipTileNotification,
+    RawNotification,
+    ToastNotification,
+    TileNotification
+)
+
+
+URI = 'https://db3.notify.live.net/throttledthirdparty/01.00/AQHgHh6ZiiHp'
+TOAST = ToastNotification(URI, text1='Breaking news',
+                          text2='Something has happened', param='/news?id=1')
+COUNTER = itertools.count()
+
+CASES = [
+    ('raw', lambda: RawNotification(URI, body='payload')),
+    ('toast', lambda: ToastNotification(
+        URI, text1='Breaking news', text2='Something has happened',
+        param='/news?id=1')),
+    ('toast unique', lambda: ToastNotification(
+        URI, text1='Breaking news', text2='Something {0}'.format(
+            next(COUNTER)), param='/news?id=1')),
+    ('toast escaped', lambda: ToastNotification(
+        URI, text1='Tom & Jerry', text2='<b>{0}</b>'.format(next(COUNTER)),
+        param='/news?id=1&ref=toast')),
+    ('tile', lambda: TileNotification(
+        URI, title='News', count=5, background='/images/news.png')),
+    ('flip tile', lambda: FlipTileNotification(
+        URI, smallBackground='/images/small.png',
+        wideBackground='/images/wide.png',
+        wideBackBackground='/images/wide-back.png',
+        wideBackContent='Something has happened',
+        background='/images/news.png', count=5, title='News',
+        backBackground='/images/back.png', backTitle='Breaking news',
+        backContent='Something has happened')),
+    ('cycle tile', lambda: CycleTileNotification(
+        URI, title='Photos', count=9,
+        images=['/images/{0}.png'.format(i) for i in range(9)])),
+    ('toast forUri', lambda: TOAST.forUri(URI))
+]
+
+
+def main(iterations=100000):
+    for name, case in CASES:
+        seconds = min(timeit.repeat(case, number=iterations, repeat=3))
+        print('{0:>14}: {1:8.0f} ns/notification'.format(
+            name, seconds / iterations * 1e9))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
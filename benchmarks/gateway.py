@@ -0,0 +1,185 @@
+"""
+Fake MPNS gateway server for benchmarks. Accepts notifications over HTTP and
+HTTPS (requiring a client certificate), answering with a configurable mix of
+gateway responses after a configurable latency.
+
+Usage: PYTHONPATH=. python benchmarks/gateway.py [options]
+"""
+import argparse
+import random
+
+from OpenSSL import crypto
+from twisted.internet import reactor
+from twisted.internet.ssl import Certificate, PrivateCertificate
+from twisted.web.resource import Resource
+from twisted.web.server import Site, NOT_DONE_YET
+
+
+# Response code and X-NotificationStatus, X-SubscriptionStatus and
+# X-DeviceConnectionStatus header values for each simulated outcome.
+OUTCOMES = {
+    'received': (200, 'Received', 'Active', 'Connected'),
+    'queuefull': (200, 'QueueFull', 'Active', 'Connected'),
+    'expired': (404, 'Dropped', 'Expired', 'Disconnected'),
+    'throttled': (406, 'Dropped', 'Active', 'Connected'),
+    'disconnected': (412, 'Dropped', 'Active', 'Inactive'),
+    'unavailable': (503, None, None, None)
+}
+
+
+def parseErrors(spec):
+    """
+    Parse error mix specification, e.g. 'expired=0.01,throttled=0.005', into
+    a dictionary mapping outcome names to their probabilities.
+    """
+    errors = {}
+    for item in filter(None, spec.split(',')):
+        name, probability = item.split('=')
+        if name not in OUTCOMES:
+            raise ValueError('Unknown outcome: ' + name)
+        errors[name] = float(probability)
+    return errors
+
+
+class FakeGateway(Resource):
+    """
+    Resource answering every POST request like an MPNS gateway would.
+
+    :param latency: number of seconds each response is delayed by.
+    :param errors: dictionary mapping names of OUTCOMES to probabilities they
+    are returned with; remaining requests are answered with 'received'.
+    """
+
+    isLeaf = True
+
+    def __init__(self, latency=0.0, errors=None, clock=reactor):
+        Resource.__init__(self)
+        self._latency = latency
+        self._errors = sorted((errors or {}).items())
+        self._clock = clock
+        self.requests = 0
+
+    def _pickOutcome(self):
+        roll = random.random()
+        for name, probability in self._errors:
+            if roll < probability:
+                return OUTCOMES[name]
+            roll -= probability
+        return OUTCOMES['received']
+
+    def render_POST(self, request):
+        self.requests += 1
+        request.content.read()
+        outcome = self._pickOutcome()
+        if self._latency > 0:
+            self._clock.callLater(self._latency, self._respond, request,
+                                  outcome)
+            return NOT_DONE_YET
+        return self._respond(request, outcome, finish=False)
+
+    @staticmethod
+    def _respond(request, outcome, finish=True):
+        code, notification, subscription, device = outcome
+        request.setResponseCode(code)
+        if notification is not None:
+            request.setHeader('X-NotificationStatus', notification)
+            request.setHeader('X-SubscriptionStatus', subscription)
+            request.setHeader('X-DeviceConnectionStatus', device)
+        if finish:
+            request.finish()
+        return b''
+
+
+def _newCertificate(subject, issuer, issuerKey, serial, extensions=()):
+    key = crypto.PKey()
+    key.generate_key(crypto.TYPE_RSA, 2048)
+    certificate = crypto.X509()
+    certificate.set_version(2)
+    certificate.get_subject().CN = subject
+    certificate.set_serial_number(serial)
+    certificate.gmtime_adj_notBefore(-3600)
+    certificate.gmtime_adj_notAfter(24 * 3600)
+    certificate.set_issuer((issuer or certificate).get_subject())
+    certificate.set_pubkey(key)
+    certificate.add_extensions(list(extensions))
+    certificate.sign(issuerKey or key, 'sha256')
+    return certificate, key
+
+
+def _pem(certificate, key):
+    return (crypto.dump_certificate(crypto.FILETYPE_PEM, certificate) +
+            crypto.dump_privatekey(crypto.FILETYPE_PEM, key))
+
+
+class Certificates(object):
+    """
+    Throwaway certificate authority with a server certificate for localhost
+    and a client certificate to be used by Pusher.
+
+    :ivar authority: Certificate of the authority, to be used as trust root.
+    :ivar server: PrivateCertificate of the gateway server.
+    :ivar clientPem: PEM string with client certificate and key.
+    """
+
+    def __init__(self, hostname='localhost'):
+        caCertificate, caKey = _newCertificate(
+            'MPNS benchmark CA', None, None, 1,
+            [crypto.X509Extension(b'basicConstraints', True, b'CA:TRUE')])
+        serverCertificate, serverKey = _newCertificate(
+            hostname, caCertificate, caKey, 2,
+            [crypto.X509Extension(b'subjectAltName', False,
+                                  b'DNS:' + hostname.encode('ascii'))])
+        clientCertificate, clientKey = _newCertificate(
+            'MPNS benchmark client', caCertificate, caKey, 3)
+
+        self.authority = Certificate(caCertificate)
+        self.server = PrivateCertificate.loadPEM(
+            _pem(serverCertificate, serverKey))
+        self.clientPem = _pem(clientCertificate, clientKey)
+
+    def serverOptions(self):
+        """Return TLS options requiring a client certificate from our CA."""
+        return self.server.options(self.authority)
+
+
+def listen(gateway, port=0, certificates=None, interface='127.0.0.1'):
+    """
+    Start serving the gateway resource, over HTTPS if certificates are given.
+
+    :return the listening port.
+    """
+    site = Site(gateway)
+    site.noisy = False
+    if certificates is None:
+        return reactor.listenTCP(port, site, interface=interface)
+    return reactor.listenSSL(port, site, certificates.serverOptions(),
+                             interface=interface)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--https', action='store_true',
+                        help='serve over HTTPS, writing client certificate '
+                             'and CA certificate to the given files')
+    parser.add_argument('--client-pem', default='client.pem')
+    parser.add_argument('--ca-pem', default='ca.pem')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--errors', type=parseErrors, default={},
+                        help='error mix, e.g. expired=0.01,throttled=0.01')
+    args = parser.parse_args()
+
+    certificates = None
+    if args.https:
+        certificates = Certificates()
+        with open(args.client_pem, 'wb') as f:
+            f.write(certificates.clientPem)
+        with open(args.ca_pem, 'wb') as f:
+            f.write(certificates.authority.dumpPEM())
+
+    listen(FakeGateway(args.latency, args.errors), args.port, certificates)
+    reactor.run()
+
+
+if __name__ == '__main__':
+    main()
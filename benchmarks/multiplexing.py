@@ -0,0 +1,72 @@
+"""
+Compares sending notifications spread across several gateway hosts with one
+request per connection, through the persistent connection pool, and through
+MultiplexingPusher, reporting notifications per second and connections
+opened.
+
+Usage: PYTHONPATH=. python benchmarks/multiplexing.py [options]
+"""
+import argparse
+import sys
+import time
+
+from twisted.internet.defer import inlineCallbacks
+from twisted.internet.task import react
+from gateway import FakeGateway, listen
+from mpns.multiplexing import MultiplexingPusher
+from mpns.notifications import ToastNotification
+from mpns.pusher import Pusher
+
+
+def parseArguments(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--count', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--hosts', type=int, default=4,
+                        help='number of gateway hosts')
+    parser.add_argument('--connections', type=int, default=2,
+                        help='persistent connections per gateway host')
+    parser.add_argument('--latency', type=float, default=0.0)
+    return parser.parse_args(argv)
+
+
+def notifications(uris, count):
+    prototype = ToastNotification(uris[0], text1='Benchmark', text2='Hello')
+    for i in range(count):
+        yield prototype.forUri(uris[i % len(uris)])
+
+
+@inlineCallbacks
+def measure(name, pusher, sender, args, uris):
+    started = time.time()
+    yield sender.sendMany(notifications(uris, args.count),
+                          concurrency=args.concurrency)
+    elapsed = time.time() - started
+    print('{0:>16}: {1:8.0f} notifications/s, {2:6} connections'.format(
+        name, args.count / elapsed, pusher.pool.misses))
+    yield pusher.pool.closeCachedConnections()
+
+
+@inlineCallbacks
+def main(reactor, *argv):
+    args = parseArguments(argv)
+    ports = [listen(FakeGateway(args.latency)) for _ in range(args.hosts)]
+    uris = ['http://127.0.0.1:{0}/notify'.format(port.getHost().port)
+            for port in ports]
+
+    pusher = Pusher(persistent=False)
+    yield measure('per connection', pusher, pusher, args, uris)
+
+    pusher = Pusher(maxConnectionsPerHost=args.connections)
+    yield measure('pooled', pusher, pusher, args, uris)
+
+    pusher = Pusher(maxConnectionsPerHost=args.connections)
+    multiplexing = MultiplexingPusher(pusher, args.connections)
+    yield measure('multiplexed', pusher, multiplexing, args, uris)
+
+    for port in ports:
+        yield port.stopListening()
+
+
+if __name__ == '__main__':
+    react(main, sys.argv[1:])
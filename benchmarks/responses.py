@@ -0,0 +1,108 @@
+"""
+Measures the cost of classifying gateway responses in Pusher, comparing the
+current implementation with the original one.
+
+Usage: PYTHONPATH=. python benchmarks/responses.py [iterations]
+"""
+import logging
+import sys
+import timeit
+
+from twisted.web.http_headers import Headers
+
+from mpns.exceptions import (
+    NotificationPusherError,
+    InvalidResponseError,
+    DeliveryError,
+    QueueFullError,
+    SubscriptionExpiredError,
+    DeviceDisconnectedError,
+    ThrottlingLimitError
+)
+from mpns.pusher import Pusher, NotificationStatus
+
+
+logger = logging.getLogger('mpns.pusher')
+
+
+class FakeResponse(object):
+
+    def __init__(self, code, notification, subscription, device):
+        self.code = code
+        self.headers = Headers({
+            'X-NotificationStatus': [notification],
+            'X-SubscriptionStatus': [subscription],
+            'X-DeviceConnectionStatus': [device]
+        })
+
+
+def legacyExtractHeader(response, name):
+    header = response.headers.getRawHeaders(name)
+    if header is not None and len(header) > 0:
+        return header[0]
+    else:
+        return ''
+
+
+def legacyProcessResponse(response):
+    """Response processing as implemented before the lookup tables."""
+    status = NotificationStatus(
+        notification=legacyExtractHeader(response, 'X-NotificationStatus'),
+        subscription=legacyExtractHeader(response, 'X-SubscriptionStatus'),
+        device=legacyExtractHeader(response, 'X-DeviceConnectionStatus')
+    )
+
+    logger.debug('Notification ' + status.notification)
+    logger.debug('Subscription ' + status.subscription)
+    logger.debug('Device ' + status.device)
+
+    extra = {'response code': response.code, 'status': status}
+
+    if response.code == 200:
+        if status.notification in ['Received', 'Suppressed']:
+            return status
+        elif status.notification == 'QueueFull':
+            raise QueueFullError('Queue full', extra=extra)
+
+    elif response.code == 404 and status.subscription == 'Expired':
+        raise SubscriptionExpiredError('Subscription expired', extra=extra)
+
+    elif response.code == 406:
+        raise ThrottlingLimitError('Throttling limit hit', extra=extra)
+
+    elif response.code == 412:
+        raise DeviceDisconnectedError('Device disconnected', extra=extra)
+
+    if status.notification == 'Dropped':
+        raise DeliveryError('Dropped for unknown reason', extra=extra)
+    else:
+        raise InvalidResponseError('Invalid notification status',
+                                   extra=extra)
+
+
+# Mostly successful responses, as seen in production.
+RESPONSES = ([FakeResponse(200, 'Received', 'Active', 'Connected')] * 18 +
+             [FakeResponse(404, 'Dropped', 'Expired', 'Disconnected'),
+              FakeResponse(406, 'Dropped', 'Active', 'Connected')])
+
+
+def processAll(process):
+    for response in RESPONSES:
+        try:
+            process(response)
+        except NotificationPusherError:
+            pass
+
+
+def main(iterations=20000):
+    candidates = [('legacy', legacyProcessResponse),
+                  ('current', Pusher._processResponse)]
+    for name, process in candidates:
+        seconds = min(timeit.repeat(lambda: processAll(process),
+                                    number=iterations, repeat=3))
+        perResponse = seconds / (iterations * len(RESPONSES)) * 1e9
+        print('{0:>8}: {1:8.0f} ns/response'.format(name, perResponse))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,112 @@
+"""
+Measures throughput and latency of Pusher against a local fake gateway,
+reporting notifications per second, latency percentiles, outcome counts and
+memory used per in-flight request.
+
+Usage: PYTHONPATH=. python benchmarks/sending.py [options]
+"""
+import argparse
+import resource
+import sys
+import time
+from collections import Counter
+
+from twisted.internet.defer import inlineCallbacks
+from twisted.internet.task import react
+from gateway import Certificates, FakeGateway, listen, parseErrors
+from mpns.notifications import ToastNotification
+from mpns.pusher import Pusher
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def maxRss():
+    """Return peak resident set size of the process in kilobytes."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def parseArguments(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--count', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--https', action='store_true')
+    parser.add_argument('--no-persistent', dest='persistent',
+                        action='store_false')
+    parser.add_argument('--connections', type=int, default=10,
+                        help='persistent connections per gateway host')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--errors', type=parseErrors, default={},
+                        help='error mix, e.g. expired=0.01,throttled=0.01')
+    return parser.parse_args(argv)
+
+
+def createPusher(args, certificates, **kwargs):
+    if certificates is None:
+        return Pusher(persistent=args.persistent,
+                      maxConnectionsPerHost=args.connections, **kwargs)
+    return Pusher(certificates.clientPem, persistent=args.persistent,
+                  maxConnectionsPerHost=args.connections,
+                  trustRoot=certificates.authority, **kwargs)
+
+
+def report(args, elapsed, latencies, outcomes, rssBefore, rssAfter):
+    latencies.sort()
+    print('{0} notifications in {1:.2f} s: {2:.0f} notifications/s'.format(
+        args.count, elapsed, args.count / elapsed))
+    print('latency p50 {0:.2f} ms, p99 {1:.2f} ms'.format(
+        percentile(latencies, 0.5) * 1000,
+        percentile(latencies, 0.99) * 1000))
+    print('memory per in-flight request: {0:.1f} kB'.format(
+        float(rssAfter - rssBefore) / args.concurrency))
+    for name, count in sorted(outcomes.items()):
+        print('{0:>30}: {1}'.format(name, count))
+
+
+@inlineCallbacks
+def main(reactor, *argv):
+    args = parseArguments(argv)
+    certificates = Certificates() if args.https else None
+    port = listen(FakeGateway(args.latency, args.errors),
+                  certificates=certificates)
+    uri = '{0}://localhost:{1}/notify'.format(
+        'https' if args.https else 'http', port.getHost().port)
+
+    pusher = createPusher(args, certificates)
+    prototype = ToastNotification(uri, text1='Benchmark', text2='Hello')
+    latencies = []
+    outcomes = Counter()
+    send = pusher.send
+
+    def timedSend(notification):
+        started = time.time()
+        d = send(notification)
+
+        @d.addBoth
+        def finished(result):
+            latencies.append(time.time() - started)
+            return result
+        return d
+    pusher.send = timedSend
+
+    def collect(notification, result):
+        outcomes[getattr(result, 'notification', None) or
+                 result.__class__.__name__] += 1
+
+    rssBefore = maxRss()
+    started = time.time()
+    yield pusher.sendMany((prototype.forUri(uri) for _ in range(args.count)),
+                          concurrency=args.concurrency, callback=collect)
+    elapsed = time.time() - started
+
+    report(args, elapsed, latencies, outcomes, rssBefore, maxRss())
+    print('connection pool: {0} hits, {1} misses'.format(
+        pusher.pool.hits, pusher.pool.misses))
+
+    yield pusher.pool.closeCachedConnections()
+    yield port.stopListening()
+
+
+if __name__ == '__main__':
+    react(main, sys.argv[1:])
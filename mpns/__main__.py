@@ -0,0 +1,4 @@
+from mpns.cli import main
+
+
+main()
@@ -0,0 +1,173 @@
+from collections import deque
+
+from twisted.internet.defer import Deferred, succeed, fail
+
+from mpns.exceptions import LoadSheddingError
+from mpns.notifications import (
+    DELIVER_IMMEDIATELY,
+    DELIVER_WITHIN_450_S,
+    DELIVER_WITHIN_950_S
+)
+from mpns.scheduling import PRIORITIES, priorityOf
+
+
+# Fractions of maxQueuedBytes above which notifications of given priority are
+# shed.
+DEFAULT_THRESHOLDS = {DELIVER_IMMEDIATELY: 1.0, DELIVER_WITHIN_450_S: 0.75,
+                      DELIVER_WITHIN_950_S: 0.5}
+
+
+def _size(notification):
+    return len(notification.requestUri) + len(notification.requestBody or b'')
+
+
+class _Waiter(object):
+
+    def __init__(self, size, canceller):
+        self.size = size
+        self.admitted = Deferred(canceller)
+
+
+class AdmissionController(object):
+    """
+    Limits the number of requests in flight and the amount of memory held by
+    notifications waiting for a free request slot. Waiting notifications are
+    admitted by priority, immediate ones first.
+
+    A notification is shed, i.e. fails with LoadSheddingError, if admitting
+    it to the waiting queue would make the queued bytes exceed its priority's
+    share of maxQueuedBytes. When an immediate notification does not fit,
+    the most recently queued notifications of the lowest priority are shed
+    to make room for it.
+
+    Producers may wait for whenReady() before sending more, instead of
+    having notifications shed.
+
+    :param maxInFlight: maximum number of requests in flight.
+    :param maxQueuedBytes: maximum size of notifications waiting for a
+    request slot, counting their URIs and bodies.
+    :param thresholds: mapping of priorities to fractions of maxQueuedBytes
+    above which notifications of the priority are shed.
+    :param resumeFraction: fraction of maxQueuedBytes below which producers
+    waiting in whenReady() are resumed.
+    """
+
+    def __init__(self, maxInFlight=100, maxQueuedBytes=8 * 1024 ** 2,
+                 thresholds=DEFAULT_THRESHOLDS, resumeFraction=0.5):
+        self._maxInFlight = maxInFlight
+        self._maxQueuedBytes = maxQueuedBytes
+        self._thresholds = thresholds
+        self._resumeBytes = maxQueuedBytes * resumeFraction
+        self._queues = dict((priority, deque()) for priority in PRIORITIES)
+        self._readyWaiters = []
+        self._admitting = False
+        self.inFlight = 0
+        self.queuedBytes = 0
+        self.shed = dict.fromkeys(PRIORITIES, 0)
+
+    @property
+    def queued(self):
+        """Return number of notifications waiting for a request slot."""
+        return sum(len(queue) for queue in self._queues.values())
+
+    @property
+    def ready(self):
+        """Return whether producers may send more notifications."""
+        return self.queuedBytes <= self._resumeBytes
+
+    def whenReady(self):
+        """
+        Return a Deferred firing with None once producers may send more
+        notifications, i.e. when few enough of them are waiting.
+        """
+        if self.ready:
+            return succeed(None)
+        d = Deferred()
+        self._readyWaiters.append(d)
+        return d
+
+    def acquire(self, notification):
+        """
+        Reserve a request slot for a notification. release() must be called
+        once the request completes.
+
+        :return a Deferred firing with None once the notification may be
+        sent, or failing with LoadSheddingError if it has been shed.
+        Cancelling it withdraws the notification from the waiting queue.
+        """
+        if self.inFlight < self._maxInFlight:
+            self.inFlight += 1
+            return succeed(None)
+
+        priority = priorityOf(notification)
+        size = _size(notification)
+        limit = self._maxQueuedBytes * self._thresholds.get(priority, 1.0)
+        if priority == DELIVER_IMMEDIATELY:
+            self._makeRoom(self.queuedBytes + size - limit)
+            self._resumeProducers()
+        if self.queuedBytes + size > limit:
+            self.shed[priority] += 1
+            return fail(LoadSheddingError('Too many queued notifications',
+                                          {'priority': priority}))
+
+        waiter = _Waiter(size, lambda _: self._cancelled(priority, waiter))
+        self._queues[priority].append(waiter)
+        self.queuedBytes += size
+        return waiter.admitted
+
+    def release(self):
+        """Free a request slot, admitting the next waiting notification."""
+        self.inFlight -= 1
+        # Admitted notifications failing synchronously release their slot
+        # from within waiter.admitted.callback(), the loop below admits
+        # their successors instead of nesting.
+        if self._admitting:
+            return
+        self._admitting = True
+        try:
+            while self.inFlight < self._maxInFlight:
+                waiter = self._nextWaiter()
+                if waiter is None:
+                    break
+                self.inFlight += 1
+                self._resumeProducers()
+                waiter.admitted.callback(None)
+        finally:
+            self._admitting = False
+        self._resumeProducers()
+
+    def _nextWaiter(self):
+        for priority in PRIORITIES:
+            queue = self._queues[priority]
+            while queue:
+                waiter = queue.popleft()
+                self.queuedBytes -= waiter.size
+                if not waiter.admitted.called:
+                    return waiter
+        return None
+
+    def _cancelled(self, priority, waiter):
+        try:
+            self._queues[priority].remove(waiter)
+        except ValueError:
+            return
+        self.queuedBytes -= waiter.size
+        self._resumeProducers()
+
+    def _makeRoom(self, size):
+        for priority in reversed(PRIORITIES[1:]):
+            queue = self._queues[priority]
+            while size > 0 and queue:
+                waiter = queue.pop()
+                self.queuedBytes -= waiter.size
+                size -= waiter.size
+                self.shed[priority] += 1
+                waiter.admitted.errback(LoadSheddingError(
+                    'Shed for a more urgent notification',
+                    {'priority': priority}))
+
+    def _resumeProducers(self):
+        if self._readyWaiters and self.ready:
+            waiters, self._readyWaiters = self._readyWaiters, []
+            for d in waiters:
+                d.callback(None)
@@ -0,0 +1,164 @@
+"""
+Pusher implementation for asyncio applications, based on aiohttp. Requires
+Python 3.5 or newer.
+"""
+import asyncio
+import logging
+import os
+import ssl
+import tempfile
+
+import aiohttp
+
+from mpns.exceptions import HTTPError
+from mpns.responses import (
+    NotificationStatus,
+    PROCESSABLE_RESPONSES,
+    RESPONSE_TO_ERROR,
+    classifyResponse
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+def clientContext(pem=None, cafile=None):
+    """
+    Create TLS context for connecting to the gateway servers, optionally
+    authenticating with a client certificate.
+
+    :param pem: a string containing PEM-formatted client certificate and
+    private key, or None.
+    :param cafile: optional path of a file with trusted authority
+    certificates, replacing the default ones.
+    """
+    context = ssl.create_default_context(cafile=cafile)
+    if pem is not None:
+        # load_cert_chain only reads files, so the PEM is written to a
+        # private temporary file for a moment.
+        descriptor, path = tempfile.mkstemp(suffix='.pem')
+        try:
+            with os.fdopen(descriptor, 'w') as f:
+                f.write(pem if isinstance(pem, str) else pem.decode('ascii'))
+            context.load_cert_chain(path)
+        finally:
+            os.unlink(path)
+    return context
+
+
+class AsyncPusher(object):
+    """
+    Allows connecting to the MPNS gateway and sending notifications to the end
+    devices from asyncio code. Semantics of sending match these of
+    mpns.pusher.Pusher: the same notification formatters, NotificationStatus
+    and exceptions are used.
+
+    :param pem: a string containing PEM-formatted certificate used to
+    authenticate the client against the gateway server. Only necessary for
+    sending notifications to https based subscriptions.
+    :param maxConnectionsPerHost: maximum number of simultaneous connections
+    per gateway host.
+    :param idleTimeout: number of seconds an idle persistent connection stays
+    open before being closed.
+    :param cafile: optional path of a file with trusted authority certificates.
+    :param session: optional aiohttp.ClientSession to be used instead of a
+    private one, e.g. to share a connection pool between pushers.
+    """
+
+    def __init__(self, pem=None, maxConnectionsPerHost=2, idleTimeout=240,
+                 cafile=None, session=None):
+        self._context = clientContext(pem, cafile)
+        self._maxConnectionsPerHost = maxConnectionsPerHost
+        self._idleTimeout = idleTimeout
+        self._session = session
+        self._ownSession = session is None
+
+    def _getSession(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(
+                limit=0, limit_per_host=self._maxConnectionsPerHost,
+                keepalive_timeout=self._idleTimeout, ssl=self._context)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self):
+        """Close connections, unless the session was given upon creation."""
+        if self._ownSession and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def send(self, notification):
+        """
+        Send prepared notification to the gateway server. Raise an exception
+        if the gateway rejected the request, the response could not be parsed,
+        or we know the notification will never be delivered.
+
+        :return an instance of NotificationStatus, containing notification,
+        subscription and device statuses extracted from the response.
+        """
+        headers = [(name, value)
+                   for name, values in notification.requestHeaders.items()
+                   for value in values]
+        body = notification.requestBody
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+
+        logger.debug('Sending request')
+
+        async with self._getSession().post(
+                notification.requestUri, data=body,
+                headers=headers) as response:
+            # Reading the body releases the connection to the pool.
+            await response.read()
+
+        logger.debug('Response code: %i', response.status)
+
+        if response.status not in PROCESSABLE_RESPONSES:
+            raise HTTPError(
+                RESPONSE_TO_ERROR.get(response.status,
+                                      'Unknown response code'),
+                {'response code': response.status})
+
+        status = NotificationStatus(
+            notification=response.headers.get('X-NotificationStatus', ''),
+            subscription=response.headers.get('X-SubscriptionStatus', ''),
+            device=response.headers.get('X-DeviceConnectionStatus', ''))
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Notification %s', status.notification)
+            logger.debug('Subscription %s', status.subscription)
+            logger.debug('Device %s', status.device)
+
+        outcome = classifyResponse(response.status, status)
+        if outcome is None:
+            return status
+
+        errorClass, message = outcome
+        raise errorClass(message, extra={'response code': response.status,
+                                         'status': status})
+
+    async def sendMany(self, notifications, concurrency=10, callback=None):
+        """
+        Send notifications taken lazily from an iterable, keeping at most
+        `concurrency` requests in flight. A failure of one notification does
+        not abort the others.
+
+        :param callback: optional callable invoked as callback(notification,
+        result) as soon as each notification is processed, where result is
+        either a NotificationStatus or the exception raised by send().
+        """
+        iterator = iter(notifications)
+
+        async def work():
+            for notification in iterator:
+                try:
+                    result = await self.send(notification)
+                except Exception as error:
+                    result = error
+                if callback is not None:
+                    try:
+                        callback(notification, result)
+                    except Exception:
+                        logger.exception('Result callback failed')
+
+        await asyncio.gather(*[work() for _ in range(concurrency)])
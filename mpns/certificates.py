@@ -0,0 +1,108 @@
+import io
+import logging
+import os
+
+from twisted.internet import reactor
+from twisted.internet.ssl import PrivateCertificate
+from twisted.internet.task import LoopingCall
+
+
+logger = logging.getLogger(__name__)
+
+
+class _Certificate(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.pem = None
+        self.stamp = None
+
+
+class CertificateRegistry(object):
+    """
+    Registry of client certificates of several applications, read from PEM
+    files and reloaded when the files change. A changed file replaces the
+    certificate only if it contains a valid certificate and private key, so a
+    file caught in the middle of being rewritten never breaks the registry;
+    it is simply read again on the next check.
+
+    :param certificates: optional mapping of application ids to paths of PEM
+    files with certificate and private key.
+    """
+
+    def __init__(self, certificates=None, clock=reactor):
+        self._certificates = {}
+        self._listeners = []
+        self._loop = LoopingCall(self.reload)
+        self._loop.clock = clock
+        for appId, path in (certificates or {}).items():
+            self.register(appId, path)
+
+    def __contains__(self, appId):
+        return appId in self._certificates
+
+    def register(self, appId, path):
+        """
+        Add a certificate of an application, reading it immediately.
+        Raise IOError or SSL error if the file could not be loaded.
+        """
+        certificate = _Certificate(path)
+        stamp = self._stamp(path)
+        certificate.pem = self._load(path)
+        certificate.stamp = stamp
+        self._certificates[appId] = certificate
+
+    def pem(self, appId):
+        """
+        Return PEM string with certificate and private key of an application.
+        Raise KeyError for unknown application ids.
+        """
+        return self._certificates[appId].pem
+
+    def addListener(self, listener):
+        """
+        Call listener(appId, pem) whenever a certificate has been reloaded.
+        """
+        self._listeners.append(listener)
+
+    def reload(self):
+        """Reload certificates whose files have changed since last read."""
+        for appId, certificate in list(self._certificates.items()):
+            try:
+                stamp = self._stamp(certificate.path)
+                if stamp == certificate.stamp:
+                    continue
+                pem = self._load(certificate.path)
+            except Exception:
+                logger.exception('Could not reload certificate of %s from %s',
+                                 appId, certificate.path)
+                continue
+
+            certificate.stamp = stamp
+            if pem == certificate.pem:
+                continue
+            certificate.pem = pem
+            logger.info('Reloaded certificate of %s', appId)
+            for listener in self._listeners:
+                listener(appId, pem)
+
+    def start(self, interval=30):
+        """Check certificate files for changes every `interval` seconds."""
+        self._loop.start(interval, now=False)
+
+    def stop(self):
+        """Stop checking certificate files for changes."""
+        if self._loop.running:
+            self._loop.stop()
+
+    @staticmethod
+    def _stamp(path):
+        stat = os.stat(path)
+        return stat.st_mtime, stat.st_size
+
+    @staticmethod
+    def _load(path):
+        with io.open(path, 'rb') as f:
+            pem = f.read()
+        PrivateCertificate.loadPEM(pem)
+        return pem
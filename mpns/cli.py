@@ -0,0 +1,294 @@
+"""
+Sends notifications described in a JSONL file through the MPNS gateway,
+writing the result of every line to an output JSONL file.
+
+Each input line is a JSON object with "type" (one of "raw", "toast", "tile",
+"flip", "iconic" and "cycle", defaulting to "raw"), "uri", and optionally
+"priority" (e.g. "deliver_within_450_s"), "uuid" and fields of the
+notification type, e.g. "text1", "text2", "param" and "sound" for toasts,
+"title", "count" and "background" for tiles, or "body" for raw
+notifications. Lines with other fields are reported as errors.
+
+Each output line holds the input line number and uri, and either the
+"notification", "subscription" and "device" statuses reported by the
+gateway, or the "error" class name and its "message". Results are written in
+completion order.
+
+Usage: python -m mpns [options] [input]
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import sys
+
+from twisted.internet.defer import inlineCallbacks
+from twisted.internet.task import react
+
+from mpns.exceptions import NotificationError
+from mpns.notifications import (
+    CycleTileNotification,
+    FlipTileNotification,
+    IconicTileNotification,
+    RawNotification,
+    ToastNotification,
+    TileNotification
+)
+from mpns.pusher import Pusher, sendMany
+
+
+NOTIFICATION_TYPES = {
+    'raw': RawNotification,
+    'toast': ToastNotification,
+    'tile': TileNotification,
+    'flip': FlipTileNotification,
+    'iconic': IconicTileNotification,
+    'cycle': CycleTileNotification
+}
+
+# Fields accepted by notifications of every type, besides "type" and "uri".
+COMMON_FIELDS = ('priority', 'uuid')
+
+
+def _templateFields(cls):
+    return ('tileId',) + tuple(field for field, _ in cls.SCHEMA)
+
+
+# Fields accepted by notifications of given type, besides COMMON_FIELDS.
+NOTIFICATION_FIELDS = {
+    'raw': ('body',),
+    'toast': ('text1', 'text2', 'param', 'sound'),
+    'tile': ('title', 'count', 'background'),
+    'flip': _templateFields(FlipTileNotification),
+    'iconic': _templateFields(IconicTileNotification),
+    'cycle': _templateFields(CycleTileNotification) + ('images',)
+}
+
+
+def notificationFromSpec(spec):
+    """
+    Return notification described by a decoded JSON object. Raise
+    NotificationError if the description is invalid.
+    """
+    if not isinstance(spec, dict):
+        raise NotificationError('Notification spec must be an object')
+    spec = dict(spec)
+    notificationType = spec.pop('type', 'raw')
+    cls = NOTIFICATION_TYPES.get(notificationType)
+    if cls is None:
+        raise NotificationError('Unknown notification type')
+    unknown = set(spec) - set(('uri',) + COMMON_FIELDS +
+                              NOTIFICATION_FIELDS[notificationType])
+    if unknown:
+        raise NotificationError('Unknown notification fields: {0}'.format(
+            ', '.join(sorted(unknown))))
+    uri = spec.pop('uri', None)
+    if not uri:
+        raise NotificationError('Missing notification uri')
+    if not isinstance(uri, bytes):
+        uri = uri.encode('utf-8')
+    try:
+        notification = cls(uri, **spec)
+    except TypeError:
+        raise NotificationError('Invalid notification fields')
+    return notification
+
+
+def readLines(stream, offset=0):
+    """
+    Yield (offset, line) pairs of lines read from a binary stream, starting
+    at given byte offset, which must be the beginning of a line.
+    """
+    if offset:
+        try:
+            stream.seek(offset)
+        except (AttributeError, IOError):
+            skipped = 0
+            while skipped < offset:
+                line = stream.readline()
+                if not line:
+                    break
+                skipped += len(line)
+    for line in iter(stream.readline, b''):
+        yield offset, line
+        offset += len(line)
+
+
+class BatchSender(object):
+    """
+    Streams notifications described by JSONL lines through a pusher with
+    bounded concurrency, writing results to an output stream. Memory usage
+    does not depend on the number of lines.
+
+    A checkpoint, i.e. the offset and number of the first line whose result
+    has not been written yet, is saved every `checkpointEvery` results and at
+    the end, so that sending can be resumed from it. Lines after the
+    checkpoint whose results were already written are sent again on resume.
+
+    :param pusher: a Pusher (or RetryingPusher) used to send notifications.
+    :param output: a binary stream receiving result lines.
+    :param checkpoint: optional path of the checkpoint file.
+    :param checkpointEvery: number of results between checkpoints.
+    """
+
+    def __init__(self, pusher, output, concurrency=10, checkpoint=None,
+                 checkpointEvery=1000):
+        self._pusher = pusher
+        self._output = output
+        self._concurrency = concurrency
+        self._checkpoint = checkpoint
+        self._checkpointEvery = checkpointEvery
+        self._inFlight = {}
+        self._position = (0, 0)
+        self._written = 0
+        self.succeeded = 0
+        self.failed = 0
+
+    def loadCheckpoint(self):
+        """Return (offset, line number) saved in the checkpoint file."""
+        if self._checkpoint is None or not os.path.exists(self._checkpoint):
+            return 0, 0
+        with io.open(self._checkpoint, 'r', encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        return checkpoint['offset'], checkpoint['line']
+
+    def saveCheckpoint(self):
+        """Atomically write the current checkpoint to the checkpoint file."""
+        if self._checkpoint is None:
+            return
+        self._output.flush()
+        offset, number = self.position
+        temporary = self._checkpoint + '.tmp'
+        with io.open(temporary, 'w', encoding='utf-8') as f:
+            f.write(u'{{"offset": {0}, "line": {1}}}\n'.format(offset, number))
+        os.rename(temporary, self._checkpoint)
+
+    @property
+    def position(self):
+        """
+        Return (offset, line number) of the first line whose result has not
+        been written yet.
+        """
+        if self._inFlight:
+            return min(self._inFlight.values())
+        return self._position
+
+    def run(self, stream, offset=0, number=0):
+        """
+        Send notifications read from a binary stream, starting at given
+        offset and line number.
+
+        :return a Deferred firing with None when all lines are processed.
+        """
+        self._position = (offset, number)
+        d = sendMany(self._send, self._read(stream, offset, number),
+                     self._concurrency, self._sent)
+        d.addCallback(lambda _: self.saveCheckpoint())
+        return d
+
+    def _read(self, stream, offset, number):
+        for offset, line in readLines(stream, offset):
+            number += 1
+            self._position = (offset + len(line), number)
+            if not line.strip():
+                continue
+            try:
+                notification = notificationFromSpec(
+                    json.loads(line.decode('utf-8')))
+            except (ValueError, NotificationError) as e:
+                self._write(number, None, e)
+                continue
+            self._inFlight[number] = (offset, number - 1)
+            yield number, notification
+
+    def _send(self, item):
+        return self._pusher.send(item[1])
+
+    def _sent(self, item, result):
+        number, notification = item
+        del self._inFlight[number]
+        self._write(number, notification.requestUri, result)
+
+    def _write(self, number, uri, result):
+        record = {'line': number}
+        if uri is not None:
+            record['uri'] = uri.decode('utf-8')
+        if isinstance(result, Exception):
+            self.failed += 1
+            record['error'] = result.__class__.__name__
+            record['message'] = str(result)
+        else:
+            self.succeeded += 1
+            record.update(result._asdict())
+        self._output.write(json.dumps(record, sort_keys=True)
+                           .encode('utf-8') + b'\n')
+        self._written += 1
+        if self._written % self._checkpointEvery == 0:
+            self.saveCheckpoint()
+
+
+def parseArguments(argv):
+    parser = argparse.ArgumentParser(
+        prog='python -m mpns', description=__doc__.split('\n\n')[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog='\n\n'.join(__doc__.split('\n\n')[1:3]))
+    parser.add_argument('input', nargs='?', default='-',
+                        help='input JSONL file, standard input by default')
+    parser.add_argument('-o', '--output', default='-',
+                        help='output JSONL file, standard output by default')
+    parser.add_argument('--pem',
+                        help='file with PEM-formatted client certificate and '
+                             'private key, required for https subscriptions')
+    parser.add_argument('-c', '--concurrency', type=int, default=10,
+                        help='maximum number of simultaneous requests')
+    parser.add_argument('-t', '--timeout', type=float,
+                        help='number of seconds after which a request is '
+                             'given up and reported as RequestTimeoutError')
+    parser.add_argument('--checkpoint',
+                        help='file the position of processed lines is saved '
+                             'to, so that sending can be resumed')
+    parser.add_argument('--checkpoint-every', type=int, default=1000,
+                        metavar='N', help='save checkpoint every N results')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue from the checkpoint, appending to '
+                             'the output file')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args(argv)
+    if args.resume and args.checkpoint is None:
+        parser.error('--resume requires --checkpoint')
+    return args
+
+
+def _open(path, mode, standard):
+    if path == '-':
+        return getattr(standard, 'buffer', standard)
+    return io.open(path, mode)
+
+
+@inlineCallbacks
+def run(reactor, argv=None):
+    args = parseArguments(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else
+                        logging.WARNING)
+
+    pem = None
+    if args.pem is not None:
+        with io.open(args.pem, 'rb') as f:
+            pem = f.read()
+
+    stream = _open(args.input, 'rb', sys.stdin)
+    output = _open(args.output, 'ab' if args.resume else 'wb', sys.stdout)
+    pusher = Pusher(pem, timeout=args.timeout)
+    sender = BatchSender(pusher, output, args.concurrency, args.checkpoint,
+                         args.checkpoint_every)
+    offset, number = sender.loadCheckpoint() if args.resume else (0, 0)
+    yield sender.run(stream, offset, number)
+    output.flush()
+
+    sys.stderr.write('{0} sent, {1} failed\n'.format(sender.succeeded,
+                                                     sender.failed))
+
+
+def main(argv=None):
+    react(run, [argv])
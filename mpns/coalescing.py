@@ -0,0 +1,107 @@
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, maybeDeferred
+from twisted.python.failure import Failure
+
+
+TILE = 'token'
+TOAST = 'toast'
+RAW = None
+
+
+class _PendingNotification(object):
+
+    def __init__(self, notification, result):
+        self.notification = notification
+        self.results = [result]
+        self.timer = None
+
+
+class CoalescingPusher(object):
+    """
+    Sends notifications through a pusher, replacing pending notifications to
+    a subscription with newer ones of the same type and, for tile templates,
+    the same tileId, so that only the latest state is sent. Notifications are
+    kept back for `delay` seconds, and while a previous notification with the
+    same key is being sent; a notification arriving meanwhile supersedes the
+    pending one instead of being queued after it. Notification types not
+    listed in `targets` are sent directly.
+
+    :param pusher: a Pusher instance used to send notifications.
+    :param delay: number of seconds a notification waits for newer ones.
+    :param targets: notification types to be coalesced, identified by their
+    X-WindowsPhone-Target header: TILE, TOAST, or RAW for notifications
+    without the header.
+    """
+
+    def __init__(self, pusher, delay=1.0, targets=(TILE,), clock=reactor):
+        self._pusher = pusher
+        self._delay = delay
+        self._targets = frozenset(targets)
+        self._clock = clock
+        self._pending = {}
+        self._inFlight = set()
+        self.superseded = 0
+
+    @property
+    def pending(self):
+        """Return number of notifications waiting to be sent."""
+        return len(self._pending)
+
+    def send(self, notification):
+        """
+        Send a notification, unless it is superseded by a newer one with the
+        same subscription URI and type before being sent.
+
+        :return a Deferred firing with the result of the notification which
+        was finally sent in its place, i.e. a NotificationStatus or a failure.
+        """
+        key = self._key(notification)
+        if key is None:
+            return self._pusher.send(notification)
+
+        result = Deferred()
+        pending = self._pending.get(key)
+        if pending is not None:
+            pending.notification = notification
+            pending.results.append(result)
+            self.superseded += 1
+            return result
+
+        pending = self._pending[key] = _PendingNotification(notification,
+                                                            result)
+        if key not in self._inFlight:
+            pending.timer = self._clock.callLater(self._delay, self._dispatch,
+                                                  key)
+        return result
+
+    def flush(self):
+        """Send all pending notifications which are not waiting for others."""
+        for key, pending in list(self._pending.items()):
+            if pending.timer is not None:
+                pending.timer.cancel()
+                self._dispatch(key)
+
+    def _key(self, notification):
+        target = notification.requestHeaders.get('X-WindowsPhone-Target')
+        if target is not None:
+            target = target[0]
+        if target not in self._targets:
+            return None
+        return (notification.requestUri, target,
+                getattr(notification, 'tileId', None))
+
+    def _dispatch(self, key):
+        pending = self._pending.pop(key)
+        self._inFlight.add(key)
+        d = maybeDeferred(self._pusher.send, pending.notification)
+        d.addBoth(self._sent, key, pending)
+
+    def _sent(self, result, key, pending):
+        self._inFlight.discard(key)
+        if key in self._pending:
+            self._dispatch(key)
+        for d in pending.results:
+            if isinstance(result, Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
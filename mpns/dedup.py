@@ -0,0 +1,92 @@
+from collections import deque
+
+from twisted.internet import reactor
+from twisted.internet.defer import fail, maybeDeferred
+
+from mpns.exceptions import DuplicateNotificationError
+
+
+class DeduplicatingPusher(object):
+    """
+    Sends notifications through a pusher, suppressing repeated notifications
+    with the same subscription URI and X-MessageID header (the `uuid` of a
+    notification) seen within the last `window` seconds, e.g. when an
+    upstream queue replays messages after a failover. Notifications without
+    the header are always sent.
+
+    Keys are kept in a sliding window of `buckets` sets, each covering an
+    equal slice of the window, so that expired keys are dropped a whole set
+    at a time. At most `maxKeys` keys are remembered; the oldest sets are
+    dropped early if there are more. A key is forgotten when sending its
+    notification fails, so that it may be sent again.
+
+    :param pusher: a Pusher instance used to send notifications.
+    :param window: number of seconds a notification is remembered for.
+    :param buckets: number of sets the window is divided into.
+    :param maxKeys: maximum number of remembered notifications.
+    """
+
+    def __init__(self, pusher, window=3600.0, buckets=12, maxKeys=1000000,
+                 clock=reactor):
+        self._pusher = pusher
+        self._window = window
+        self._bucketLength = float(window) / buckets
+        self._maxKeys = maxKeys
+        self._clock = clock
+        self._buckets = deque()
+        self._size = 0
+        self.suppressed = 0
+
+    def __len__(self):
+        """Return number of remembered notifications."""
+        return self._size
+
+    def __contains__(self, key):
+        self._expire(self._clock.seconds())
+        return any(key in keys for _, keys in self._buckets)
+
+    def send(self, notification):
+        """
+        Send a notification, unless one with the same URI and X-MessageID has
+        already been sent within the window.
+
+        :return a Deferred firing with the result of the notification, or
+        failing with DuplicateNotificationError if it has been suppressed.
+        """
+        messageId = notification.requestHeaders.get('X-MessageID')
+        if messageId is None:
+            return self._pusher.send(notification)
+
+        key = (notification.requestUri, messageId[0])
+        if key in self:
+            self.suppressed += 1
+            return fail(DuplicateNotificationError('Duplicate notification',
+                                                   {'messageId': key[1]}))
+
+        self._add(key)
+        d = maybeDeferred(self._pusher.send, notification)
+        d.addErrback(self._failed, key)
+        return d
+
+    def _add(self, key):
+        while self._size >= self._maxKeys and self._buckets:
+            self._size -= len(self._buckets.popleft()[1])
+        now = self._clock.seconds()
+        if not self._buckets or \
+                self._buckets[-1][0] + self._bucketLength <= now:
+            self._buckets.append((now, set()))
+        self._buckets[-1][1].add(key)
+        self._size += 1
+
+    def _expire(self, now):
+        horizon = now - self._window - self._bucketLength
+        while self._buckets and self._buckets[0][0] <= horizon:
+            self._size -= len(self._buckets.popleft()[1])
+
+    def _failed(self, failure, key):
+        for _, keys in self._buckets:
+            if key in keys:
+                keys.discard(key)
+                self._size -= 1
+                break
+        return failure
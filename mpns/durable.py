@@ -0,0 +1,371 @@
+import base64
+import io
+import json
+import logging
+import os
+from collections import OrderedDict, deque
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, DeferredList, maybeDeferred
+from twisted.python.failure import Failure
+
+from mpns.exceptions import (
+    LoadSheddingError,
+    NotificationPusherError,
+    RequestTimeoutError
+)
+from mpns.notifications import PreparedNotification
+
+
+logger = logging.getLogger(__name__)
+
+
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.log'
+
+
+def _segmentName(number):
+    return '{0}{1:010d}{2}'.format(SEGMENT_PREFIX, number, SEGMENT_SUFFIX)
+
+
+def _segmentNumber(name):
+    if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+        number = name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]
+        if number.isdigit():
+            return int(number)
+    return None
+
+
+def _bytes(value):
+    if value is not None and not isinstance(value, bytes):
+        return value.encode('utf-8')
+    return value
+
+
+class _Entry(object):
+
+    __slots__ = ('id', 'uri', 'headers', 'body', 'segment', 'size')
+
+    def __init__(self, entryId, uri, headers, body, segment, size=0):
+        self.id = entryId
+        self.uri = uri
+        self.headers = headers
+        self.body = body
+        self.segment = segment
+        self.size = size
+
+    def record(self):
+        body = self.body
+        if body is not None:
+            body = base64.b64encode(body).decode('ascii')
+        return {'id': self.id, 'uri': self.uri.decode('utf-8'),
+                'headers': self.headers, 'body': body}
+
+    @classmethod
+    def fromRecord(cls, record, segment, size):
+        body = record['body']
+        if body is not None:
+            body = base64.b64decode(body)
+        return cls(record['id'], _bytes(record['uri']), record['headers'],
+                   body, segment, size)
+
+
+class DurableQueue(object):
+    """
+    Send queue persisted in an append-only log, giving at-least-once delivery
+    of notifications across pusher restarts.
+
+    The log is a directory of numbered segment files holding one JSON record
+    per line: either an enqueued notification or an acknowledgement of one.
+    Enqueued notifications are written to disk in groups with a single fsync
+    and are only sent once durable. A notification is acknowledged when the
+    gateway gave a definite answer, i.e. a NotificationStatus or a
+    NotificationPusherError; other failures, such as connection errors, load
+    shedding or timeouts, are retried after retryDelay. Use a RetryingPusher
+    to retry transient gateway errors as well.
+
+    Segments are rotated once they reach segmentSize bytes. Leading segments
+    whose notifications were all acknowledged are deleted. Once there are
+    more than maxSegments segments, unacknowledged notifications of the oldest
+    one are copied to the current segment if they take at most
+    compactFraction of its size, so a few stale entries do not pin the whole
+    log. A mostly unacknowledged backlog, e.g. while the gateway is
+    unreachable, is never copied, and the log grows instead. On start(),
+    unacknowledged notifications found in the log are replayed.
+
+    :param pusher: a Pusher (or RetryingPusher) used to send notifications.
+    :param path: directory holding log segments, created if missing.
+    :param concurrency: maximum number of notifications sent simultaneously.
+    :param callback: optional callable invoked as callback(notification,
+    result) when a notification is acknowledged, where result is either a
+    NotificationStatus or a NotificationPusherError.
+    :param syncInterval: maximum number of seconds enqueued notifications wait
+    for the group fsync.
+    :param syncBatch: number of enqueued notifications triggering an
+    immediate fsync.
+    :param segmentSize: size in bytes after which a new segment is started.
+    :param maxSegments: number of segments after which unacknowledged
+    notifications of the oldest one are moved forward.
+    :param compactFraction: maximum fraction of the oldest segment's size its
+    unacknowledged notifications may take to be moved forward.
+    :param retryDelay: number of seconds to wait before resending a
+    notification which failed without a gateway answer.
+
+    :ivar bytesWritten: number of bytes written to the log.
+    """
+
+    def __init__(self, pusher, path, concurrency=10, callback=None,
+                 syncInterval=0.01, syncBatch=256, segmentSize=16 * 1024 ** 2,
+                 maxSegments=8, compactFraction=0.25, retryDelay=5.0,
+                 clock=reactor):
+        self._pusher = pusher
+        self._path = path
+        self._concurrency = concurrency
+        self._callback = callback
+        self._syncInterval = syncInterval
+        self._syncBatch = syncBatch
+        self._segmentSize = segmentSize
+        self._maxSegments = maxSegments
+        self._compactFraction = compactFraction
+        self._retryDelay = retryDelay
+        self._clock = clock
+
+        self._entries = OrderedDict()
+        self._ready = deque()
+        self._running = {}
+        # Bytes taken by unacknowledged notifications, and the total size,
+        # of every segment on disk.
+        self._live = OrderedDict()
+        self._sizes = {}
+        self._nextId = 0
+        self._file = None
+        self._segment = None
+        self._unsynced = []
+        self._syncTimer = None
+        self._started = False
+        self._pumping = False
+        self.bytesWritten = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def inFlight(self):
+        """Return number of notifications currently being sent."""
+        return len(self._running)
+
+    @property
+    def segments(self):
+        """Return numbers of log segments currently on disk."""
+        return list(self._live)
+
+    def start(self):
+        """
+        Replay unacknowledged notifications from the log and start sending.
+        """
+        if not os.path.isdir(self._path):
+            os.makedirs(self._path)
+        numbers = sorted(number for number in
+                         map(_segmentNumber, os.listdir(self._path))
+                         if number is not None)
+        for number in numbers:
+            self._live[number] = 0
+            self._sizes[number] = self._replay(number)
+        for entry in self._entries.values():
+            self._live[entry.segment] += entry.size
+            self._ready.append(entry)
+
+        self._openSegment(numbers[-1] + 1 if numbers else 0)
+        self._releaseSegments()
+        self._started = True
+        logger.debug('Replayed %i unacknowledged notifications',
+                     len(self._entries))
+        self._pump()
+
+    def stop(self):
+        """
+        Stop sending and close the log. Notifications which are being sent are
+        waited for, remaining ones are kept for the next start().
+
+        :return a Deferred firing with None once the log is closed.
+        """
+        self._started = False
+        d = DeferredList(list(self._running.values()))
+        d.addCallback(lambda _: self._close())
+        return d
+
+    def enqueue(self, notification):
+        """
+        Append a notification to the log. It will be sent as soon as it is
+        written to disk. The queue must be started.
+
+        :return a Deferred firing with None once the notification is durable.
+        """
+        entryId = self._nextId
+        self._nextId += 1
+        entry = _Entry(entryId, _bytes(notification.requestUri),
+                       notification.requestHeaders,
+                       _bytes(notification.requestBody), self._segment)
+        self._entries[entryId] = entry
+        self._writeEntry(entry)
+
+        d = Deferred()
+        self._unsynced.append((entry, d))
+        if len(self._unsynced) >= self._syncBatch:
+            self.sync()
+        elif self._syncTimer is None:
+            self._syncTimer = self._clock.callLater(self._syncInterval,
+                                                    self.sync)
+        return d
+
+    def sync(self):
+        """
+        Write all buffered records to disk and schedule notifications enqueued
+        since the last call for sending.
+        """
+        if self._syncTimer is not None:
+            if self._syncTimer.active():
+                self._syncTimer.cancel()
+            self._syncTimer = None
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+        synced, self._unsynced = self._unsynced, []
+        self._ready.extend(entry for entry, _ in synced)
+        for _, d in synced:
+            d.callback(None)
+        self._rotate()
+        self._pump()
+
+    def _replay(self, number):
+        """Read records of a segment, returning its size."""
+        path = os.path.join(self._path, _segmentName(number))
+        size = 0
+        with io.open(path, 'rb') as f:
+            for line in f:
+                size += len(line)
+                try:
+                    record = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    logger.warning('Skipping corrupted record in %s', path)
+                    continue
+                if 'ack' in record:
+                    self._entries.pop(record['ack'], None)
+                else:
+                    entryId = record['id']
+                    self._entries.pop(entryId, None)
+                    self._entries[entryId] = _Entry.fromRecord(
+                        record, number, len(line))
+                    self._nextId = max(self._nextId, entryId + 1)
+        return size
+
+    def _openSegment(self, number):
+        path = os.path.join(self._path, _segmentName(number))
+        self._file = io.open(path, 'ab')
+        self._segment = number
+        self._live.setdefault(number, 0)
+
+    def _write(self, record):
+        line = json.dumps(record, separators=(',', ':')).encode('utf-8')
+        self._file.write(line + b'\n')
+        self.bytesWritten += len(line) + 1
+        return len(line) + 1
+
+    def _writeEntry(self, entry):
+        entry.segment = self._segment
+        entry.size = self._write(entry.record())
+        self._live[self._segment] += entry.size
+
+    def _rotate(self):
+        if self._file.tell() < self._segmentSize:
+            return
+        self._sizes[self._segment] = self._file.tell()
+        self._file.close()
+        self._openSegment(self._segment + 1)
+        self._releaseSegments()
+
+    def _releaseSegments(self):
+        """
+        Delete leading segments without unacknowledged notifications, moving
+        notifications of the oldest segments forward if there are too many.
+        Acknowledgements always follow their notifications in the log, so the
+        remaining segments never depend on deleted ones.
+        """
+        while len(self._live) > 1:
+            number, live = next(iter(self._live.items()))
+            if live:
+                if len(self._live) <= self._maxSegments or \
+                        live > self._sizes[number] * self._compactFraction:
+                    break
+                self._moveForward(number)
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            del self._live[number]
+            del self._sizes[number]
+            os.remove(os.path.join(self._path, _segmentName(number)))
+
+    def _moveForward(self, number):
+        for entry in self._entries.values():
+            if entry.segment == number:
+                self._writeEntry(entry)
+
+    def _pump(self):
+        # Sends completing synchronously end up here again through _sent,
+        # their successors are picked up by the loop already running instead.
+        if self._pumping:
+            return
+        self._pumping = True
+        try:
+            while self._started and self._ready and \
+                    len(self._running) < self._concurrency:
+                entry = self._ready.popleft()
+                if self._entries.get(entry.id) is not entry or \
+                        entry.id in self._running:
+                    continue
+                notification = PreparedNotification(entry.uri, entry.headers,
+                                                    entry.body)
+                d = maybeDeferred(self._pusher.send, notification)
+                self._running[entry.id] = d
+                d.addBoth(self._sent, entry.id, notification)
+        finally:
+            self._pumping = False
+
+    def _sent(self, result, entryId, notification):
+        del self._running[entryId]
+        if isinstance(result, Failure):
+            error = result.value
+            if not isinstance(error, NotificationPusherError) or \
+                    isinstance(error, (LoadSheddingError,
+                                       RequestTimeoutError)):
+                logger.warning('Sending failed, retrying: %s', error)
+                self._clock.callLater(self._retryDelay, self._retry, entryId)
+                self._pump()
+                return
+            result = error
+
+        self._acknowledge(entryId)
+        if self._callback is not None:
+            try:
+                self._callback(notification, result)
+            except Exception:
+                logger.exception('Result callback failed')
+        self._pump()
+
+    def _retry(self, entryId):
+        entry = self._entries.get(entryId)
+        if entry is not None:
+            self._ready.append(entry)
+            self._pump()
+
+    def _acknowledge(self, entryId):
+        entry = self._entries.pop(entryId)
+        self._write({'ack': entryId})
+        self._live[entry.segment] -= entry.size
+        self._releaseSegments()
+
+    def _close(self):
+        if self._file is None:
+            return
+        self.sync()
+        self._file.close()
+        self._file = None
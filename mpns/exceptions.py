@@ -53,3 +53,25 @@ class ThrottlingLimitError(DeliveryError):
     limit for a subscription, or when a pusher (authenticated or
     unauthenticated) has sent too many notifications per second.
     """
+
+
+class LoadSheddingError(NotificationPusherError):
+    """
+    Raised when a notification was rejected without contacting the gateway,
+    because too many notifications were already waiting to be sent.
+    """
+
+
+class RequestTimeoutError(NotificationPusherError):
+    """
+    Raised when the gateway did not respond within the configured timeout and
+    the request was cancelled. The notification may or may not have been
+    delivered.
+    """
+
+
+class DuplicateNotificationError(NotificationPusherError):
+    """
+    Raised when a notification was not sent, because one with the same
+    subscription URI and message ID had already been sent recently.
+    """
@@ -0,0 +1,85 @@
+import io
+import os
+from collections import OrderedDict
+
+from twisted.internet import reactor
+
+
+class ExpiredSubscriptionCache(object):
+    """
+    Bounded in-memory set of subscription URIs the gateway reported as
+    expired, allowing to fail fast instead of sending further notifications
+    to them. The least recently used URIs are evicted when the cache is full.
+
+    :param maxSize: maximum number of URIs kept in the cache.
+    :param ttl: optional number of seconds after which a URI is forgotten.
+    :param path: optional path of a file the cache is loaded from upon
+    creation and saved to with save().
+    :param onExpired: optional callable receiving lists of newly expired URIs,
+    e.g. to remove them from a database in batches.
+    :param batchSize: number of newly expired URIs collected before onExpired
+    is called. Remaining ones are passed on flush().
+    """
+
+    def __init__(self, maxSize=100000, ttl=None, path=None, onExpired=None,
+                 batchSize=100, clock=reactor):
+        self._maxSize = maxSize
+        self._ttl = ttl
+        self._path = path
+        self._onExpired = onExpired
+        self._batchSize = batchSize
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._batch = []
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, uri):
+        added = self._entries.pop(uri, None)
+        if added is None:
+            return False
+        if self._ttl is not None and \
+                added + self._ttl <= self._clock.seconds():
+            return False
+        self._entries[uri] = added
+        return True
+
+    def add(self, uri, added=None):
+        """Mark subscription URI as expired."""
+        if added is None:
+            added = self._clock.seconds()
+        known = self._entries.pop(uri, None) is not None
+        self._entries[uri] = added
+        if len(self._entries) > self._maxSize:
+            self._entries.popitem(last=False)
+
+        if not known and self._onExpired is not None:
+            self._batch.append(uri)
+            if len(self._batch) >= self._batchSize:
+                self.flush()
+
+    def flush(self):
+        """Pass all collected newly expired URIs to onExpired callback."""
+        if self._batch:
+            batch, self._batch = self._batch, []
+            self._onExpired(batch)
+
+    def load(self):
+        """Read expired URIs from the file given upon creation."""
+        with io.open(self._path, 'r', encoding='utf-8') as f:
+            for line in f:
+                added, uri = line.rstrip('\n').split(' ', 1)
+                self._entries[uri] = float(added)
+                if len(self._entries) > self._maxSize:
+                    self._entries.popitem(last=False)
+
+    def save(self):
+        """Atomically write expired URIs to the file given upon creation."""
+        temporary = self._path + '.tmp'
+        with io.open(temporary, 'w', encoding='utf-8') as f:
+            for uri, added in self._entries.items():
+                f.write(u'{0!r} {1}\n'.format(added, uri))
+        os.rename(temporary, self._path)
@@ -0,0 +1,184 @@
+from bisect import bisect_left
+
+from zope.interface import Interface, implementer
+
+from twisted.internet import reactor
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+
+
+def _escapeLabel(value):
+    """Escape a label value as required by the Prometheus text format."""
+    return ('{0}'.format(value).replace('\\', '\\\\')
+            .replace('"', '\\"').replace('\n', '\\n'))
+
+
+class IPusherMetrics(Interface):
+    """
+    Receives instrumentation events from Pusher.
+    """
+
+    def requestStarted():
+        """Called when sending of a notification starts."""
+
+    def phaseCompleted(phase, duration):
+        """
+        Called when a phase of sending a notification completes.
+
+        :param phase: 'connect' for establishing a new connection (TCP
+        connection and TLS setup), 'request' for obtaining a connection and
+        writing the request, 'response' for waiting for the response headers
+        (including TLS handshake of a new HTTPS connection).
+        :param duration: phase duration in seconds.
+        """
+
+    def requestFinished(outcome, status, duration):
+        """
+        Called when sending of a notification is finished.
+
+        :param outcome: notification status reported by the gateway for
+        accepted notifications, otherwise name of the raised exception class.
+        :param status: NotificationStatus extracted from the response, or None
+        if no valid response was received.
+        :param duration: total time spent sending the notification.
+        """
+
+
+@implementer(IPusherMetrics)
+class NullMetrics(object):
+    """Metrics implementation discarding all events."""
+
+    def requestStarted(self):
+        pass
+
+    def phaseCompleted(self, phase, duration):
+        pass
+
+    def requestFinished(self, outcome, status, duration):
+        pass
+
+
+class Histogram(object):
+    """
+    Cumulative histogram with fixed bucket upper bounds.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulativeCounts(self):
+        total = 0
+        for count in self.counts:
+            total += count
+            yield total
+
+
+@implementer(IPusherMetrics)
+class Metrics(object):
+    """
+    In-memory metrics collector: counters of outcomes and response statuses,
+    latency histograms per phase and a gauge of requests in flight.
+    """
+
+    LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                       5.0, 10.0, 30.0)
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self._buckets = buckets
+        self.inFlight = 0
+        self.outcomes = {}
+        self.statuses = {}
+        self.latencies = {}
+
+    def requestStarted(self):
+        self.inFlight += 1
+
+    def phaseCompleted(self, phase, duration):
+        self._observe(phase, duration)
+
+    def requestFinished(self, outcome, status, duration):
+        self.inFlight -= 1
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        if status is not None:
+            for key in zip(status._fields, status):
+                self.statuses[key] = self.statuses.get(key, 0) + 1
+        self._observe('total', duration)
+
+    def _observe(self, phase, duration):
+        histogram = self.latencies.get(phase)
+        if histogram is None:
+            histogram = self.latencies[phase] = Histogram(self._buckets)
+        histogram.observe(duration)
+
+    def prometheusText(self):
+        """Return collected metrics in Prometheus text exposition format."""
+        lines = [
+            '# HELP mpns_requests_in_flight Notifications being sent.',
+            '# TYPE mpns_requests_in_flight gauge',
+            'mpns_requests_in_flight {0}'.format(self.inFlight),
+            '# HELP mpns_notifications_total Sent notifications by outcome.',
+            '# TYPE mpns_notifications_total counter'
+        ]
+        for outcome, count in sorted(self.outcomes.items()):
+            lines.append('mpns_notifications_total{{outcome="{0}"}} {1}'
+                         .format(_escapeLabel(outcome), count))
+
+        lines.extend([
+            '# HELP mpns_statuses_total Statuses reported by the gateway.',
+            '# TYPE mpns_statuses_total counter'
+        ])
+        for (field, value), count in sorted(self.statuses.items()):
+            lines.append('mpns_statuses_total{{field="{0}",value="{1}"}} {2}'
+                         .format(_escapeLabel(field), _escapeLabel(value),
+                                 count))
+
+        lines.extend([
+            '# HELP mpns_latency_seconds Duration of sending phases.',
+            '# TYPE mpns_latency_seconds histogram'
+        ])
+        for phase, histogram in sorted(self.latencies.items()):
+            phase = _escapeLabel(phase)
+            bounds = [repr(b) for b in histogram.buckets] + ['+Inf']
+            for bound, count in zip(bounds, histogram.cumulativeCounts()):
+                lines.append('mpns_latency_seconds_bucket'
+                             '{{phase="{0}",le="{1}"}} {2}'
+                             .format(phase, bound, count))
+            lines.append('mpns_latency_seconds_sum{{phase="{0}"}} {1!r}'
+                         .format(phase, histogram.sum))
+            lines.append('mpns_latency_seconds_count{{phase="{0}"}} {1}'
+                         .format(phase, histogram.count))
+
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsResource(Resource):
+    """Web resource exposing Metrics in Prometheus text format."""
+
+    isLeaf = True
+
+    def __init__(self, metrics):
+        Resource.__init__(self)
+        self._metrics = metrics
+
+    def render_GET(self, request):
+        request.setHeader('Content-Type', 'text/plain; version=0.0.4')
+        return self._metrics.prometheusText()
+
+
+def listenMetrics(metrics, port, interface='127.0.0.1'):
+    """
+    Serve metrics in Prometheus text format over HTTP.
+
+    :return the listening port.
+    """
+    site = Site(MetricsResource(metrics))
+    site.noisy = False
+    return reactor.listenTCP(port, site, interface=interface)
@@ -0,0 +1,120 @@
+from collections import deque
+
+from twisted.internet.defer import Deferred, maybeDeferred
+from twisted.python.failure import Failure
+
+from mpns.pusher import sendMany
+from mpns.utils import gatewayHost
+
+
+class _Host(object):
+
+    def __init__(self, key):
+        self.key = key
+        self.queue = deque()
+        self.inFlight = 0
+        self.ready = False
+
+
+class MultiplexingPusher(object):
+    """
+    Sends notifications through a pusher, grouped by gateway host. Each host
+    has its own queue, and at most `connectionsPerHost` requests to a host
+    are in flight, so that requests follow each other back-to-back on the
+    persistent connections kept by the pusher's pool, instead of opening
+    surplus connections which are closed again once the pool is full. Hosts
+    with queued notifications take turns, so a backlog for one host does not
+    delay notifications to others.
+
+    Requests are not pipelined: Twisted's HTTP client sends a request on a
+    connection only after the previous response has been received.
+
+    :param pusher: a Pusher instance used to send notifications. Its
+    maxConnectionsPerHost should be at least `connectionsPerHost`.
+    :param connectionsPerHost: maximum number of simultaneous requests to
+    one gateway host.
+    :param concurrency: optional maximum number of simultaneous requests to
+    all hosts.
+    """
+
+    def __init__(self, pusher, connectionsPerHost=2, concurrency=None):
+        self._pusher = pusher
+        self._connectionsPerHost = connectionsPerHost
+        self._concurrency = concurrency
+        self._hosts = {}
+        self._ready = deque()
+        self._inFlight = 0
+        self._dispatching = False
+
+    @property
+    def depths(self):
+        """Return number of queued notifications, keyed by host."""
+        return dict((key, len(host.queue))
+                    for key, host in self._hosts.items() if host.queue)
+
+    @property
+    def inFlight(self):
+        """Return number of notifications currently being sent."""
+        return self._inFlight
+
+    def send(self, notification):
+        """
+        Queue a notification for sending to its gateway host.
+
+        :return a Deferred firing with the result of Pusher.send.
+        """
+        key = gatewayHost(notification.requestUri)
+        host = self._hosts.get(key)
+        if host is None:
+            host = self._hosts[key] = _Host(key)
+        result = Deferred()
+        host.queue.append((notification, result))
+        self._schedule(host)
+        self._dispatch()
+        return result
+
+    def sendMany(self, notifications, concurrency=10, callback=None):
+        """
+        Send notifications taken lazily from an iterable, keeping at most
+        `concurrency` of them queued or in flight. See Pusher.sendMany.
+        """
+        return sendMany(self.send, notifications, concurrency, callback)
+
+    def _schedule(self, host):
+        if not host.ready and host.queue and \
+                host.inFlight < self._connectionsPerHost:
+            host.ready = True
+            self._ready.append(host)
+
+    def _dispatch(self):
+        # Sends completing synchronously end up here again through _sent,
+        # they are picked up by the loop already running instead.
+        if self._dispatching:
+            return
+        self._dispatching = True
+        try:
+            while self._ready and (self._concurrency is None or
+                                   self._inFlight < self._concurrency):
+                host = self._ready.popleft()
+                host.ready = False
+                notification, result = host.queue.popleft()
+                host.inFlight += 1
+                self._inFlight += 1
+                self._schedule(host)
+                d = maybeDeferred(self._pusher.send, notification)
+                d.addBoth(self._sent, host, result)
+        finally:
+            self._dispatching = False
+
+    def _sent(self, response, host, result):
+        host.inFlight -= 1
+        self._inFlight -= 1
+        if host.inFlight == 0 and not host.queue:
+            del self._hosts[host.key]
+        else:
+            self._schedule(host)
+        self._dispatch()
+        if isinstance(response, Failure):
+            result.errback(response)
+        else:
+            result.callback(response)
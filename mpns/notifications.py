@@ -5,6 +5,105 @@ DELIVER_IMMEDIATELY = 'deliver_immediately'
 DELIVER_WITHIN_450_S = 'deliver_within_450_s'
 DELIVER_WITHIN_950_S = 'deliver_within_950_s'
 
+# Value clearing a property of a tile template, e.g. backContent=CLEAR.
+CLEAR = object()
+
+# Maximum size of a notification payload accepted by the gateway, in bytes.
+MAX_PAYLOAD_SIZE = 3072
+
+
+# Headers tables shared by all notifications of the same type and priority,
+# keyed by (notification class, priority).
+_HEADER_TABLES = {}
+
+# Names of all slots of notification classes, including inherited ones, and
+# whether their instances have a __dict__, keyed by notification class.
+_SLOT_NAMES = {}
+
+# Encoded opening and closing tags of XML elements, keyed by element name.
+_TAGS = {}
+
+# Compiled schemas of tile templates, keyed by notification class. See
+# _TemplateTileNotification._compiled.
+_SCHEMAS = {}
+
+# Encoded beginnings and endings of XML documents, together with the number
+# of markup characters '<' in both, keyed by (notification class, root node
+# name).
+_FRAMES = {}
+
+try:
+    _unicode = unicode
+except NameError:
+    _unicode = str
+
+
+def _encodeBody(body):
+    """Return request body encoded to UTF-8 bytes."""
+    if body is None or isinstance(body, bytes):
+        return body
+    return body.encode('utf-8')
+
+
+def _utf8(value):
+    """Return UTF-8 encoded representation of a value."""
+    if isinstance(value, bytes):
+        return value
+    if not isinstance(value, _unicode):
+        value = _unicode(value)
+    return value.encode('utf-8')
+
+
+def _escape(value):
+    """Return escaped and UTF-8 encoded XML element value."""
+    value = _utf8(value)
+    if b'&' in value or b'<' in value or b'>' in value:
+        value = value.replace(b'&', b'&amp;').replace(
+            b'<', b'&lt;').replace(b'>', b'&gt;')
+    return value
+
+
+def _escapeAttribute(value):
+    return _escape(value).replace(b'"', b'&quot;')
+
+
+class _HeaderTable(dict):
+    """
+    Read-only table of additional request headers, mapping names to tuples of
+    values. Tables are shared by many notifications, so modifying one raises
+    TypeError instead of silently changing headers of other notifications.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, headers=()):
+        dict.__init__(self, ((name, tuple(values))
+                             for name, values in dict(headers).items()))
+
+    def __reduce__(self):
+        return self.__class__, (dict(self),)
+
+    def _readOnly(self, *args, **kwargs):
+        raise TypeError('Header tables are read-only')
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = \
+        update = _readOnly
+
+
+def _checkSize(body):
+    if body is not None and len(body) > MAX_PAYLOAD_SIZE:
+        raise NotificationError(
+            'Payload of {0} bytes exceeds the limit of {1} bytes'.format(
+                len(body), MAX_PAYLOAD_SIZE))
+
+
+def _tags(name):
+    tags = _TAGS.get(name)
+    if tags is None:
+        tags = _TAGS[name] = (_utf8(u'<wp:{0}>'.format(name)),
+                              _utf8(u'</wp:{0}>'.format(name)))
+    return tags
+
 
 class RawNotification(object):
     """
@@ -16,18 +115,25 @@ class RawNotification(object):
     DELIVER_WITHIN_450_S, or DELIVER_WITHIN_950_S.
     :param uuid: an optional UUID uniquely identifying the notification message
     :param body: a string containing payload to be sent within HTTP request.
-    The structure of the payload is freely definable.
+    The structure of the payload is freely definable. Unicode payload is
+    encoded to UTF-8. NotificationError is raised if the payload exceeds
+    MAX_PAYLOAD_SIZE bytes.
     """
 
+    __slots__ = ('_uri', '_priority', '_body', '_headers')
+
     CLASS_HEADERS = {DELIVER_IMMEDIATELY: '3', DELIVER_WITHIN_450_S: '13',
                      DELIVER_WITHIN_950_S: '23'}
 
+    # Headers sent with every notification of given type.
+    STATIC_HEADERS = ()
+
     def __init__(self, uri, **kwargs):
         self._uri = uri
         self._priority = kwargs.get('priority', DELIVER_IMMEDIATELY)
-        self._body = kwargs.get('body')
-        self._headers = {}
-        self._setHeader('X-NotificationClass', self._classHeader())
+        self._body = _encodeBody(kwargs.get('body'))
+        _checkSize(self._body)
+        self._headers = self._headerTable()
         if 'uuid' in kwargs:
             self._setHeader('X-MessageID', kwargs['uuid'])
 
@@ -43,12 +149,57 @@ class RawNotification(object):
 
     @property
     def requestHeaders(self):
-        """Return additional headers to be appended to HTTP request."""
+        """
+        Return additional headers to be appended to HTTP request, as a
+        read-only mapping of names to tuples of values. The table may be
+        shared with other notifications.
+        """
         return self._headers
 
+    def forUri(self, uri):
+        """
+        Return a copy of this notification addressed to another subscription
+        URI. Body and headers are not formatted again, but shared with this
+        notification, so one prepared notification may be cheaply broadcast to
+        many devices. Shared parts should not be modified afterwards.
+        """
+        cls = self.__class__
+        clone = cls.__new__(cls)
+        layout = _SLOT_NAMES.get(cls)
+        if layout is None:
+            names = tuple(name for klass in cls.__mro__
+                          for name in klass.__dict__.get('__slots__', ()))
+            layout = _SLOT_NAMES[cls] = (names, hasattr(clone, '__dict__'))
+        names, hasDict = layout
+        for name in names:
+            setattr(clone, name, getattr(self, name, None))
+        if hasDict:
+            clone.__dict__.update(self.__dict__)
+        clone._uri = uri
+        return clone
+
+    def _headerTable(self):
+        """
+        Return headers table shared by notifications of this type and
+        priority.
+        """
+        key = (self.__class__, self._priority)
+        table = _HEADER_TABLES.get(key)
+        if table is None:
+            headers = dict((name, (value,))
+                           for name, value in self.STATIC_HEADERS)
+            headers['X-NotificationClass'] = (self._classHeader(),)
+            table = _HEADER_TABLES[key] = _HeaderTable(headers)
+        return table
+
     def _setHeader(self, name, value):
-        """Assign new value to additional headers table"""
-        self._headers[name] = [value]
+        """
+        Assign new value to additional headers, replacing the shared table
+        with a copy of its own.
+        """
+        headers = dict(self._headers)
+        headers[name] = (value,)
+        self._headers = _HeaderTable(headers)
 
     def _classHeader(self):
         """
@@ -63,20 +214,50 @@ class RawNotification(object):
             return self.CLASS_HEADERS[self._priority]
 
 
+class PreparedNotification(RawNotification):
+    """
+    Notification rebuilt from already formatted request parts, e.g. after
+    being passed to another process or read from disk.
+
+    :param uri: unique device URI.
+    :param headers: additional request headers, mapping names to sequences
+    of values, as returned by requestHeaders.
+    :param body: request body, as returned by requestBody.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, uri, headers, body=None):
+        self._uri = uri
+        self._priority = None
+        if not isinstance(headers, _HeaderTable):
+            headers = _HeaderTable(headers)
+        self._headers = headers
+        self._body = _encodeBody(body)
+
+
 class XmlNotification(RawNotification):
     """
     A base class for XML-based notification formatters. Generally should not
-    be instantiated standalone.
+    be instantiated standalone. Elements added with _addElement are released
+    once rendered by _updateBody. Element values are escaped, and
+    NotificationError is raised if the rendered payload exceeds
+    MAX_PAYLOAD_SIZE bytes.
     """
 
+    __slots__ = ('_node', '_elements')
+
+    STATIC_HEADERS = (('Content-Type', 'text/xml'),)
+
     def __init__(self, node, uri, **kwargs):
         super(XmlNotification, self).__init__(uri, **kwargs)
-        self._setHeader('Content-Type', 'text/xml')
         self._node = node
-        self._elements = []
+        self._elements = None
 
     def _addElement(self, name, value):
         if value is not None:
+            if self._elements is None:
+                self._elements = []
             self._elements.append((name, value))
 
     XML_HEADER = ('<?xml version=\"1.0\" encoding=\"utf-8\"?>'
@@ -86,16 +267,45 @@ class XmlNotification(RawNotification):
     XML_FOOTER = ('</wp:{0}>'
                   '</wp:Notification>')
 
-    def _updateBody(self):
-        xml = [self.XML_HEADER.format(self._node)]
+    def _frame(self):
+        """
+        Return encoded beginning and ending of the XML document, and the
+        number of tags in both.
+        """
+        key = (self.__class__, self._node)
+        frame = _FRAMES.get(key)
+        if frame is None:
+            header = _utf8(self.XML_HEADER.format(self._node))
+            footer = _utf8(self.XML_FOOTER.format(self._node))
+            frame = _FRAMES[key] = (header, footer,
+                                    header.count(b'<') + footer.count(b'<'))
+        return frame
 
-        for e in self._elements:
-            name, value = e
-            xml.append('<wp:{0}>{1}</wp:{0}>'.format(name, value))
+    def _render(self, header, footer, encode):
+        xml = [header]
 
-        xml.append(self.XML_FOOTER.format(self._node))
+        for name, value in self._elements or ():
+            opening, closing = _tags(name)
+            xml.extend((opening, encode(value), closing))
 
-        self._body = ''.join(xml)
+        xml.append(footer)
+        return b''.join(xml)
+
+    def _updateBody(self):
+        # Values are rendered unescaped first. If the document contains no
+        # '&' and no more '<' or '>' characters than its own tags, no value
+        # needs escaping, which is checked by a few scans of the whole body
+        # instead of three per value.
+        header, footer, tags = self._frame()
+        body = self._render(header, footer, _utf8)
+        tags += 2 * len(self._elements or ())
+        if b'&' in body or body.count(b'<') != tags or \
+                body.count(b'>') != tags:
+            body = self._render(header, footer, _escape)
+
+        self._body = body
+        self._elements = None
+        _checkSize(self._body)
 
 
 class ToastNotification(XmlNotification):
@@ -115,12 +325,16 @@ class ToastNotification(XmlNotification):
     arrives
     """
 
+    __slots__ = ()
+
     CLASS_HEADERS = {DELIVER_IMMEDIATELY: '2', DELIVER_WITHIN_450_S: '12',
                      DELIVER_WITHIN_950_S: '22'}
 
+    STATIC_HEADERS = XmlNotification.STATIC_HEADERS + (
+        ('X-WindowsPhone-Target', 'toast'),)
+
     def __init__(self, uri, **kwargs):
         super(ToastNotification, self).__init__('Toast', uri, **kwargs)
-        self._setHeader('X-WindowsPhone-Target', 'toast')
         self._addElement('Text1', kwargs.get('text1'))
         self._addElement('Text2', kwargs.get('text2'))
         self._addElement('Param', kwargs.get('param'))
@@ -140,17 +354,210 @@ class TileNotification(XmlNotification):
     :param title: title of the tile
     :param count: count to be displayed on the tile
     :param background: optional URI to a background image of the tile
+
+    See FlipTileNotification, IconicTileNotification and CycleTileNotification
+    for tile templates with more options.
     """
 
-    # TODO: support for more advanced tile options
+    __slots__ = ()
 
     CLASS_HEADERS = {DELIVER_IMMEDIATELY: '1', DELIVER_WITHIN_450_S: '11',
                      DELIVER_WITHIN_950_S: '21'}
 
+    STATIC_HEADERS = XmlNotification.STATIC_HEADERS + (
+        ('X-WindowsPhone-Target', 'token'),)
+
     def __init__(self, uri, **kwargs):
         super(TileNotification, self).__init__('Tile', uri, **kwargs)
-        self._setHeader('X-WindowsPhone-Target', 'token')
         self._addElement('Title', kwargs.get('title'))
         self._addElement('Count', kwargs.get('count'))
         self._addElement('BackgroundImage', kwargs.get('background'))
         self._updateBody()
+
+
+class _TemplateTileNotification(XmlNotification):
+    """
+    A base class for formatters of Windows Phone 8 tile templates. Elements
+    are declared in SCHEMA as (keyword argument, element name) pairs, in the
+    order required by the template, and compiled to encoded tags once per
+    class, so a notification is rendered in a single pass over the schema.
+    """
+
+    __slots__ = ('_tileId',)
+
+    CLASS_HEADERS = TileNotification.CLASS_HEADERS
+
+    STATIC_HEADERS = TileNotification.STATIC_HEADERS
+
+    TEMPLATE = None
+
+    SCHEMA = ()
+
+    XML_HEADER = ('<?xml version=\"1.0\" encoding=\"utf-8\"?>'
+                  '<wp:Notification xmlns:wp=\"WPNotification\" '
+                  'Version=\"2.0\"><wp:Tile')
+
+    XML_FOOTER = ('</wp:Tile>'
+                  '</wp:Notification>')
+
+    def __init__(self, uri, **kwargs):
+        super(_TemplateTileNotification, self).__init__('Tile', uri, **kwargs)
+        self._tileId = kwargs.get('tileId')
+        self._body = self._renderSchema(kwargs)
+        _checkSize(self._body)
+
+    @property
+    def tileId(self):
+        """Return navigation URI of the updated secondary tile, or None."""
+        return self._tileId
+
+    @classmethod
+    def _compiled(cls):
+        """
+        Return encoded document frame and a tuple of (keyword argument,
+        opening tag, closing tag, clearing tag) for every schema element.
+        """
+        compiled = _SCHEMAS.get(cls)
+        if compiled is None:
+            header = _utf8(cls.XML_HEADER)
+            template = _utf8(u' Template="{0}">'.format(cls.TEMPLATE))
+            elements = tuple(
+                (field,) + _tags(name) +
+                (_utf8(u'<wp:{0} Action="Clear">'.format(name)),)
+                for field, name in cls.SCHEMA)
+            compiled = _SCHEMAS[cls] = (header, template,
+                                        _utf8(cls.XML_FOOTER), elements)
+        return compiled
+
+    def _renderSchema(self, values):
+        header, template, footer, elements = self._compiled()
+        tileId = self._tileId
+        if tileId is None:
+            xml = [header, template]
+        else:
+            xml = [header, b' Id="', _escapeAttribute(tileId), b'"', template]
+
+        for field, opening, closing, clearing in elements:
+            value = values.get(field)
+            if value is None:
+                continue
+            if value is CLEAR:
+                xml.extend((clearing, closing))
+            else:
+                xml.extend((opening, _escape(value), closing))
+
+        xml.append(footer)
+        return b''.join(xml)
+
+
+class FlipTileNotification(_TemplateTileNotification):
+    """
+    Formatter for flip tile notifications, showing front and back content.
+    Any property may be set to CLEAR to remove it from the tile.
+
+    :param uri: unique device URI.
+    :param priority: desired notification priority, either DELIVER_IMMEDIATELY,
+    DELIVER_WITHIN_450_S, or DELIVER_WITHIN_950_S.
+    :param uuid: an optional UUID uniquely identifying the notification message
+    :param tileId: optional navigation URI of a secondary tile to be updated.
+    :param smallBackground: URI of the small tile's background image.
+    :param background: URI of the medium tile's front background image.
+    :param wideBackground: URI of the wide tile's front background image.
+    :param backBackground: URI of the medium tile's back background image.
+    :param wideBackBackground: URI of the wide tile's back background image.
+    :param count: count to be displayed on the tile.
+    :param title: title of the tile front.
+    :param backTitle: title of the tile back.
+    :param backContent: text on the back of the medium tile.
+    :param wideBackContent: text on the back of the wide tile.
+    """
+
+    __slots__ = ()
+
+    TEMPLATE = 'FlipTile'
+
+    SCHEMA = (('smallBackground', 'SmallBackgroundImage'),
+              ('wideBackground', 'WideBackgroundImage'),
+              ('wideBackBackground', 'WideBackBackgroundImage'),
+              ('wideBackContent', 'WideBackContent'),
+              ('background', 'BackgroundImage'),
+              ('count', 'Count'),
+              ('title', 'Title'),
+              ('backBackground', 'BackBackgroundImage'),
+              ('backTitle', 'BackTitle'),
+              ('backContent', 'BackContent'))
+
+
+class IconicTileNotification(_TemplateTileNotification):
+    """
+    Formatter for iconic tile notifications, showing an icon, a count and, on
+    the wide tile, up to three lines of text. Any property may be set to CLEAR
+    to remove it from the tile.
+
+    :param uri: unique device URI.
+    :param priority: desired notification priority, either DELIVER_IMMEDIATELY,
+    DELIVER_WITHIN_450_S, or DELIVER_WITHIN_950_S.
+    :param uuid: an optional UUID uniquely identifying the notification message
+    :param tileId: optional navigation URI of a secondary tile to be updated.
+    :param smallIcon: URI of the icon of the small and wide tile.
+    :param icon: URI of the icon of the medium tile.
+    :param wideContent1: first line of text on the wide tile.
+    :param wideContent2: second line of text on the wide tile.
+    :param wideContent3: third line of text on the wide tile.
+    :param count: count to be displayed on the tile.
+    :param title: title of the tile.
+    :param backgroundColor: background color as #AARRGGBB.
+    """
+
+    __slots__ = ()
+
+    TEMPLATE = 'IconicTile'
+
+    SCHEMA = (('smallIcon', 'SmallIconImage'),
+              ('icon', 'IconImage'),
+              ('wideContent1', 'WideContent1'),
+              ('wideContent2', 'WideContent2'),
+              ('wideContent3', 'WideContent3'),
+              ('count', 'Count'),
+              ('title', 'Title'),
+              ('backgroundColor', 'BackgroundColor'))
+
+
+class CycleTileNotification(_TemplateTileNotification):
+    """
+    Formatter for cycle tile notifications, cycling through up to nine
+    background images. Any property may be set to CLEAR to remove it from the
+    tile.
+
+    :param uri: unique device URI.
+    :param priority: desired notification priority, either DELIVER_IMMEDIATELY,
+    DELIVER_WITHIN_450_S, or DELIVER_WITHIN_950_S.
+    :param uuid: an optional UUID uniquely identifying the notification message
+    :param tileId: optional navigation URI of a secondary tile to be updated.
+    :param smallBackground: URI of the small tile's background image.
+    :param images: sequence of at most MAX_IMAGES URIs of images to cycle
+    through; alternatively given as cycleImage1 to cycleImage9.
+    :param count: count to be displayed on the tile.
+    :param title: title of the tile.
+    """
+
+    __slots__ = ()
+
+    TEMPLATE = 'CycleTile'
+
+    MAX_IMAGES = 9
+
+    SCHEMA = ((('smallBackground', 'SmallBackgroundImage'),) +
+              tuple(('cycleImage{0}'.format(i), 'CycleImage{0}'.format(i))
+                    for i in range(1, MAX_IMAGES + 1)) +
+              (('count', 'Count'),
+               ('title', 'Title')))
+
+    def __init__(self, uri, **kwargs):
+        images = kwargs.pop('images', None)
+        if images is not None:
+            if len(images) > self.MAX_IMAGES:
+                raise NotificationError('Too many cycle images')
+            for i, image in enumerate(images, 1):
+                kwargs['cycleImage{0}'.format(i)] = image
+        super(CycleTileNotification, self).__init__(uri, **kwargs)
@@ -1,14 +1,18 @@
 import logging
-from collections import namedtuple
 
 from zope.interface import implements, implementer
 
 from twisted.internet import reactor
-from twisted.internet.defer import inlineCallbacks, succeed, returnValue
+from twisted.internet.defer import (
+    Deferred, inlineCallbacks, succeed, returnValue, gatherResults)
+from twisted.internet.task import cooperate
+from twisted.internet.interfaces import IOpenSSLClientConnectionCreator
+from twisted.internet.protocol import Protocol
 from twisted.internet.ssl import PrivateCertificate, optionsForClientTLS
 from twisted.web.iweb import IBodyProducer, IPolicyForHTTPS
-from twisted.web.client import Agent
+from twisted.web.client import Agent, HTTPConnectionPool
 from twisted.web.http_headers import Headers
+from twisted.python.failure import Failure
 
 from mpns.exceptions import (
     InvalidResponseError,
@@ -17,57 +21,257 @@ from mpns.exceptions import (
     QueueFullError,
     SubscriptionExpiredError,
     DeviceDisconnectedError,
-    ThrottlingLimitError
+    ThrottlingLimitError,
+    RequestTimeoutError
 )
+from mpns.metrics import NullMetrics
+from mpns.responses import (
+    NotificationStatus,
+    PROCESSABLE_RESPONSES,
+    RESPONSE_TO_ERROR,
+    classifyResponse
+)
+from mpns.utils import gatewayHost
 
 
 logger = logging.getLogger(__name__)
 
 
-class NotificationStatus(
-    namedtuple('NotificationStatus',
-               ['notification', 'subscription', 'device'])):
-    """
-    Contains information extracted from gateway server response.
-    """
-
-
 class StringProducer(object):
     """
-    Simple body producer pushing a in-memory string to a Twisted consumer.
+    Body producer pushing an in-memory string to a Twisted consumer. The
+    string is written as is, so one encoded body may be shared by many
+    requests. Bodies longer than CHUNK_SIZE are written in chunks, pausing
+    while the consumer's buffer is full. A None body is sent empty.
+
+    :ivar producedAt: time the body was written to a connection, or None.
     """
     implements(IBodyProducer)
 
+    CHUNK_SIZE = 64 * 1024
+
     def __init__(self, body):
+        if body is None:
+            body = b''
         self.body = body
         self.length = len(body)
+        self.producedAt = None
+        self._consumer = None
+        self._finished = None
+        self._offset = 0
+        self._paused = False
 
     def startProducing(self, consumer):
-        consumer.write(self.body)
-        return succeed(None)
+        self.producedAt = reactor.seconds()
+        if self.length <= self.CHUNK_SIZE:
+            consumer.write(self.body)
+            return succeed(None)
+        self._consumer = consumer
+        self._finished = Deferred()
+        self._produce()
+        return self._finished
+
+    def _produce(self):
+        while self._consumer is not None and not self._paused:
+            chunk = self.body[self._offset:self._offset + self.CHUNK_SIZE]
+            self._offset += len(chunk)
+            self._consumer.write(chunk)
+            if self._offset >= self.length and self._consumer is not None:
+                self._consumer = None
+                self._finished.callback(None)
 
     def pauseProducing(self):
-        pass
+        self._paused = True
+
+    def resumeProducing(self):
+        self._paused = False
+        self._produce()
 
     def stopProducing(self):
+        # The Deferred returned by startProducing must never fire now.
+        self._consumer = None
+
+
+# Headers instances shared by requests with the same header table to the same
+# gateway host, keyed by id of the table, which is kept alongside so that the
+# id is not reused. See _requestHeaders.
+_HEADERS = {}
+
+_HEADERS_CACHE_SIZE = 1024
+
+
+def _requestHeaders(notification):
+    """
+    Return Headers of a request sending a notification, including the Host
+    header, so that Agent does not have to copy them. Instances are shared
+    by notifications with shared header tables, e.g. copies made by forUri,
+    and must not be modified.
+    """
+    table = notification.requestHeaders
+    netloc = gatewayHost(notification.requestUri)
+    key = (id(table), netloc)
+    cached = _HEADERS.get(key)
+    if cached is not None and cached[0] is table:
+        return cached[1]
+    headers = Headers(dict((name, list(values))
+                           for name, values in table.items()))
+    headers.setRawHeaders('Host', [netloc])
+    if len(_HEADERS) >= _HEADERS_CACHE_SIZE:
+        _HEADERS.clear()
+    _HEADERS[key] = (table, headers)
+    return headers
+
+
+class _BodyDiscarder(Protocol):
+    """
+    Consumes and drops response body, so the underlying connection becomes
+    quiescent and may be returned to the connection pool.
+    """
+
+    def dataReceived(self, data):
+        pass
+
+    def connectionLost(self, reason):
         pass
 
 
+class NotificationConnectionPool(HTTPConnectionPool):
+    """
+    HTTP connection pool keeping persistent connections to gateway servers and
+    counting how many requests could reuse an already established connection.
+
+    :ivar hits: number of requests served by a cached connection.
+    :ivar misses: number of requests which had to open a new connection.
+    """
+
+    def __init__(self, reactor, persistent=True, metrics=None):
+        HTTPConnectionPool.__init__(self, reactor, persistent)
+        self.hits = 0
+        self.misses = 0
+        self._metrics = metrics or NullMetrics()
+        self._retired = False
+
+    def retire(self):
+        """
+        Close idle connections and any connection finishing its request later
+        on, instead of keeping it for reuse.
+        """
+        self._retired = True
+        return self.closeCachedConnections()
+
+    def getConnection(self, key, endpoint):
+        if self._connections.get(key):
+            self.hits += 1
+        else:
+            self.misses += 1
+        return HTTPConnectionPool.getConnection(self, key, endpoint)
+
+    def _putConnection(self, key, connection):
+        if self._retired:
+            connection.transport.loseConnection()
+        else:
+            HTTPConnectionPool._putConnection(self, key, connection)
+
+    def _newConnection(self, key, endpoint):
+        started = self._reactor.seconds()
+        d = HTTPConnectionPool._newConnection(self, key, endpoint)
+        d.addCallback(self._connected, started)
+        return d
+
+    def _connected(self, connection, started):
+        self._metrics.phaseCompleted('connect',
+                                     self._reactor.seconds() - started)
+        return connection
+
+
+@implementer(IOpenSSLClientConnectionCreator)
+class _ResumingConnectionCreator(object):
+    """
+    TLS connection creator offering the session of the most recently
+    established connection to the server, so that new connections can resume
+    it with an abbreviated handshake instead of a full one.
+    """
+
+    def __init__(self, creator):
+        self._creator = creator
+        self._session = None
+        self._last = None
+
+    def clientConnectionForTLS(self, tlsProtocol):
+        if self._last is not None:
+            session = self._last.get_session()
+            if session is not None:
+                self._session = session
+        connection = self._creator.clientConnectionForTLS(tlsProtocol)
+        if self._session is not None:
+            connection.set_session(self._session)
+        self._last = connection
+        return connection
+
+
 @implementer(IPolicyForHTTPS)
 class NotificationPolicyForHTTPS(object):
     """
     TLS policy implementation for HTTPS clients, providing a client-side
-    certificate for authentication against server.
+    certificate for authentication against server. One connection creator,
+    holding an OpenSSL context, is kept per gateway host and port, and TLS
+    sessions are resumed across connections to it.
+
+    :param pem: PEM-formatted client certificate and private key, or None.
+    :param trustRoot: optional trust root used to verify gateway certificates
+    instead of the platform's default one.
     """
-    def __init__(self, pem):
+    def __init__(self, pem, trustRoot=None):
+        self._trustRoot = trustRoot
+        self._creators = {}
+        self.reload(pem)
+
+    def reload(self, pem):
+        """
+        Replace the client certificate used by new connections. Cached
+        contexts and sessions established with the previous one are dropped.
+        """
         if pem is None:
             self._clientCertificate = None
         else:
             self._clientCertificate = PrivateCertificate.loadPEM(pem)
+        self._creators = {}
 
     def creatorForNetloc(self, hostname, port):
-        return optionsForClientTLS(hostname.decode('ascii'),
-                                   clientCertificate=self._clientCertificate)
+        creator = self._creators.get((hostname, port))
+        if creator is None:
+            creator = _ResumingConnectionCreator(optionsForClientTLS(
+                hostname.decode('ascii'),
+                trustRoot=self._trustRoot,
+                clientCertificate=self._clientCertificate))
+            self._creators[(hostname, port)] = creator
+        return creator
+
+
+def sendMany(send, notifications, concurrency=10, callback=None):
+    """
+    Send notifications taken lazily from an iterable with given send function,
+    keeping at most `concurrency` of them in flight. See Pusher.sendMany.
+    """
+    work = (_sendOne(send, notification, callback)
+            for notification in notifications)
+    tasks = [cooperate(work).whenDone() for _ in range(concurrency)]
+    return gatherResults(tasks).addCallback(lambda _: None)
+
+
+def _sendOne(send, notification, callback):
+    d = send(notification)
+    d.addBoth(_deliverResult, notification, callback)
+    d.addErrback(lambda failure: logger.error(
+        'Result callback failed: %s', failure.getTraceback()))
+    return d
+
+
+def _deliverResult(result, notification, callback):
+    if isinstance(result, Failure):
+        result = result.value
+    if callback is not None:
+        callback(notification, result)
 
 
 class Pusher(object):
@@ -78,53 +282,298 @@ class Pusher(object):
     :param pem: a string containing PEM-formatted certificate used to
     authenticate the client against the gateway server. Only necessary for
     sending notifications to https based subscriptions.
+    :param persistent: whether connections to the gateway should be kept open
+    and reused by subsequent requests.
+    :param maxConnectionsPerHost: maximum number of idle persistent connections
+    kept per gateway host.
+    :param idleTimeout: number of seconds an idle persistent connection stays
+    open before being closed.
+    :param limiter: an optional AdaptiveRateLimiter delaying requests which
+    would otherwise be refused by the gateway due to throttling.
+    :param expiredCache: an optional ExpiredSubscriptionCache, remembering
+    expired subscriptions so that notifications to them fail without
+    contacting the gateway or waiting for admission.
+    :param trustRoot: optional trust root used to verify gateway certificates,
+    e.g. a Certificate of a private authority.
+    :param metrics: an optional IPusherMetrics implementation receiving
+    instrumentation events, e.g. Metrics.
+    :param certificates: an optional CertificateRegistry with client
+    certificates of several applications, selected by the appId argument of
+    send(). Each certificate has its own connection pool; when a certificate
+    is reloaded, its pool is retired and a new one is used for subsequent
+    requests, while requests in flight complete on the old connections.
+    :param admission: an optional AdmissionController limiting the number of
+    requests in flight and shedding notifications under excessive load.
+    :param timeout: default number of seconds after which sending of a
+    notification is cancelled, or None for no timeout. See send().
+    :param connectTimeout: optional number of seconds after which an attempt
+    to open a connection to the gateway is given up.
     """
 
-    PROCESSABLE_RESPONSES = [200, 404, 406, 412]
+    PROCESSABLE_RESPONSES = PROCESSABLE_RESPONSES
+
+    RESPONSE_TO_ERROR = RESPONSE_TO_ERROR
+
+    def __init__(self, pem=None, persistent=True, maxConnectionsPerHost=2,
+                 idleTimeout=240, limiter=None, expiredCache=None,
+                 trustRoot=None, metrics=None, certificates=None,
+                 admission=None, timeout=None, connectTimeout=None):
+        self._limiter = limiter
+        self._admission = admission
+        self._timeout = timeout
+        self._connectTimeout = connectTimeout
+        self._expiredCache = expiredCache
+        self._metrics = metrics or NullMetrics()
+        self._persistent = persistent
+        self._maxConnectionsPerHost = maxConnectionsPerHost
+        self._idleTimeout = idleTimeout
+        self._trustRoot = trustRoot
+        self._policy, self._pool, self._agent = self._createAgent(pem)
+        self._certificates = certificates
+        self._appAgents = {}
+        if certificates is not None:
+            certificates.addListener(self._certificateReloaded)
+
+    @property
+    def pool(self):
+        """Return connection pool, exposing its hit and miss counters."""
+        return self._pool
+
+    @property
+    def pools(self):
+        """
+        Return connection pools of applications which have sent notifications
+        with their certificates, keyed by application id.
+        """
+        return dict((appId, pool)
+                    for appId, (_, pool, _) in self._appAgents.items())
 
-    RESPONSE_TO_ERROR = {
-        400: 'Bad request',
-        401: 'Unauthorized',
-        405: 'Method not allowed',
-        503: 'Service unavailable'
-    }
+    @property
+    def limiter(self):
+        """Return rate limiter, exposing its current rates."""
+        return self._limiter
 
-    def __init__(self, pem=None):
-        self._agent = Agent(reactor, NotificationPolicyForHTTPS(pem))
+    @property
+    def admission(self):
+        """Return admission controller, exposing its queue and counters."""
+        return self._admission
 
-    @inlineCallbacks
-    def send(self, notification):
+    @property
+    def metrics(self):
+        """Return metrics receiving instrumentation events."""
+        return self._metrics
+
+    def reloadCertificate(self, pem):
+        """
+        Use another client certificate, e.g. a renewed one, for connections
+        opened from now on. Already established persistent connections are
+        kept until they are closed.
+
+        :param pem: a string containing PEM-formatted certificate and private
+        key, or None.
+        """
+        self._policy.reload(pem)
+
+    def forApp(self, appId):
+        """
+        Return an object with send() and sendMany() methods sending
+        notifications with the certificate of given application, to be used
+        wherever a pusher is expected, e.g. by RetryingPusher.
+        """
+        return _AppPusher(self, appId)
+
+    def _createAgent(self, pem):
+        policy = NotificationPolicyForHTTPS(pem, self._trustRoot)
+        pool = NotificationConnectionPool(reactor, self._persistent,
+                                          self._metrics)
+        pool.maxPersistentPerHost = self._maxConnectionsPerHost
+        pool.cachedConnectionTimeout = self._idleTimeout
+        return policy, pool, Agent(reactor, policy, pool=pool,
+                                   connectTimeout=self._connectTimeout)
+
+    def _agentFor(self, appId):
+        if appId is None:
+            return self._agent
+        agent = self._appAgents.get(appId)
+        if agent is None:
+            if self._certificates is None:
+                raise ValueError('No certificate registry given')
+            agent = self._createAgent(self._certificates.pem(appId))
+            self._appAgents[appId] = agent
+        return agent[2]
+
+    def _certificateReloaded(self, appId, pem):
+        agent = self._appAgents.pop(appId, None)
+        if agent is not None:
+            agent[1].retire()
+
+    def send(self, notification, appId=None, timeout=None):
         """
         Send prepared notification to the gateway server and fire some events
         based on the server's response. Raise an exception if the gateway
         rejected the request, the response could not be parsed, or we know the
         notification will never be delivered.
 
+        :param appId: optional id of the application whose certificate from
+        the registry should be used, instead of the pem given upon creation.
+        :param timeout: number of seconds after which the request is
+        cancelled and RequestTimeoutError is raised, overriding the default
+        one. It covers waiting for the rate limiter, connecting, TLS
+        handshake, sending the request and receiving the response headers,
+        but not waiting for admission.
         :return an instance of NotificationStatus, containing notification,
         subscription and device statuses extracted from the response.
         """
+        started = reactor.seconds()
+        self._metrics.requestStarted()
+        if timeout is None:
+            timeout = self._timeout
+        if self._admission is None or self._isExpired(notification):
+            d = self._send(notification, appId, timeout)
+        else:
+            d = self._admission.acquire(notification)
+            d.addCallback(self._admitted, notification, appId, timeout)
+        d.addBoth(self._requestFinished, started)
+        return d
+
+    def _isExpired(self, notification):
+        return self._expiredCache is not None and \
+            notification.requestUri in self._expiredCache
+
+    def _admitted(self, _, notification, appId, timeout):
+        d = self._send(notification, appId, timeout)
+        d.addBoth(self._released)
+        return d
+
+    def _released(self, result):
+        self._admission.release()
+        return result
+
+    def _requestFinished(self, result, started):
+        if isinstance(result, Failure):
+            outcome = result.value.__class__.__name__
+            extra = getattr(result.value, 'extra', None)
+            status = extra.get('status') if extra else None
+        else:
+            outcome = getattr(result, 'notification', None)
+            status = result
+        self._metrics.requestFinished(outcome, status,
+                                      reactor.seconds() - started)
+        return result
+
+    @inlineCallbacks
+    def _send(self, notification, appId=None, timeout=None):
+        if timeout is not None:
+            deadline = reactor.seconds() + timeout
+
+        if self._isExpired(notification):
+            raise SubscriptionExpiredError('Subscription expired',
+                                           extra={'cached': True})
+
+        agent = self._agentFor(appId)
+
+        if self._limiter is not None:
+            d = self._limiter.acquire(notification.requestUri)
+            if timeout is not None:
+                d = self._withTimeout(d, deadline - reactor.seconds(),
+                                      timeout)
+            yield d
+
         logger.debug('Sending request')
 
         body = StringProducer(notification.requestBody)
-        headers = Headers(notification.requestHeaders)
-
-        response = yield self._agent.request('POST', notification.requestUri,
-                                             headers, body)
+        headers = _requestHeaders(notification)
+
+        issued = reactor.seconds()
+        if timeout is not None and deadline <= issued:
+            raise RequestTimeoutError('Request timed out',
+                                      {'timeout': timeout})
+        d = agent.request('POST', notification.requestUri, headers, body)
+        if timeout is not None:
+            d = self._withTimeout(d, deadline - issued, timeout)
+        response = yield d
+        if body.producedAt is not None:
+            self._metrics.phaseCompleted('request', body.producedAt - issued)
+            self._metrics.phaseCompleted('response',
+                                         reactor.seconds() - body.producedAt)
 
         logger.debug('Response code: %i', response.code)
 
-        if response.code in self.PROCESSABLE_RESPONSES:
-            returnValue(self._processResponse(response))
-        else:
-            self._processErrorResponse(response)
+        response.deliverBody(_BodyDiscarder())
+
+        try:
+            if response.code in self.PROCESSABLE_RESPONSES:
+                status = self._processResponse(response)
+                if self._limiter is not None:
+                    self._limiter.accepted(notification.requestUri)
+                returnValue(status)
+            else:
+                self._processErrorResponse(response)
+        except ThrottlingLimitError:
+            self._throttled(notification.requestUri, hostWide=True)
+            raise
+        except QueueFullError:
+            self._throttled(notification.requestUri, hostWide=False)
+            raise
+        except SubscriptionExpiredError:
+            if self._expiredCache is not None:
+                self._expiredCache.add(notification.requestUri)
+            raise
+
+    @staticmethod
+    def _withTimeout(d, remaining, timeout):
+        """
+        Cancel a Deferred, e.g. of a request, releasing its connection, after
+        given number of seconds, and fail it with RequestTimeoutError.
+        """
+        timedOut = []
+
+        def expire():
+            timedOut.append(True)
+            d.cancel()
+
+        def finished(result):
+            if timer.active():
+                timer.cancel()
+            if timedOut and isinstance(result, Failure):
+                raise RequestTimeoutError('Request timed out',
+                                          {'timeout': timeout})
+            return result
+
+        timer = reactor.callLater(max(0, remaining), expire)
+        return d.addBoth(finished)
+
+    def _throttled(self, uri, hostWide):
+        if self._limiter is not None:
+            self._limiter.throttled(uri, hostWide)
+
+    def sendMany(self, notifications, concurrency=10, callback=None,
+                 appId=None):
+        """
+        Send notifications taken lazily from an iterable, keeping at most
+        `concurrency` requests in flight. A failure of one notification does
+        not abort the others.
+
+        :param notifications: an iterable (possibly a generator) yielding
+        notifications to be sent.
+        :param concurrency: maximum number of simultaneous requests.
+        :param callback: optional callable invoked as callback(notification,
+        result) as soon as each notification is processed, where result is
+        either a NotificationStatus or the exception raised by send().
+        :param appId: optional id of the application whose certificate should
+        be used, see send().
+        :return a Deferred firing with None when all notifications have been
+        processed.
+        """
+        send = self.send
+        if appId is not None:
+            send = self.forApp(appId).send
+        return sendMany(send, notifications, concurrency, callback)
 
     @staticmethod
     def _extractHeader(response, name):
         header = response.headers.getRawHeaders(name)
-        if header is not None and len(header) > 0:
-            return header[0]
-        else:
-            return ''
+        return header[0] if header else ''
 
     @classmethod
     def _processResponse(cls, response):
@@ -134,32 +583,18 @@ class Pusher(object):
             device=cls._extractHeader(response, 'X-DeviceConnectionStatus')
         )
 
-        logger.debug('Notification ' + status.notification)
-        logger.debug('Subscription ' + status.subscription)
-        logger.debug('Device ' + status.device)
-
-        extra = {'response code': response.code, 'status': status}
-
-        if response.code == 200:
-            if status.notification in ['Received', 'Suppressed']:
-                return status
-            elif status.notification == 'QueueFull':
-                raise QueueFullError('Queue full', extra=extra)
-
-        elif response.code == 404 and status.subscription == 'Expired':
-            raise SubscriptionExpiredError('Subscription expired', extra=extra)
-
-        elif response.code == 406:
-            raise ThrottlingLimitError('Throttling limit hit', extra=extra)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Notification %s', status.notification)
+            logger.debug('Subscription %s', status.subscription)
+            logger.debug('Device %s', status.device)
 
-        elif response.code == 412:
-            raise DeviceDisconnectedError('Device disconnected', extra=extra)
+        outcome = classifyResponse(response.code, status)
+        if outcome is None:
+            return status
 
-        if status.notification == 'Dropped':
-            raise DeliveryError('Dropped for unknown reason', extra=extra)
-        else:
-            raise InvalidResponseError('Invalid notification status',
-                                       extra=extra)
+        errorClass, message = outcome
+        raise errorClass(message, extra={'response code': response.code,
+                                         'status': status})
 
     @staticmethod
     def _processErrorResponse(response):
@@ -167,3 +602,17 @@ class Pusher(object):
             response.code, 'Unknown response code')
 
         raise HTTPError(message, {'response code': response.code})
+
+
+class _AppPusher(object):
+    """Pusher view sending notifications with certificate of an application."""
+
+    def __init__(self, pusher, appId):
+        self._pusher = pusher
+        self._appId = appId
+
+    def send(self, notification, timeout=None):
+        return self._pusher.send(notification, self._appId, timeout)
+
+    def sendMany(self, notifications, concurrency=10, callback=None):
+        return sendMany(self.send, notifications, concurrency, callback)
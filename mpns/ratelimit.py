@@ -0,0 +1,132 @@
+from twisted.internet import reactor
+from twisted.internet.defer import succeed
+from twisted.internet.task import deferLater
+
+from mpns.utils import gatewayHost
+
+
+class _Bucket(object):
+    """
+    Rate limiting state of a single key, implemented as a generic cell rate
+    algorithm: tat is the theoretical arrival time of the next request.
+    """
+
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self.tat = 0.0
+
+
+class AdaptiveRateLimiter(object):
+    """
+    Spaces out requests per gateway host and per subscription URI, adapting
+    the allowed rates with additive increase and multiplicative decrease:
+    rates shrink whenever the gateway reports throttling or a full queue and
+    slowly grow back while notifications are accepted. Requests exceeding the
+    current rate are deferred rather than rejected.
+
+    :param hostRate: maximum number of requests per second sent to a single
+    gateway host, or None for no per-host limit.
+    :param subscriptionRate: maximum number of requests per second sent to a
+    single subscription URI, or None for no per-subscription limit.
+    :param minRate: rate below which limits are never decreased.
+    :param increase: requests per second added to a rate after each accepted
+    notification.
+    :param decrease: factor a rate is multiplied by after each throttled
+    notification.
+    :param burst: number of requests which may be sent back to back before
+    rate limiting kicks in.
+    :param maxSubscriptions: number of tracked subscriptions above which idle
+    ones are forgotten.
+    """
+
+    def __init__(self, hostRate=None, subscriptionRate=None, minRate=0.1,
+                 increase=0.1, decrease=0.5, burst=1, maxSubscriptions=100000,
+                 clock=reactor):
+        self._hostRate = hostRate
+        self._subscriptionRate = subscriptionRate
+        self._minRate = minRate
+        self._increase = increase
+        self._decrease = decrease
+        self._burst = burst
+        self._maxSubscriptions = maxSubscriptions
+        self._clock = clock
+        self._hosts = {}
+        self._subscriptions = {}
+
+    @property
+    def hostRates(self):
+        """Return current rates of all tracked gateway hosts."""
+        return dict((host, bucket.rate)
+                    for host, bucket in self._hosts.items())
+
+    def hostRate(self, uri):
+        """Return current rate for the gateway host of given URI."""
+        bucket = self._hosts.get(gatewayHost(uri))
+        return bucket.rate if bucket is not None else self._hostRate
+
+    def subscriptionRate(self, uri):
+        """Return current rate for given subscription URI."""
+        bucket = self._subscriptions.get(uri)
+        return bucket.rate if bucket is not None else self._subscriptionRate
+
+    def acquire(self, uri):
+        """
+        Reserve a slot for sending a request to given subscription URI.
+
+        :return a Deferred firing when the request may be sent.
+        """
+        now = self._clock.seconds()
+        buckets = self._buckets(uri, now)
+        start = now
+        for bucket in buckets:
+            tolerance = (self._burst - 1) / bucket.rate
+            start = max(start, bucket.tat - tolerance)
+        for bucket in buckets:
+            bucket.tat = max(bucket.tat, start) + 1.0 / bucket.rate
+
+        if start > now:
+            return deferLater(self._clock, start - now, lambda: None)
+        else:
+            return succeed(None)
+
+    def throttled(self, uri, hostWide=True):
+        """
+        Decrease rates after the gateway refused a notification because of
+        throttling. Per-host rate is only decreased if hostWide is set.
+        """
+        buckets = [self._subscriptions.get(uri)]
+        if hostWide:
+            buckets.append(self._hosts.get(gatewayHost(uri)))
+        for bucket in buckets:
+            if bucket is not None:
+                bucket.rate = max(self._minRate, bucket.rate * self._decrease)
+
+    def accepted(self, uri):
+        """Increase rates after the gateway accepted a notification."""
+        self._grow(self._subscriptions.get(uri), self._subscriptionRate)
+        self._grow(self._hosts.get(gatewayHost(uri)), self._hostRate)
+
+    def _grow(self, bucket, maxRate):
+        if bucket is not None and bucket.rate < maxRate:
+            bucket.rate = min(maxRate, bucket.rate + self._increase)
+
+    def _buckets(self, uri, now):
+        buckets = []
+        if self._hostRate is not None:
+            host = gatewayHost(uri)
+            if host not in self._hosts:
+                self._hosts[host] = _Bucket(self._hostRate)
+            buckets.append(self._hosts[host])
+        if self._subscriptionRate is not None:
+            if uri not in self._subscriptions:
+                if len(self._subscriptions) >= self._maxSubscriptions:
+                    self._prune(now)
+                self._subscriptions[uri] = _Bucket(self._subscriptionRate)
+            buckets.append(self._subscriptions[uri])
+        return buckets
+
+    def _prune(self, now):
+        """Forget subscriptions which are idle and back at full rate."""
+        for uri, bucket in list(self._subscriptions.items()):
+            if bucket.tat <= now and bucket.rate >= self._subscriptionRate:
+                del self._subscriptions[uri]
@@ -0,0 +1,76 @@
+from collections import namedtuple
+
+from mpns.exceptions import (
+    InvalidResponseError,
+    DeliveryError,
+    QueueFullError,
+    SubscriptionExpiredError,
+    DeviceDisconnectedError,
+    ThrottlingLimitError
+)
+
+
+class NotificationStatus(
+    namedtuple('NotificationStatus',
+               ['notification', 'subscription', 'device'])):
+    """
+    Contains information extracted from gateway server response.
+    """
+    __slots__ = ()
+
+
+PROCESSABLE_RESPONSES = frozenset([200, 404, 406, 412])
+
+# Messages of HTTPError raised for responses which could not be processed.
+RESPONSE_TO_ERROR = {
+    400: 'Bad request',
+    401: 'Unauthorized',
+    405: 'Method not allowed',
+    503: 'Service unavailable'
+}
+
+# Outcomes of responses depending on the notification status, keyed by
+# (response code, notification status). None means a delivered notification,
+# otherwise an (exception class, message) pair describes the failure.
+STATUS_OUTCOMES = {
+    (200, 'Received'): None,
+    (200, 'Suppressed'): None,
+    (200, 'QueueFull'): (QueueFullError, 'Queue full')
+}
+
+# Outcomes of responses not depending on the notification status.
+CODE_OUTCOMES = {
+    406: (ThrottlingLimitError, 'Throttling limit hit'),
+    412: (DeviceDisconnectedError, 'Device disconnected')
+}
+
+EXPIRED_OUTCOME = (SubscriptionExpiredError, 'Subscription expired')
+DROPPED_OUTCOME = (DeliveryError, 'Dropped for unknown reason')
+INVALID_OUTCOME = (InvalidResponseError, 'Invalid notification status')
+
+_UNKNOWN = object()
+
+
+def classifyResponse(code, status):
+    """
+    Find outcome of a processable gateway response.
+
+    :param code: HTTP response code.
+    :param status: NotificationStatus extracted from response headers.
+    :return None if the notification was accepted, otherwise a pair of
+    exception class and message describing the failure.
+    """
+    outcome = STATUS_OUTCOMES.get((code, status.notification), _UNKNOWN)
+    if outcome is not _UNKNOWN:
+        return outcome
+
+    outcome = CODE_OUTCOMES.get(code)
+    if outcome is not None:
+        return outcome
+
+    if code == 404 and status.subscription == 'Expired':
+        return EXPIRED_OUTCOME
+    elif status.notification == 'Dropped':
+        return DROPPED_OUTCOME
+    else:
+        return INVALID_OUTCOME
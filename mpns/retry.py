@@ -0,0 +1,160 @@
+import heapq
+import random
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+
+from mpns.exceptions import (
+    HTTPError,
+    QueueFullError,
+    DeviceDisconnectedError
+)
+
+
+class RetryRule(object):
+    """
+    Describes how notifications failing with a particular error are retried.
+
+    :param maxAttempts: maximum number of attempts, including the first one.
+    :param initialDelay: number of seconds to wait before the first retry.
+    :param maxDelay: upper bound for the delay between attempts.
+    :param multiplier: factor the delay grows by after each attempt.
+    :param jitter: fraction of the delay which is randomized, from 0 (no
+    jitter) to 1 (delay chosen uniformly between zero and its nominal value).
+    :param codes: optional collection of HTTP response codes; if given, the
+    rule only applies to errors carrying one of these codes.
+    """
+
+    def __init__(self, maxAttempts=5, initialDelay=1.0, maxDelay=300.0,
+                 multiplier=2.0, jitter=0.5, codes=None):
+        self.maxAttempts = maxAttempts
+        self.initialDelay = initialDelay
+        self.maxDelay = maxDelay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.codes = codes
+
+    def matches(self, error):
+        if self.codes is None:
+            return True
+        extra = error.extra or {}
+        return extra.get('response code') in self.codes
+
+    def delay(self, attempt):
+        """Return number of seconds to wait after given failed attempt."""
+        delay = min(self.maxDelay,
+                    self.initialDelay * self.multiplier ** (attempt - 1))
+        return delay - delay * self.jitter * random.random()
+
+
+DEFAULT_RULES = (
+    (HTTPError, RetryRule(codes=(503,))),
+    (QueueFullError, RetryRule(initialDelay=10.0)),
+    (DeviceDisconnectedError, RetryRule(maxAttempts=3, initialDelay=60.0))
+)
+
+
+class _PendingNotification(object):
+
+    def __init__(self, notification, expires):
+        self.notification = notification
+        self.expires = expires
+        self.attempts = 0
+        self.result = Deferred()
+
+
+class RetryingPusher(object):
+    """
+    Sends notifications through a pusher, retrying transient failures with
+    exponential backoff. All pending retries are kept in a single heap served
+    by one timer, regardless of their number.
+
+    :param pusher: a Pusher instance used to send notifications.
+    :param rules: sequence of (exception class, RetryRule) pairs; a failed
+    notification is retried according to the first matching rule, or given
+    up if there is none.
+    :param deadline: default number of seconds after which a notification is
+    no longer retried, or None for no deadline.
+    """
+
+    def __init__(self, pusher, rules=DEFAULT_RULES, deadline=None,
+                 clock=reactor):
+        self._pusher = pusher
+        self._rules = rules
+        self._deadline = deadline
+        self._clock = clock
+        self._queue = []
+        self._sequence = 0
+        self._timer = None
+
+    @property
+    def pending(self):
+        """Return number of notifications waiting for a retry."""
+        return len(self._queue)
+
+    def send(self, notification, deadline=None):
+        """
+        Send a notification, retrying it if it fails with a transient error.
+
+        :param deadline: number of seconds after which the notification is no
+        longer retried, overriding the default one.
+        :return a Deferred firing with the NotificationStatus of the last
+        attempt, or failing with its error.
+        """
+        if deadline is None:
+            deadline = self._deadline
+        expires = None
+        if deadline is not None:
+            expires = self._clock.seconds() + deadline
+
+        pending = _PendingNotification(notification, expires)
+        self._attempt(pending)
+        return pending.result
+
+    def _attempt(self, pending):
+        pending.attempts += 1
+        d = self._pusher.send(pending.notification)
+        d.addCallbacks(pending.result.callback, self._failed,
+                       errbackArgs=(pending,))
+
+    def _failed(self, failure, pending):
+        rule = self._findRule(failure.value)
+        if rule is None or pending.attempts >= rule.maxAttempts:
+            pending.result.errback(failure)
+            return
+
+        when = self._clock.seconds() + rule.delay(pending.attempts)
+        if pending.expires is not None and when > pending.expires:
+            pending.result.errback(failure)
+            return
+
+        self._sequence += 1
+        heapq.heappush(self._queue, (when, self._sequence, pending))
+        self._schedule()
+
+    def _findRule(self, error):
+        for errorClass, rule in self._rules:
+            if isinstance(error, errorClass) and rule.matches(error):
+                return rule
+        return None
+
+    def _schedule(self):
+        if not self._queue:
+            return
+        when = self._queue[0][0]
+        if self._timer is not None:
+            if self._timer.getTime() <= when:
+                return
+            self._timer.cancel()
+        delay = max(0, when - self._clock.seconds())
+        self._timer = self._clock.callLater(delay, self._retryDue)
+
+    def _retryDue(self):
+        self._timer = None
+        now = self._clock.seconds()
+        due = []
+        while self._queue and self._queue[0][0] <= now:
+            due.append(heapq.heappop(self._queue)[2])
+        for pending in due:
+            self._attempt(pending)
+        self._schedule()
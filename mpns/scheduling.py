@@ -0,0 +1,144 @@
+from collections import deque
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, maybeDeferred
+from twisted.python.failure import Failure
+
+from mpns.notifications import (
+    DELIVER_IMMEDIATELY,
+    DELIVER_WITHIN_450_S,
+    DELIVER_WITHIN_950_S
+)
+
+
+# Priorities indexed by the tens digit of the X-NotificationClass header.
+PRIORITIES = (DELIVER_IMMEDIATELY, DELIVER_WITHIN_450_S, DELIVER_WITHIN_950_S)
+
+# Delivery windows of priorities in seconds.
+WINDOWS = {DELIVER_IMMEDIATELY: 0, DELIVER_WITHIN_450_S: 450,
+           DELIVER_WITHIN_950_S: 950}
+
+
+def priorityOf(notification):
+    """
+    Return priority of a notification, derived from its X-NotificationClass
+    header. Notifications without a valid header are treated as immediate.
+    """
+    header = notification.requestHeaders.get('X-NotificationClass')
+    try:
+        return PRIORITIES[int(header[0]) // 10]
+    except (TypeError, ValueError, IndexError):
+        return DELIVER_IMMEDIATELY
+
+
+class _QueuedNotification(object):
+
+    def __init__(self, notification, deadline):
+        self.notification = notification
+        self.deadline = deadline
+        self.result = Deferred()
+
+
+class PriorityScheduler(object):
+    """
+    Sends notifications through a pusher with bounded concurrency, dispatching
+    them by priority instead of arrival order. Each priority has its own
+    queue. Immediate notifications go first, while deferred ones fill the
+    remaining capacity in earliest deadline first order, the deadline being
+    the time of arrival plus the delivery window of their class. A deferred
+    notification whose deadline is less than `slack` seconds away is
+    dispatched before immediate ones, so batch classes keep their windows
+    even under a steady stream of immediate notifications.
+
+    :param pusher: a Pusher instance used to send notifications.
+    :param concurrency: maximum number of simultaneous requests.
+    :param reserved: number of request slots deferred notifications may not
+    use, so that immediate notifications never wait for a batch backlog.
+    :param slack: number of seconds before its deadline a deferred
+    notification becomes urgent.
+    """
+
+    def __init__(self, pusher, concurrency=10, reserved=1, slack=30.0,
+                 clock=reactor):
+        self._pusher = pusher
+        self._concurrency = concurrency
+        self._reserved = min(reserved, concurrency - 1)
+        self._slack = slack
+        self._clock = clock
+        self._queues = dict((priority, deque()) for priority in PRIORITIES)
+        self._inFlight = 0
+        self._dispatching = False
+        self.missed = dict.fromkeys(PRIORITIES, 0)
+        self.sent = dict.fromkeys(PRIORITIES, 0)
+
+    @property
+    def depths(self):
+        """Return number of queued notifications, keyed by priority."""
+        return dict((priority, len(queue))
+                    for priority, queue in self._queues.items())
+
+    @property
+    def inFlight(self):
+        """Return number of notifications currently being sent."""
+        return self._inFlight
+
+    def send(self, notification):
+        """
+        Queue a notification for sending.
+
+        :return a Deferred firing with the result of Pusher.send.
+        """
+        priority = priorityOf(notification)
+        queued = _QueuedNotification(
+            notification, self._clock.seconds() + WINDOWS[priority])
+        self._queues[priority].append(queued)
+        self._dispatch()
+        return queued.result
+
+    def _dispatch(self):
+        # Sends completing synchronously end up here again through _sent,
+        # they are picked up by the loop already running instead.
+        if self._dispatching:
+            return
+        self._dispatching = True
+        try:
+            while self._inFlight < self._concurrency:
+                priority = self._next()
+                if priority is None:
+                    return
+                queued = self._queues[priority].popleft()
+                if self._clock.seconds() > queued.deadline:
+                    self.missed[priority] += 1
+                self.sent[priority] += 1
+                self._inFlight += 1
+                d = maybeDeferred(self._pusher.send, queued.notification)
+                d.addBoth(self._sent, queued)
+        finally:
+            self._dispatching = False
+
+    def _next(self):
+        """Return priority of the queue to be served next, if any."""
+        deferred = None
+        for priority in PRIORITIES[1:]:
+            queue = self._queues[priority]
+            if queue and (deferred is None or queue[0].deadline <
+                          self._queues[deferred][0].deadline):
+                deferred = priority
+
+        if deferred is not None and \
+                self._queues[deferred][0].deadline - self._slack <= \
+                self._clock.seconds():
+            return deferred
+        if self._queues[DELIVER_IMMEDIATELY]:
+            return DELIVER_IMMEDIATELY
+        if self._inFlight < self._concurrency - self._reserved:
+            return deferred
+        return None
+
+    def _sent(self, result, queued):
+        self._inFlight -= 1
+        self._dispatch()
+        if isinstance(result, Failure):
+            queued.result.errback(result)
+        else:
+            queued.result.callback(result)
@@ -0,0 +1,271 @@
+"""
+Sending notifications from several worker processes, each running its own
+Pusher. Workers communicate with the coordinating process using AMP over
+their standard input and output.
+"""
+import json
+import logging
+import os
+import sys
+import zlib
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, gatherResults
+from twisted.internet.error import ProcessDone
+from twisted.internet.protocol import ProcessProtocol
+from twisted.internet.stdio import StandardIO
+from twisted.protocols.amp import AMP, Command, Integer, String, Unicode
+
+from mpns import exceptions
+from mpns.notifications import PreparedNotification
+from mpns.pusher import Pusher, sendMany
+from mpns.responses import NotificationStatus
+
+
+logger = logging.getLogger(__name__)
+
+
+class Configure(Command):
+    """Create the Pusher of a worker with given keyword arguments."""
+    arguments = [('options', String())]
+    response = []
+
+
+class Send(Command):
+    """Send a notification, reporting its status or error."""
+    arguments = [('uri', String()),
+                 ('headers', String()),
+                 ('body', String(optional=True))]
+    response = [('notification', Unicode()),
+                ('subscription', Unicode()),
+                ('device', Unicode()),
+                ('error', Unicode(optional=True)),
+                ('message', Unicode(optional=True)),
+                ('code', Integer(optional=True))]
+
+
+def _encode(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+def _bytes(value):
+    if value is not None and not isinstance(value, bytes):
+        return value.encode('utf-8')
+    return value
+
+
+class ShardWorker(AMP):
+    """
+    AMP protocol of a worker process, sending notifications with its Pusher.
+    """
+
+    def __init__(self):
+        AMP.__init__(self)
+        self._pusher = None
+
+    @Configure.responder
+    def configure(self, options):
+        self._pusher = Pusher(**json.loads(options))
+        return {}
+
+    @Send.responder
+    def send(self, uri, headers, body=None):
+        notification = PreparedNotification(uri, json.loads(headers), body)
+        d = self._pusher.send(notification)
+        d.addCallbacks(self._sent, self._failed)
+        return d
+
+    @staticmethod
+    def _sent(status):
+        return {'notification': _encode(status.notification),
+                'subscription': _encode(status.subscription),
+                'device': _encode(status.device)}
+
+    @staticmethod
+    def _failed(failure):
+        error = failure.value
+        extra = getattr(error, 'extra', None) or {}
+        status = extra.get('status') or NotificationStatus('', '', '')
+        result = ShardWorker._sent(status)
+        result['error'] = _encode(error.__class__.__name__)
+        result['message'] = _encode(str(error))
+        if 'response code' in extra:
+            result['code'] = extra['response code']
+        return result
+
+    def connectionLost(self, reason):
+        AMP.connectionLost(self, reason)
+        if reactor.running:
+            reactor.stop()
+
+
+class _ProcessTransport(object):
+    """Exposes standard input of a worker process as an AMP transport."""
+
+    def __init__(self, transport):
+        self._transport = transport
+
+    def write(self, data):
+        self._transport.write(data)
+
+    def writeSequence(self, data):
+        self._transport.writeSequence(data)
+
+    def loseConnection(self):
+        self._transport.closeStdin()
+
+    def getPeer(self):
+        return ('process', self._transport.pid)
+
+    def getHost(self):
+        return ('process', os.getpid())
+
+
+class _WorkerProcess(ProcessProtocol):
+
+    def __init__(self):
+        self.amp = AMP()
+        self.started = Deferred()
+        self.ended = Deferred()
+
+    def connectionMade(self):
+        self.amp.makeConnection(_ProcessTransport(self.transport))
+        self.started.callback(self)
+
+    def outReceived(self, data):
+        self.amp.dataReceived(data)
+
+    def processEnded(self, reason):
+        self.amp.connectionLost(reason)
+        if not reason.check(ProcessDone):
+            logger.error('Worker process failed: %s', reason.value)
+        if not self.started.called:
+            self.started.errback(reason)
+        self.ended.callback(None)
+
+
+class ShardedPusher(object):
+    """
+    Distributes notifications between a number of worker processes by hash of
+    their subscription URI, so that notifications to one device are always
+    sent by the same worker, in order. Each worker has its own connection
+    pool. A worker process which exits unexpectedly is respawned. Results
+    have the same form as these of Pusher.send.
+
+    :param workers: number of worker processes.
+    :param options: keyword arguments for Pusher of each worker, which must be
+    serializable to JSON, e.g. pem, maxConnectionsPerHost or idleTimeout.
+    """
+
+    def __init__(self, workers=4, **options):
+        self._size = workers
+        self._options = json.dumps(options)
+        self._workers = []
+
+    def start(self):
+        """
+        Spawn worker processes.
+
+        :return a Deferred firing when all workers are ready.
+        """
+        self._workers = [None] * self._size
+        started = [self._spawn(index) for index in range(self._size)]
+        return gatherResults(started).addCallback(lambda _: None)
+
+    def _spawn(self, index):
+        environment = dict(os.environ)
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        environment['PYTHONPATH'] = os.pathsep.join(
+            filter(None, [root, environment.get('PYTHONPATH')]))
+
+        process = _WorkerProcess()
+        self._workers[index] = process
+        process.ended.addCallback(self._ended, index, process)
+        reactor.spawnProcess(process, sys.executable,
+                             [sys.executable, '-m', 'mpns.sharding'],
+                             env=environment,
+                             childFDs={0: 'w', 1: 'r', 2: 2})
+        return process.started.addCallback(self._configure)
+
+    def _configure(self, process):
+        return process.amp.callRemote(Configure, options=self._options)
+
+    def _ended(self, _, index, process):
+        if index < len(self._workers) and self._workers[index] is process:
+            logger.warning('Respawning worker process %i', index)
+            self._spawn(index).addErrback(lambda failure: logger.error(
+                'Respawning worker process failed: %s', failure.value))
+
+    def stop(self):
+        """
+        Stop worker processes after they finish sending notifications.
+
+        :return a Deferred firing when all workers exited.
+        """
+        ended = []
+        for process in self._workers:
+            process.transport.closeStdin()
+            ended.append(process.ended)
+        self._workers = []
+        return gatherResults(ended).addCallback(lambda _: None)
+
+    def shardOf(self, uri):
+        """Return index of the worker sending notifications to given URI."""
+        return (zlib.crc32(_bytes(uri)) & 0xffffffff) % self._size
+
+    def send(self, notification):
+        """
+        Send notification through the worker responsible for its subscription
+        URI.
+
+        :return a Deferred firing with a NotificationStatus, or failing with
+        the exception raised by the worker's Pusher. Errors other than
+        NotificationPusherError subclasses are reported as
+        NotificationPusherError, with their class name in extra.
+        """
+        uri = notification.requestUri
+        worker = self._workers[self.shardOf(uri)]
+        d = worker.amp.callRemote(
+            Send, uri=_bytes(uri),
+            headers=_bytes(json.dumps(notification.requestHeaders)),
+            body=_bytes(notification.requestBody))
+        return d.addCallback(self._processResult)
+
+    def sendMany(self, notifications, concurrency=10, callback=None):
+        """
+        Send notifications taken lazily from an iterable, keeping at most
+        `concurrency` requests in flight. See Pusher.sendMany.
+        """
+        return sendMany(self.send, notifications, concurrency, callback)
+
+    @staticmethod
+    def _processResult(result):
+        status = NotificationStatus(result['notification'],
+                                    result['subscription'],
+                                    result['device'])
+        if result.get('error') is None:
+            return status
+
+        extra = {}
+        if result.get('code') is not None:
+            extra['response code'] = result['code']
+        if any(status):
+            extra['status'] = status
+
+        errorClass = getattr(exceptions, result['error'], None)
+        if not (isinstance(errorClass, type) and
+                issubclass(errorClass, exceptions.NotificationPusherError)):
+            errorClass = exceptions.NotificationPusherError
+            extra['error class'] = result['error']
+        raise errorClass(result['message'], extra=extra)
+
+
+def main():
+    StandardIO(ShardWorker())
+    reactor.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+from mock import Mock
+from twisted.internet.defer import Deferred, fail
+
+
+class PendingPusherMixin(object):
+    """
+    Test case mixin providing a mocked pusher, whose send() returns pending
+    Deferreds collected in self.requests as (notification, Deferred) pairs.
+    """
+
+    def setUp(self):
+        super(PendingPusherMixin, self).setUp()
+        self.pusher = Mock()
+        self.requests = []
+        self.pusher.send = Mock(side_effect=self._send)
+
+    def _send(self, notification):
+        d = Deferred()
+        self.requests.append((notification, d))
+        return d
+
+    def _sendAll(self, sender, *notifications):
+        """Send notifications, returning a list collecting their results."""
+        results = []
+        for notification in notifications:
+            sender.send(notification).addBoth(results.append)
+        return results
+
+    def _failSynchronously(self, error):
+        """Make subsequent sends fail synchronously with the given error."""
+        self.pusher.send.side_effect = lambda notification: fail(error)
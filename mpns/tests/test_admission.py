@@ -0,0 +1,129 @@
+from twisted.trial.unittest import TestCase
+
+from mpns.admission import AdmissionController
+from mpns.exceptions import LoadSheddingError
+from mpns.notifications import (
+    DELIVER_IMMEDIATELY,
+    DELIVER_WITHIN_450_S,
+    DELIVER_WITHIN_950_S,
+    RawNotification
+)
+
+
+class AdmissionControllerTestCase(TestCase):
+
+    # Each notification is 100 bytes long, counting its URI and body.
+    URI = 'http://foo/bar'
+
+    def _notification(self, priority=DELIVER_IMMEDIATELY):
+        return RawNotification(self.URI, priority=priority,
+                               body='x' * (100 - len(self.URI)))
+
+    def _acquire(self, controller, priority=DELIVER_IMMEDIATELY):
+        results = []
+        controller.acquire(self._notification(priority)).addBoth(
+            results.append)
+        return results
+
+    def test_in_flight_limit(self):
+        controller = AdmissionController(maxInFlight=2)
+        first = self._acquire(controller)
+        second = self._acquire(controller)
+        third = self._acquire(controller)
+        self.assertEqual(first + second, [None, None])
+        self.assertEqual(third, [])
+        self.assertEqual((controller.inFlight, controller.queued), (2, 1))
+        self.assertEqual(controller.queuedBytes, 100)
+
+        controller.release()
+        self.assertEqual(third, [None])
+        self.assertEqual((controller.inFlight, controller.queued), (2, 0))
+        self.assertEqual(controller.queuedBytes, 0)
+
+    def test_admitted_by_priority(self):
+        controller = AdmissionController(maxInFlight=1)
+        self._acquire(controller)
+        batch = self._acquire(controller, DELIVER_WITHIN_950_S)
+        immediate = self._acquire(controller)
+        controller.release()
+        self.assertEqual((immediate, batch), ([None], []))
+        controller.release()
+        self.assertEqual(batch, [None])
+
+    def test_shedding_by_priority(self):
+        controller = AdmissionController(maxInFlight=1, maxQueuedBytes=400)
+        self._acquire(controller)
+        self._acquire(controller, DELIVER_WITHIN_950_S)
+        self._acquire(controller, DELIVER_WITHIN_950_S)
+        shed = self._acquire(controller, DELIVER_WITHIN_950_S)
+        self.assertTrue(isinstance(shed[0].value, LoadSheddingError))
+        self.assertEqual(shed[0].value.extra,
+                         {'priority': DELIVER_WITHIN_950_S})
+        self.assertEqual(self._acquire(controller, DELIVER_WITHIN_450_S),
+                         [])
+        self.assertEqual(controller.shed[DELIVER_WITHIN_950_S], 1)
+        self.assertEqual(controller.queuedBytes, 300)
+
+    def test_immediate_evicts_lower_priorities(self):
+        controller = AdmissionController(maxInFlight=1, maxQueuedBytes=300,
+                                         thresholds={})
+        self._acquire(controller)
+        older = self._acquire(controller, DELIVER_WITHIN_950_S)
+        newer = self._acquire(controller, DELIVER_WITHIN_950_S)
+        urgent = self._acquire(controller, DELIVER_WITHIN_450_S)
+        self.assertTrue(isinstance(
+            self._acquire(controller, DELIVER_WITHIN_450_S)[0].value,
+            LoadSheddingError))
+
+        immediate = self._acquire(controller)
+        self.assertEqual((older, urgent, immediate), ([], [], []))
+        self.assertTrue(isinstance(newer[0].value, LoadSheddingError))
+        self.assertEqual(controller.shed, {DELIVER_IMMEDIATELY: 0,
+                                           DELIVER_WITHIN_450_S: 1,
+                                           DELIVER_WITHIN_950_S: 1})
+
+    def test_when_ready(self):
+        controller = AdmissionController(maxInFlight=1, maxQueuedBytes=400,
+                                         resumeFraction=0.25)
+        self._acquire(controller)
+        self.assertTrue(controller.ready)
+        for _ in range(3):
+            self._acquire(controller)
+        self.assertFalse(controller.ready)
+
+        ready = []
+        controller.whenReady().addCallback(ready.append)
+        controller.release()
+        self.assertEqual(ready, [])
+        controller.release()
+        self.assertEqual(ready, [None])
+
+    def test_cancelled_waiter(self):
+        controller = AdmissionController(maxInFlight=1)
+        self._acquire(controller)
+        d = controller.acquire(self._notification(DELIVER_WITHIN_950_S))
+        waiting = self._acquire(controller)
+        d.cancel()
+        self.failureResultOf(d)
+        self.assertEqual((controller.queued, controller.queuedBytes),
+                         (1, 100))
+
+        controller.release()
+        self.assertEqual(waiting, [None])
+        controller.release()
+        self.assertEqual((controller.inFlight, controller.queued), (0, 0))
+        self.assertEqual(self._acquire(controller), [None])
+
+    def test_synchronous_release(self):
+        controller = AdmissionController(maxInFlight=1,
+                                         maxQueuedBytes=100 * 3000)
+        self._acquire(controller)
+        admitted = []
+        for _ in range(3000):
+            d = controller.acquire(self._notification())
+            d.addCallback(admitted.append)
+            d.addCallback(lambda _: controller.release())
+        controller.release()
+        self.assertEqual(len(admitted), 3000)
+        self.assertEqual((controller.inFlight, controller.queued), (0, 0))
+        self.assertEqual(controller.queuedBytes, 0)
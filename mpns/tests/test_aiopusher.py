@@ -0,0 +1,96 @@
+from mock import Mock
+from twisted.trial.unittest import TestCase
+
+try:
+    import asyncio
+    from mpns.aiopusher import AsyncPusher
+except (ImportError, SyntaxError):
+    AsyncPusher = None
+
+from mpns.exceptions import (
+    HTTPError,
+    QueueFullError,
+    SubscriptionExpiredError
+)
+from mpns.notifications import ToastNotification
+
+
+class FakeResponse(object):
+
+    def __init__(self, status=200, notification='Received',
+                 subscription='Active', device='Connected'):
+        self.status = status
+        self.headers = {'X-NotificationStatus': notification,
+                        'X-SubscriptionStatus': subscription,
+                        'X-DeviceConnectionStatus': device}
+        self.read = Mock(side_effect=lambda: self._done(b''))
+
+    @staticmethod
+    def _done(result):
+        future = asyncio.get_event_loop().create_future()
+        future.set_result(result)
+        return future
+
+    def __aenter__(self):
+        return self._done(self)
+
+    def __aexit__(self, *args):
+        return self._done(None)
+
+
+class AsyncPusherTestCase(TestCase):
+
+    if AsyncPusher is None:
+        skip = 'asyncio pusher requires Python 3 and aiohttp'
+
+    TEST_URI = 'http://foo/bar'
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.addCleanup(self.loop.close)
+        self.session = Mock()
+
+    def _pusher(self, *responses):
+        self.session.post = Mock(side_effect=list(responses))
+        return AsyncPusher(session=self.session)
+
+    def _send(self, pusher):
+        notification = ToastNotification(self.TEST_URI, text1=u'foo')
+        return self.loop.run_until_complete(pusher.send(notification))
+
+    def test_send_received(self):
+        response = FakeResponse()
+        pusher = self._pusher(response)
+        status = self._send(pusher)
+        self.assertEqual(status.notification, 'Received')
+        self.assertTrue(response.read.called)
+
+        args, kwargs = self.session.post.call_args
+        self.assertEqual(args, (self.TEST_URI,))
+        self.assertIn(('X-WindowsPhone-Target', 'toast'), kwargs['headers'])
+        self.assertIsInstance(kwargs['data'], bytes)
+
+    def test_send_expired(self):
+        pusher = self._pusher(FakeResponse(404, 'Dropped', 'Expired'))
+        with self.assertRaises(SubscriptionExpiredError) as context:
+            self._send(pusher)
+        self.assertEqual(context.exception.extra['response code'], 404)
+
+    def test_send_http_error(self):
+        pusher = self._pusher(FakeResponse(503))
+        with self.assertRaises(HTTPError) as context:
+            self._send(pusher)
+        self.assertEqual(str(context.exception), 'Service unavailable')
+
+    def test_send_many(self):
+        pusher = self._pusher(FakeResponse(), FakeResponse(200, 'QueueFull'),
+                              FakeResponse())
+        results = []
+        notifications = (ToastNotification(self.TEST_URI) for _ in range(3))
+        self.loop.run_until_complete(pusher.sendMany(
+            notifications, concurrency=2,
+            callback=lambda n, r: results.append(r)))
+        self.assertEqual(len(results), 3)
+        self.assertEqual(
+            len([r for r in results if isinstance(r, QueueFullError)]), 1)
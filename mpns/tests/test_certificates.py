@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+
+from OpenSSL import crypto
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from mpns.certificates import CertificateRegistry
+
+
+def _newPem(subject):
+    key = crypto.PKey()
+    key.generate_key(crypto.TYPE_RSA, 2048)
+    certificate = crypto.X509()
+    certificate.get_subject().CN = subject
+    certificate.set_issuer(certificate.get_subject())
+    certificate.set_serial_number(1)
+    certificate.gmtime_adj_notBefore(0)
+    certificate.gmtime_adj_notAfter(3600)
+    certificate.set_pubkey(key)
+    certificate.sign(key, 'sha256')
+    return (crypto.dump_certificate(crypto.FILETYPE_PEM, certificate) +
+            crypto.dump_privatekey(crypto.FILETYPE_PEM, key))
+
+
+class CertificateRegistryTestCase(TestCase):
+
+    FOO_PEM = _newPem(u'foo')
+    BAR_PEM = _newPem(u'bar')
+
+    def setUp(self):
+        self.clock = Clock()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def _write(self, name, pem, mtime=None):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as f:
+            f.write(pem)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def test_register(self):
+        registry = CertificateRegistry(
+            {'foo': self._write('foo.pem', self.FOO_PEM)}, clock=self.clock)
+        self.assertTrue('foo' in registry)
+        self.assertFalse('bar' in registry)
+        self.assertEqual(registry.pem('foo'), self.FOO_PEM)
+        self.assertRaises(KeyError, registry.pem, 'bar')
+
+    def test_register_invalid(self):
+        path = self._write('foo.pem', b'foo')
+        registry = CertificateRegistry(clock=self.clock)
+        self.assertRaises(Exception, registry.register, 'foo', path)
+        self.assertFalse('foo' in registry)
+
+    def test_reload_changed(self):
+        path = self._write('app.pem', self.FOO_PEM, mtime=1000)
+        registry = CertificateRegistry({'app': path}, clock=self.clock)
+        reloaded = []
+        registry.addListener(lambda *args: reloaded.append(args))
+
+        registry.reload()
+        self.assertEqual(reloaded, [])
+        self._write('app.pem', self.BAR_PEM, mtime=2000)
+        registry.reload()
+        self.assertEqual(reloaded, [('app', self.BAR_PEM)])
+        self.assertEqual(registry.pem('app'), self.BAR_PEM)
+
+    def test_reload_keeps_valid_certificate(self):
+        path = self._write('app.pem', self.FOO_PEM, mtime=1000)
+        registry = CertificateRegistry({'app': path}, clock=self.clock)
+        reloaded = []
+        registry.addListener(lambda *args: reloaded.append(args))
+
+        self._write('app.pem', self.BAR_PEM[:100], mtime=2000)
+        registry.reload()
+        self.assertEqual(registry.pem('app'), self.FOO_PEM)
+        self.flushLoggedErrors()
+
+        self._write('app.pem', self.BAR_PEM, mtime=2000)
+        registry.reload()
+        self.assertEqual(registry.pem('app'), self.BAR_PEM)
+        self.assertEqual(len(reloaded), 1)
+
+    def test_periodic_reload(self):
+        path = self._write('app.pem', self.FOO_PEM, mtime=1000)
+        registry = CertificateRegistry({'app': path}, clock=self.clock)
+        registry.start(interval=10)
+        self._write('app.pem', self.BAR_PEM, mtime=2000)
+        self.clock.advance(9)
+        self.assertEqual(registry.pem('app'), self.FOO_PEM)
+        self.clock.advance(1)
+        self.assertEqual(registry.pem('app'), self.BAR_PEM)
+        registry.stop()
+        self.assertEqual(self.clock.getDelayedCalls(), [])
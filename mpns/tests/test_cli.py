@@ -0,0 +1,162 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+
+from mock import Mock
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, inlineCallbacks, succeed, fail
+from twisted.internet.task import deferLater
+from twisted.trial.unittest import TestCase
+
+from mpns.cli import BatchSender, notificationFromSpec, parseArguments
+from mpns.exceptions import NotificationError, SubscriptionExpiredError
+from mpns.notifications import (
+    DELIVER_WITHIN_450_S,
+    RawNotification,
+    TileNotification,
+    ToastNotification
+)
+from mpns.responses import NotificationStatus
+
+
+class NotificationFromSpecTestCase(TestCase):
+
+    def test_toast(self):
+        notification = notificationFromSpec(
+            {u'type': u'toast', u'uri': u'http://foo/bar', u'text1': u'foo',
+             u'priority': DELIVER_WITHIN_450_S, u'uuid': u'1234'})
+        expected = ToastNotification('http://foo/bar', text1='foo',
+                                     priority=DELIVER_WITHIN_450_S,
+                                     uuid='1234')
+        self.assertTrue(isinstance(notification, ToastNotification))
+        self.assertEqual(notification.requestUri, b'http://foo/bar')
+        self.assertEqual(notification.requestBody, expected.requestBody)
+        self.assertEqual(notification.requestHeaders,
+                         expected.requestHeaders)
+
+    def test_tile_and_raw(self):
+        self.assertTrue(isinstance(notificationFromSpec(
+            {u'type': u'tile', u'uri': u'http://foo/bar', u'count': 3}),
+            TileNotification))
+        raw = notificationFromSpec({u'uri': u'http://foo/bar',
+                                    u'body': u'foo'})
+        self.assertTrue(isinstance(raw, RawNotification))
+        self.assertEqual(raw.requestBody, b'foo')
+
+    def test_unknown_fields_reported(self):
+        with self.assertRaises(NotificationError) as context:
+            notificationFromSpec({u'type': u'toast', u'uri': u'http://foo',
+                                  u'text_1': u'foo', u'text_2': u'bar'})
+        self.assertEqual(str(context.exception),
+                         'Unknown notification fields: text_1, text_2')
+
+    def test_template_tile_fields(self):
+        notification = notificationFromSpec(
+            {u'type': u'cycle', u'uri': u'http://foo/bar', u'title': u'foo',
+             u'images': [u'/1.png'], u'tileId': u'/a.xaml'})
+        self.assertEqual(notification.tileId, u'/a.xaml')
+
+    def test_invalid(self):
+        for spec in ([], {u'type': u'badge', u'uri': u'http://foo/bar'},
+                     {u'type': u'toast'},
+                     {u'uri': u'http://foo/bar', u'priority': u'never'},
+                     {u'type': u'toast', u'uri': u'http://foo/bar',
+                      u'text_1': u'foo'},
+                     {u'type': u'tile', u'uri': u'http://foo/bar',
+                      u'backContent': u'foo'}):
+            self.assertRaises(NotificationError, notificationFromSpec, spec)
+
+
+class BatchSenderTestCase(TestCase):
+
+    STATUS = NotificationStatus('Received', 'Active', 'Connected')
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.checkpoint = os.path.join(self.directory, 'checkpoint')
+        self.pusher = Mock()
+        self.output = io.BytesIO()
+
+    def _input(self, *specs):
+        lines = [spec if isinstance(spec, bytes) else
+                 json.dumps(spec).encode('utf-8') for spec in specs]
+        return io.BytesIO(b''.join(line + b'\n' for line in lines))
+
+    def _results(self):
+        return [json.loads(line.decode('utf-8'))
+                for line in self.output.getvalue().splitlines()]
+
+    def test_results(self):
+        error = SubscriptionExpiredError('Subscription expired')
+        self.pusher.send = Mock(side_effect=[succeed(self.STATUS),
+                                             fail(error)])
+        sender = BatchSender(self.pusher, self.output)
+        stream = self._input({'uri': 'http://foo/1'}, b'{',
+                             {'uri': 'http://foo/2'}, b'')
+
+        def check(_):
+            results = sorted(self._results(), key=lambda r: r['line'])
+            self.assertEqual(results[0], {
+                'line': 1, 'uri': 'http://foo/1', 'notification': 'Received',
+                'subscription': 'Active', 'device': 'Connected'})
+            self.assertEqual(results[1]['line'], 2)
+            self.assertEqual(results[1]['error'], 'ValueError')
+            self.assertEqual(results[2], {
+                'line': 3, 'uri': 'http://foo/2',
+                'error': 'SubscriptionExpiredError',
+                'message': 'Subscription expired'})
+            self.assertEqual((sender.succeeded, sender.failed), (1, 2))
+
+        return sender.run(stream).addCallback(check)
+
+    @inlineCallbacks
+    def test_checkpoint_and_resume(self):
+        requests = []
+
+        def send(notification):
+            d = Deferred()
+            requests.append((notification.requestUri, d))
+            return d
+
+        self.pusher.send = Mock(side_effect=send)
+        specs = [{'uri': 'http://foo/{0}'.format(i)} for i in range(4)]
+        sender = BatchSender(self.pusher, self.output, concurrency=2,
+                             checkpoint=self.checkpoint, checkpointEvery=1)
+        sender.run(self._input(*specs))
+        yield deferLater(reactor, 0.01, lambda: None)
+        self.assertEqual(len(requests), 2)
+
+        requests[1][1].callback(self.STATUS)
+        self.assertEqual(sender.loadCheckpoint(), (0, 0))
+        requests[0][1].callback(self.STATUS)
+        offset = len(self._input(*specs[:2]).getvalue())
+        self.assertEqual(sender.loadCheckpoint(), (offset, 2))
+        yield deferLater(reactor, 0.01, lambda: None)
+        self.assertEqual(len(requests), 4)
+
+        requests[2][1].callback(self.STATUS)
+        offset = len(self._input(*specs[:3]).getvalue())
+        self.assertEqual(sender.loadCheckpoint(), (offset, 3))
+
+        self.pusher.send = Mock(return_value=succeed(self.STATUS))
+        resumed = BatchSender(self.pusher, io.BytesIO(),
+                              checkpoint=self.checkpoint)
+        yield resumed.run(self._input(*specs), *resumed.loadCheckpoint())
+        self.assertEqual(self.pusher.send.call_count, 1)
+        self.assertEqual(self.pusher.send.call_args[0][0].requestUri,
+                         b'http://foo/3')
+        self.assertEqual(resumed.loadCheckpoint(),
+                         (len(self._input(*specs).getvalue()), 4))
+
+    def test_arguments(self):
+        args = parseArguments(['-c', '5', '--checkpoint', 'foo', '--resume',
+                               'input.jsonl'])
+        self.assertEqual(args.input, 'input.jsonl')
+        self.assertEqual(args.output, '-')
+        self.assertEqual(args.concurrency, 5)
+        self.assertTrue(args.resume)
+        self.assertEqual(args.timeout, None)
+        self.assertEqual(parseArguments(['-t', '2.5']).timeout, 2.5)
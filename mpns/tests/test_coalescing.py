@@ -0,0 +1,104 @@
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from mpns.coalescing import CoalescingPusher, TILE, RAW
+from mpns.exceptions import ThrottlingLimitError
+from mpns.notifications import (
+    FlipTileNotification,
+    RawNotification,
+    TileNotification,
+    ToastNotification
+)
+from helpers import PendingPusherMixin
+
+
+class CoalescingPusherTestCase(PendingPusherMixin, TestCase):
+
+    def setUp(self):
+        super(CoalescingPusherTestCase, self).setUp()
+        self.clock = Clock()
+
+    def test_latest_tile_sent_after_delay(self):
+        coalescing = CoalescingPusher(self.pusher, delay=1, clock=self.clock)
+        results = self._sendAll(coalescing,
+                                TileNotification('http://foo/1', count=1),
+                                TileNotification('http://foo/1', count=2),
+                                TileNotification('http://foo/2', count=3))
+        self.assertEqual(self.requests, [])
+        self.assertEqual(coalescing.pending, 2)
+
+        self.clock.advance(1)
+        self.assertEqual([n.requestBody for n, _ in self.requests],
+                         [TileNotification('foo', count=2).requestBody,
+                          TileNotification('foo', count=3).requestBody])
+        self.assertEqual(coalescing.superseded, 1)
+
+        self.requests[0][1].callback('status')
+        self.assertEqual(results, ['status', 'status'])
+
+    def test_supersede_while_in_flight(self):
+        coalescing = CoalescingPusher(self.pusher, delay=0, clock=self.clock)
+        results = self._sendAll(coalescing,
+                                TileNotification('http://foo/1', count=1))
+        self.clock.advance(0)
+        self.assertEqual(len(self.requests), 1)
+
+        later = self._sendAll(coalescing,
+                              TileNotification('http://foo/1', count=2),
+                              TileNotification('http://foo/1', count=3))
+        self.clock.advance(10)
+        self.assertEqual(len(self.requests), 1)
+
+        error = ThrottlingLimitError('Throttled')
+        self.requests[0][1].errback(error)
+        self.assertEqual(len(self.requests), 2)
+        self.assertEqual(self.requests[1][0].requestBody,
+                         TileNotification('foo', count=3).requestBody)
+        self.assertEqual([r.value for r in results], [error])
+        self.assertEqual(later, [])
+
+        self.requests[1][1].callback('status')
+        self.assertEqual(later, ['status', 'status'])
+
+    def test_other_types_sent_directly(self):
+        coalescing = CoalescingPusher(self.pusher, clock=self.clock)
+        self._sendAll(coalescing,
+                      ToastNotification('http://foo/1', text1='foo'),
+                      ToastNotification('http://foo/1', text1='bar'),
+                      RawNotification('http://foo/1'))
+        self.assertEqual(len(self.requests), 3)
+
+    def test_raw_coalescing(self):
+        coalescing = CoalescingPusher(self.pusher, targets=(TILE, RAW),
+                                      clock=self.clock)
+        self._sendAll(coalescing,
+                      RawNotification('http://foo/1', body='1'),
+                      RawNotification('http://foo/1', body='2'),
+                      TileNotification('http://foo/1', count=1))
+        self.clock.advance(1)
+        bodies = [n.requestBody for n, _ in self.requests]
+        self.assertEqual(len(bodies), 2)
+        self.assertTrue(b'2' in bodies)
+        self.assertFalse(b'1' in bodies)
+
+    def test_flush(self):
+        coalescing = CoalescingPusher(self.pusher, delay=10, clock=self.clock)
+        self._sendAll(coalescing, TileNotification('http://foo/1', count=1))
+        coalescing.flush()
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(coalescing.pending, 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_secondary_tiles_not_coalesced(self):
+        coalescing = CoalescingPusher(self.pusher, delay=1, clock=self.clock)
+        self._sendAll(
+            coalescing, FlipTileNotification('http://foo/1', count=1),
+            FlipTileNotification('http://foo/1', count=2, tileId='/a.xaml'),
+            FlipTileNotification('http://foo/1', count=3, tileId='/a.xaml'))
+        self.clock.advance(1)
+        self.assertEqual(sorted((n.tileId, n.requestBody)
+                                for n, _ in self.requests), [
+            (None, FlipTileNotification('foo', count=1).requestBody),
+            ('/a.xaml', FlipTileNotification(
+                'foo', count=3, tileId='/a.xaml').requestBody)])
+        self.assertEqual(coalescing.superseded, 1)
@@ -0,0 +1,86 @@
+from mock import Mock
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from mpns.dedup import DeduplicatingPusher
+from mpns.exceptions import DuplicateNotificationError, RequestTimeoutError
+from mpns.notifications import RawNotification
+
+
+class DeduplicatingPusherTestCase(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.pusher = Mock()
+        self.pusher.send = Mock(side_effect=lambda _: succeed('sent'))
+
+    def _send(self, dedup, uri='http://foo/1', uuid='1'):
+        results = []
+        dedup.send(RawNotification(uri, uuid=uuid)).addBoth(results.append)
+        return results[0]
+
+    def test_duplicate_suppressed(self):
+        dedup = DeduplicatingPusher(self.pusher, clock=self.clock)
+        self.assertEqual(self._send(dedup), 'sent')
+        duplicate = self._send(dedup)
+        self.assertTrue(isinstance(duplicate.value,
+                                   DuplicateNotificationError))
+        self.assertEqual(duplicate.value.extra, {'messageId': '1'})
+        self.assertEqual(self._send(dedup, uri='http://foo/2'), 'sent')
+        self.assertEqual(self._send(dedup, uuid='2'), 'sent')
+        self.assertEqual(self.pusher.send.call_count, 3)
+        self.assertEqual((dedup.suppressed, len(dedup)), (1, 3))
+
+    def test_without_message_id(self):
+        dedup = DeduplicatingPusher(self.pusher, clock=self.clock)
+        for _ in range(2):
+            dedup.send(RawNotification('http://foo/1'))
+        self.assertEqual(self.pusher.send.call_count, 2)
+        self.assertEqual(len(dedup), 0)
+
+    def test_in_flight_duplicate_suppressed(self):
+        self.pusher.send = Mock(return_value=Deferred())
+        dedup = DeduplicatingPusher(self.pusher, clock=self.clock)
+        dedup.send(RawNotification('http://foo/1', uuid='1'))
+        self.assertTrue(isinstance(self._send(dedup).value,
+                                   DuplicateNotificationError))
+        self.assertEqual(self.pusher.send.call_count, 1)
+
+    def test_window_expiry(self):
+        dedup = DeduplicatingPusher(self.pusher, window=60, buckets=6,
+                                    clock=self.clock)
+        self._send(dedup)
+        self.clock.advance(30)
+        self._send(dedup, uuid='2')
+        self.clock.advance(30)
+        self.assertEqual(self._send(dedup).value.__class__,
+                         DuplicateNotificationError)
+        self.clock.advance(10)
+        self.assertEqual(self._send(dedup), 'sent')
+        self.assertEqual(len(dedup), 2)
+        self.assertTrue(('http://foo/1', '2') in dedup)
+
+    def test_max_keys(self):
+        dedup = DeduplicatingPusher(self.pusher, window=60, buckets=6,
+                                    maxKeys=2, clock=self.clock)
+        for uuid in '123':
+            self._send(dedup, uuid=uuid)
+            self.clock.advance(10)
+        self.assertEqual(len(dedup), 2)
+        self.assertEqual(self._send(dedup, uuid='1'), 'sent')
+        self.assertEqual(self.pusher.send.call_count, 4)
+
+    def test_failed_forgotten(self):
+        request = Deferred()
+        self.pusher.send = Mock(return_value=request)
+        dedup = DeduplicatingPusher(self.pusher, clock=self.clock)
+        results = []
+        dedup.send(RawNotification('http://foo/1', uuid='1')).addErrback(
+            results.append)
+        request.errback(RequestTimeoutError('Request timed out'))
+        self.assertTrue(isinstance(results[0].value, RequestTimeoutError))
+        self.assertEqual(len(dedup), 0)
+
+        self.pusher.send = Mock(side_effect=lambda _: succeed('sent'))
+        self.assertEqual(self._send(dedup), 'sent')
@@ -0,0 +1,193 @@
+import os
+import shutil
+import tempfile
+
+from mock import Mock
+from twisted.internet.defer import succeed, fail
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from mpns.durable import DurableQueue
+from mpns.exceptions import LoadSheddingError, SubscriptionExpiredError
+from mpns.notifications import RawNotification, ToastNotification
+from helpers import PendingPusherMixin
+
+
+class DurableQueueTestCase(PendingPusherMixin, TestCase):
+
+    def setUp(self):
+        super(DurableQueueTestCase, self).setUp()
+        self.clock = Clock()
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def _queue(self, **kwargs):
+        kwargs.setdefault('clock', self.clock)
+        queue = DurableQueue(self.pusher, self.path, **kwargs)
+        queue.start()
+        return queue
+
+    def _restart(self, queue, **kwargs):
+        queue._close()
+        self.requests = []
+        return self._queue(**kwargs)
+
+    def test_send_after_sync(self):
+        queue = self._queue()
+        durable = []
+        queue.enqueue(ToastNotification('http://foo/1', text1=u'\u0142'))
+        queue.enqueue(RawNotification('http://foo/2')).addCallback(
+            durable.append)
+        self.assertEqual(self.requests, [])
+        self.clock.advance(0.01)
+        self.assertEqual(durable, [None])
+
+        self.assertEqual([n.requestUri for n, _ in self.requests],
+                         ['http://foo/1', 'http://foo/2'])
+        toast = self.requests[0][0]
+        self.assertEqual(toast.requestBody,
+                         ToastNotification('foo', text1=u'\u0142').requestBody)
+        self.assertEqual(toast.requestHeaders['X-WindowsPhone-Target'],
+                         ('toast',))
+        self.assertEqual(self.requests[1][0].requestBody, None)
+
+    def test_sync_batch(self):
+        queue = self._queue(syncBatch=2)
+        queue.enqueue(RawNotification('http://foo/1'))
+        self.assertEqual(len(self.requests), 0)
+        queue.enqueue(RawNotification('http://foo/2'))
+        self.assertEqual(len(self.requests), 2)
+
+    def test_concurrency(self):
+        queue = self._queue(concurrency=2)
+        for i in range(5):
+            queue.enqueue(RawNotification('http://foo/{0}'.format(i)))
+        queue.sync()
+        self.assertEqual(len(self.requests), 2)
+        self.assertEqual(queue.inFlight, 2)
+        self.requests[0][1].callback('status')
+        self.assertEqual(len(self.requests), 3)
+        self.assertEqual(len(queue), 4)
+
+    def test_acknowledge(self):
+        results = []
+        queue = self._queue(
+            callback=lambda n, r: results.append((n.requestUri, r)))
+        queue.enqueue(RawNotification('http://foo/1'))
+        queue.enqueue(RawNotification('http://foo/2'))
+        queue.sync()
+        error = SubscriptionExpiredError('Subscription expired')
+        self.requests[0][1].callback('status')
+        self.requests[1][1].errback(error)
+        self.assertEqual(results, [('http://foo/1', 'status'),
+                                   ('http://foo/2', error)])
+        self.assertEqual(len(queue), 0)
+
+    def test_retry_connection_failure(self):
+        self.pusher.send = Mock(
+            side_effect=[fail(ValueError('Connection lost')),
+                         fail(LoadSheddingError('Load shed')),
+                         succeed('status')])
+        queue = self._queue(retryDelay=5)
+        queue.enqueue(RawNotification('http://foo/1'))
+        queue.sync()
+        self.assertEqual(len(queue), 1)
+        self.clock.advance(5)
+        self.assertEqual(len(queue), 1)
+        self.clock.advance(5)
+        self.assertEqual(self.pusher.send.call_count, 3)
+        self.assertEqual(len(queue), 0)
+
+    def test_replay_unacknowledged(self):
+        queue = self._queue()
+        queue.enqueue(RawNotification('http://foo/1', body='one'))
+        queue.enqueue(RawNotification('http://foo/2', body='two'))
+        queue.sync()
+        self.requests[0][1].callback('status')
+
+        queue = self._restart(queue)
+        self.assertEqual([(n.requestUri, n.requestBody)
+                          for n, _ in self.requests],
+                         [('http://foo/2', b'two')])
+        queue.enqueue(RawNotification('http://foo/3'))
+        queue.sync()
+        self.assertEqual(len(queue), 2)
+
+    def test_replay_skips_torn_record(self):
+        queue = self._queue()
+        queue.enqueue(RawNotification('http://foo/1'))
+        queue.sync()
+        queue._file.write(b'{"id":1,"uri":"http://fo')
+
+        queue = self._restart(queue)
+        self.assertEqual(len(queue), 1)
+        self.assertEqual(len(self.requests), 1)
+
+    def test_release_acknowledged_segments(self):
+        queue = self._queue(segmentSize=1)
+        queue.enqueue(RawNotification('http://foo/1'))
+        queue.sync()
+        queue.enqueue(RawNotification('http://foo/2'))
+        queue.sync()
+        self.assertEqual(queue.segments, [0, 1, 2])
+
+        self.requests[1][1].callback('status')
+        self.assertEqual(queue.segments, [0, 1, 2])
+        self.requests[0][1].callback('status')
+        self.assertEqual(queue.segments, [2])
+        self.assertEqual(sorted(os.listdir(self.path)),
+                         ['segment-0000000002.log'])
+
+    def test_compaction_moves_stale_entries(self):
+        queue = self._queue(segmentSize=300, maxSegments=2)
+        for i in range(8):
+            queue.enqueue(RawNotification('http://foo/{0}'.format(i)))
+        queue.sync()
+        for _, d in self.requests[1:]:
+            d.callback('status')
+        for i in range(8, 12):
+            queue.enqueue(RawNotification('http://foo/{0}'.format(i)))
+        queue.sync()
+        self.assertEqual(queue.segments, [1, 2])
+
+        queue = self._restart(queue)
+        self.assertEqual(len(queue), 5)
+        self.assertIn('http://foo/0',
+                      [n.requestUri for n, _ in self.requests])
+
+    def test_compaction_skips_unacknowledged_backlog(self):
+        queue = self._queue(segmentSize=4096, maxSegments=2)
+        for i in range(300):
+            queue.enqueue(RawNotification('http://foo/{0}'.format(i)))
+            queue.sync()
+        self.assertEqual(len(self.requests), 10)
+        self.assertTrue(len(queue.segments) > 2)
+        self.assertEqual(queue.bytesWritten, sum(
+            os.path.getsize(os.path.join(self.path, name))
+            for name in os.listdir(self.path)))
+
+    def test_synchronous_results(self):
+        queue = self._queue(concurrency=1)
+        for i in range(3000):
+            queue.enqueue(RawNotification('http://foo/{0}'.format(i)))
+        self.clock.advance(0.01)
+        self._failSynchronously(SubscriptionExpiredError('Expired'))
+        self.requests[0][1].callback('status')
+        self.assertEqual((len(queue), queue.inFlight), (0, 0))
+
+    def test_stop_waits_for_requests(self):
+        queue = self._queue()
+        queue.enqueue(RawNotification('http://foo/1'))
+        queue.enqueue(RawNotification('http://foo/2'))
+        queue.sync()
+        stopped = []
+        queue.stop().addCallback(stopped.append)
+        self.assertEqual(stopped, [])
+        self.requests[0][1].callback('status')
+        self.requests[1][1].errback(ValueError('Connection lost'))
+        self.assertEqual(stopped, [None])
+
+        self.requests = []
+        self._queue()
+        self.assertEqual([n.requestUri for n, _ in self.requests],
+                         ['http://foo/2'])
@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from mpns.expiry import ExpiredSubscriptionCache
+
+
+class ExpiredSubscriptionCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+
+    def test_add(self):
+        cache = ExpiredSubscriptionCache(clock=self.clock)
+        cache.add('http://foo/bar')
+        self.assertTrue('http://foo/bar' in cache)
+        self.assertFalse('http://foo/baz' in cache)
+
+    def test_lru_eviction(self):
+        cache = ExpiredSubscriptionCache(maxSize=2, clock=self.clock)
+        cache.add('http://foo/1')
+        cache.add('http://foo/2')
+        self.assertTrue('http://foo/1' in cache)
+        cache.add('http://foo/3')
+        self.assertEqual(len(cache), 2)
+        self.assertTrue('http://foo/1' in cache)
+        self.assertFalse('http://foo/2' in cache)
+
+    def test_ttl(self):
+        cache = ExpiredSubscriptionCache(ttl=10, clock=self.clock)
+        cache.add('http://foo/bar')
+        self.clock.advance(9)
+        self.assertTrue('http://foo/bar' in cache)
+        self.clock.advance(1)
+        self.assertFalse('http://foo/bar' in cache)
+        self.assertEqual(len(cache), 0)
+
+    def test_on_expired_batches(self):
+        batches = []
+        cache = ExpiredSubscriptionCache(onExpired=batches.append,
+                                         batchSize=2, clock=self.clock)
+        cache.add('http://foo/1')
+        cache.add('http://foo/1')
+        self.assertEqual(batches, [])
+        cache.add('http://foo/2')
+        cache.add('http://foo/3')
+        self.assertEqual(batches, [['http://foo/1', 'http://foo/2']])
+        cache.flush()
+        cache.flush()
+        self.assertEqual(batches[1:], [['http://foo/3']])
+
+    def test_persistence(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'expired')
+        cache = ExpiredSubscriptionCache(path=path, clock=self.clock)
+        cache.add('http://foo/1')
+        self.clock.advance(1.5)
+        cache.add('http://foo/2')
+        cache.save()
+
+        loaded = ExpiredSubscriptionCache(path=path, ttl=10, clock=self.clock)
+        self.assertEqual(len(loaded), 2)
+        self.clock.advance(9)
+        self.assertFalse('http://foo/1' in loaded)
+        self.assertTrue('http://foo/2' in loaded)
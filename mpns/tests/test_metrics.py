@@ -0,0 +1,76 @@
+from mock import Mock
+from zope.interface.verify import verifyObject
+from twisted.trial.unittest import TestCase
+
+from mpns.metrics import (
+    IPusherMetrics,
+    NullMetrics,
+    Metrics,
+    MetricsResource
+)
+from mpns.responses import NotificationStatus
+
+
+class MetricsTestCase(TestCase):
+
+    STATUS = NotificationStatus('Received', 'Active', 'Connected')
+
+    def test_interface(self):
+        self.assertTrue(verifyObject(IPusherMetrics, NullMetrics()))
+        self.assertTrue(verifyObject(IPusherMetrics, Metrics()))
+
+    def test_in_flight(self):
+        metrics = Metrics()
+        metrics.requestStarted()
+        metrics.requestStarted()
+        metrics.requestFinished('Received', self.STATUS, 0.1)
+        self.assertEqual(metrics.inFlight, 1)
+
+    def test_outcomes_and_statuses(self):
+        metrics = Metrics()
+        metrics.requestFinished('Received', self.STATUS, 0.1)
+        metrics.requestFinished('Received', self.STATUS, 0.1)
+        metrics.requestFinished('HTTPError', None, 0.1)
+        self.assertEqual(metrics.outcomes, {'Received': 2, 'HTTPError': 1})
+        self.assertEqual(metrics.statuses[('subscription', 'Active')], 2)
+
+    def test_histogram(self):
+        metrics = Metrics(buckets=(0.1, 1.0))
+        for duration in (0.05, 0.1, 0.5, 5):
+            metrics.phaseCompleted('connect', duration)
+        histogram = metrics.latencies['connect']
+        self.assertEqual(list(histogram.cumulativeCounts()), [2, 3, 4])
+        self.assertEqual(histogram.sum, 5.65)
+        self.assertEqual(histogram.count, 4)
+
+    def test_prometheus_text(self):
+        metrics = Metrics(buckets=(0.1,))
+        metrics.requestStarted()
+        metrics.requestFinished('Received', self.STATUS, 0.05)
+        text = metrics.prometheusText()
+        self.assertIn('mpns_requests_in_flight 0\n', text)
+        self.assertIn('mpns_notifications_total{outcome="Received"} 1\n',
+                      text)
+        self.assertIn('mpns_statuses_total{field="device",value="Connected"} '
+                      '1\n', text)
+        self.assertIn('mpns_latency_seconds_bucket{phase="total",le="0.1"} '
+                      '1\n', text)
+        self.assertIn('mpns_latency_seconds_bucket{phase="total",le="+Inf"} '
+                      '1\n', text)
+        self.assertIn('mpns_latency_seconds_count{phase="total"} 1\n', text)
+
+    def test_prometheus_text_escapes_labels(self):
+        metrics = Metrics()
+        metrics.requestStarted()
+        status = self.STATUS._replace(device='Bad "dev"\\\nice')
+        metrics.requestFinished('Received', status, 0.05)
+        text = metrics.prometheusText()
+        self.assertIn('mpns_statuses_total'
+                      '{field="device",value="Bad \\"dev\\"\\\\\\nice"} 1\n',
+                      text)
+
+    def test_resource(self):
+        metrics = Metrics()
+        request = Mock()
+        body = MetricsResource(metrics).render_GET(request)
+        self.assertEqual(body, metrics.prometheusText())
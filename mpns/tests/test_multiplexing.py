@@ -0,0 +1,82 @@
+from twisted.internet import reactor
+from twisted.internet.task import deferLater
+from twisted.trial.unittest import TestCase
+
+from mpns.exceptions import QueueFullError, SubscriptionExpiredError
+from mpns.multiplexing import MultiplexingPusher
+from mpns.notifications import RawNotification
+from helpers import PendingPusherMixin
+
+
+class MultiplexingPusherTestCase(PendingPusherMixin, TestCase):
+
+    def _sendTo(self, multiplexing, *uris):
+        return self._sendAll(multiplexing,
+                             *[RawNotification(uri) for uri in uris])
+
+    def _finish(self, index, result='sent'):
+        notification, d = self.requests.pop(index)
+        d.callback(result)
+        return notification.requestUri
+
+    def test_connections_per_host(self):
+        multiplexing = MultiplexingPusher(self.pusher, connectionsPerHost=2)
+        results = self._sendTo(multiplexing, 'http://a/1', 'http://a/2',
+                               'http://a/3', 'http://b/1')
+        self.assertEqual([n.requestUri for n, _ in self.requests],
+                         ['http://a/1', 'http://a/2', 'http://b/1'])
+        self.assertEqual(multiplexing.depths, {'a': 1})
+        self.assertEqual(multiplexing.inFlight, 3)
+
+        self._finish(0)
+        self.assertEqual(results, ['sent'])
+        self.assertEqual(self.requests[-1][0].requestUri, 'http://a/3')
+        self.assertEqual(multiplexing.depths, {})
+
+    def test_fair_across_hosts(self):
+        multiplexing = MultiplexingPusher(self.pusher, connectionsPerHost=1,
+                                          concurrency=1)
+        self._sendTo(multiplexing, 'http://a/1', 'http://a/2', 'http://a/3',
+                     'http://b/1', 'http://b/2', 'http://c/1')
+        sent = []
+        while self.requests:
+            sent.append(self._finish(0))
+        self.assertEqual(sent, ['http://a/1', 'http://b/1', 'http://c/1',
+                                'http://a/2', 'http://b/2', 'http://a/3'])
+        self.assertEqual(multiplexing.inFlight, 0)
+
+    def test_failure(self):
+        multiplexing = MultiplexingPusher(self.pusher, connectionsPerHost=1)
+        results = self._sendTo(multiplexing, 'http://a/1', 'http://a/2')
+        self.requests.pop(0)[1].errback(QueueFullError('Queue full'))
+        self.assertTrue(isinstance(results[0].value, QueueFullError))
+        self.assertEqual(self._finish(0), 'http://a/2')
+        self.assertEqual(results[1], 'sent')
+
+    def test_send_many(self):
+        multiplexing = MultiplexingPusher(self.pusher, connectionsPerHost=1)
+        results = []
+        d = multiplexing.sendMany(
+            (RawNotification(uri) for uri in ('http://a/1', 'http://a/2')),
+            callback=lambda notification, result: results.append(result))
+
+        def finish(_):
+            while self.requests:
+                self._finish(0)
+
+        def check(_):
+            self.assertEqual(results, ['sent', 'sent'])
+
+        deferLater(reactor, 0.01, lambda: None).addCallback(finish)
+        return d.addCallback(check)
+
+    def test_synchronous_failures(self):
+        multiplexing = MultiplexingPusher(self.pusher, concurrency=10)
+        results = self._sendTo(multiplexing, *[
+            'http://{0}/{1}'.format(i % 5, i) for i in range(3010)])
+        self._failSynchronously(SubscriptionExpiredError('Expired'))
+        while self.requests:
+            self._finish(0)
+        self.assertEqual(len(results), 3010)
+        self.assertEqual(multiplexing.inFlight, 0)
+        self.assertEqual(multiplexing.depths, {})
@@ -2,18 +2,27 @@ from twisted.trial.unittest import TestCase
 
 from mpns.notifications import (
     RawNotification,
+    PreparedNotification,
     XmlNotification,
     ToastNotification,
     TileNotification,
+    FlipTileNotification,
+    IconicTileNotification,
+    CycleTileNotification,
+    CLEAR,
     DELIVER_IMMEDIATELY,
     DELIVER_WITHIN_450_S,
     DELIVER_WITHIN_950_S,
+    MAX_PAYLOAD_SIZE,
     NotificationError
 )
 
 
 class NotificationTestCase(TestCase):
 
+    TEXT = u'\u017c\xf3\u0142w'
+    UTF8_TEXT = b'\xc5\xbc\xc3\xb3\xc5\x82w'
+
     TEST_URI = 'http://foo/bar'
     TEST_UUID = 'de305d54-75b4-431b-adb2-eb6b9e546014'
 
@@ -27,12 +36,12 @@ class NotificationTestCase(TestCase):
 
     def test_body_defined(self):
         notification = RawNotification(self.TEST_URI, body='foo')
-        self.assertEqual(notification.requestBody, 'foo')
+        self.assertEqual(notification.requestBody, b'foo')
 
     def test_set_header(self):
         notification = RawNotification(self.TEST_URI)
         notification._setHeader('foo', 'bar')
-        self.assertEqual(notification.requestHeaders['foo'], ['bar'])
+        self.assertEqual(notification.requestHeaders['foo'], ('bar',))
 
     def test_class_header_nonexisting(self):
         with self.assertRaises(NotificationError):
@@ -61,22 +70,22 @@ class NotificationTestCase(TestCase):
     def test_target_header_toast(self):
         notification = ToastNotification(self.TEST_URI)
         self.assertEqual(notification.requestHeaders['X-WindowsPhone-Target'],
-                         ['toast'])
+                         ('toast',))
 
     def test_target_header_tile(self):
         notification = TileNotification(self.TEST_URI)
         self.assertEqual(notification.requestHeaders['X-WindowsPhone-Target'],
-                         ['token'])
+                         ('token',))
 
     def test_uuid(self):
         notification = ToastNotification(self.TEST_URI, uuid=self.TEST_UUID)
         self.assertEqual(notification.requestHeaders['X-MessageID'],
-                         [self.TEST_UUID])
+                         (self.TEST_UUID,))
 
     def test_xml_content_type(self):
         notification = XmlNotification('foo', self.TEST_URI)
         self.assertEqual(notification.requestHeaders['Content-Type'],
-                         ['text/xml'])
+                         ('text/xml',))
 
     def test_xml_body(self):
         notification = XmlNotification('foo', self.TEST_URI)
@@ -85,4 +94,151 @@ class NotificationTestCase(TestCase):
         body = ''.join([XmlNotification.XML_HEADER.format('foo'),
                         '<wp:bar>baz</wp:bar>',
                         XmlNotification.XML_FOOTER.format('foo')])
-        self.assertEqual(body, notification.requestBody)
+        self.assertEqual(body.encode('utf-8'), notification.requestBody)
+
+    def test_xml_escaping(self):
+        notification = ToastNotification(self.TEST_URI, text1='Tom & Jerry',
+                                         text2=u'<b>\u0142</b>',
+                                         param='/page?a=1&b=2')
+        self.assertIn(b''.join([
+            b'<wp:Text1>Tom &amp; Jerry</wp:Text1>',
+            b'<wp:Text2>&lt;b&gt;\xc5\x82&lt;/b&gt;</wp:Text2>',
+            b'<wp:Param>/page?a=1&amp;b=2</wp:Param>']),
+            notification.requestBody)
+
+    def test_xml_escaping_single_bracket(self):
+        notification = TileNotification(self.TEST_URI, title='a > b')
+        self.assertIn(b'<wp:Title>a &gt; b</wp:Title>',
+                      notification.requestBody)
+
+    def test_payload_size_limit(self):
+        RawNotification(self.TEST_URI, body='x' * MAX_PAYLOAD_SIZE)
+        self.assertRaises(NotificationError, RawNotification, self.TEST_URI,
+                          body='x' * (MAX_PAYLOAD_SIZE + 1))
+        self.assertRaises(NotificationError, ToastNotification, self.TEST_URI,
+                          text1='&' * (MAX_PAYLOAD_SIZE // 5))
+
+    def test_for_uri(self):
+        notification = ToastNotification(self.TEST_URI, text1='foo')
+        clone = notification.forUri('http://foo/baz')
+        self.assertIsInstance(clone, ToastNotification)
+        self.assertEqual(clone.requestUri, 'http://foo/baz')
+        self.assertEqual(notification.requestUri, self.TEST_URI)
+        self.assertIs(clone.requestBody, notification.requestBody)
+        self.assertIs(clone.requestHeaders, notification.requestHeaders)
+
+    def test_no_instance_dict(self):
+        for notification in [RawNotification(self.TEST_URI),
+                             ToastNotification(self.TEST_URI),
+                             TileNotification(self.TEST_URI),
+                             PreparedNotification(self.TEST_URI, {})]:
+            self.assertFalse(hasattr(notification, '__dict__'))
+
+    def test_body_encoded(self):
+        notification = RawNotification(self.TEST_URI, body=self.TEXT)
+        self.assertEqual(notification.requestBody, self.UTF8_TEXT)
+
+    def test_xml_body_unicode(self):
+        notification = ToastNotification(self.TEST_URI, text1=self.TEXT,
+                                         text2=self.UTF8_TEXT, param=5)
+        self.assertIsInstance(notification.requestBody, bytes)
+        self.assertIn(b''.join([b'<wp:Text1>', self.UTF8_TEXT, b'</wp:Text1>',
+                                b'<wp:Text2>', self.UTF8_TEXT, b'</wp:Text2>',
+                                b'<wp:Param>5</wp:Param>']),
+                      notification.requestBody)
+
+    def test_shared_header_table(self):
+        first = ToastNotification(self.TEST_URI)
+        second = ToastNotification('http://foo/baz', text1='foo')
+        other = ToastNotification(self.TEST_URI, priority=DELIVER_WITHIN_450_S)
+        self.assertIs(first.requestHeaders, second.requestHeaders)
+        self.assertIsNot(first.requestHeaders, other.requestHeaders)
+
+    def test_header_table_read_only(self):
+        notification = ToastNotification(self.TEST_URI)
+        headers = notification.requestHeaders
+        self.assertRaises(TypeError, headers.__setitem__, 'foo', ['bar'])
+        self.assertRaises(TypeError, headers.update, foo=['bar'])
+        self.assertRaises(TypeError, headers.pop, 'Content-Type')
+        self.assertIsInstance(headers['X-NotificationClass'], tuple)
+        self.assertEqual(ToastNotification(self.TEST_URI).requestHeaders,
+                         {'Content-Type': ('text/xml',),
+                          'X-WindowsPhone-Target': ('toast',),
+                          'X-NotificationClass': ('2',)})
+
+    def test_uuid_does_not_modify_shared_table(self):
+        shared = TileNotification(self.TEST_URI)
+        notification = TileNotification(self.TEST_URI, uuid=self.TEST_UUID)
+        self.assertFalse('X-MessageID' in shared.requestHeaders)
+        self.assertEqual(notification.requestHeaders['X-NotificationClass'],
+                         ('1',))
+
+    def test_prepared(self):
+        headers = {'X-NotificationClass': ['3']}
+        notification = PreparedNotification(self.TEST_URI, headers, u'foo')
+        self.assertEqual(notification.requestHeaders,
+                         {'X-NotificationClass': ('3',)})
+        self.assertEqual(notification.requestBody, b'foo')
+
+    def test_flip_tile(self):
+        notification = FlipTileNotification(
+            self.TEST_URI, priority=DELIVER_WITHIN_450_S, title='News',
+            count=3, backContent='Tom & Jerry', wideBackContent=CLEAR,
+            tileId='/Page.xaml?a=1&b="2"')
+        self.assertEqual(notification.requestBody, b''.join([
+            b'<?xml version="1.0" encoding="utf-8"?>',
+            b'<wp:Notification xmlns:wp="WPNotification" Version="2.0">',
+            b'<wp:Tile Id="/Page.xaml?a=1&amp;b=&quot;2&quot;" ',
+            b'Template="FlipTile">',
+            b'<wp:WideBackContent Action="Clear"></wp:WideBackContent>',
+            b'<wp:Count>3</wp:Count>',
+            b'<wp:Title>News</wp:Title>',
+            b'<wp:BackContent>Tom &amp; Jerry</wp:BackContent>',
+            b'</wp:Tile></wp:Notification>']))
+        self.assertEqual(notification.tileId, '/Page.xaml?a=1&b="2"')
+        self.assertEqual(notification.requestHeaders['X-NotificationClass'],
+                         ('11',))
+        self.assertEqual(notification.requestHeaders['X-WindowsPhone-Target'],
+                         ('token',))
+
+    def test_iconic_tile(self):
+        notification = IconicTileNotification(
+            self.TEST_URI, wideContent1=self.TEXT, icon='/icon.png',
+            backgroundColor='#FF00FF00')
+        self.assertIn(b''.join([
+            b'<wp:Tile Template="IconicTile">',
+            b'<wp:IconImage>/icon.png</wp:IconImage>',
+            b'<wp:WideContent1>', self.UTF8_TEXT, b'</wp:WideContent1>',
+            b'<wp:BackgroundColor>#FF00FF00</wp:BackgroundColor>',
+            b'</wp:Tile>']), notification.requestBody)
+
+    def test_cycle_tile(self):
+        notification = CycleTileNotification(
+            self.TEST_URI, images=['/1.png', '/2.png'], title='Photos')
+        self.assertIn(b''.join([
+            b'<wp:Tile Template="CycleTile">',
+            b'<wp:CycleImage1>/1.png</wp:CycleImage1>',
+            b'<wp:CycleImage2>/2.png</wp:CycleImage2>',
+            b'<wp:Title>Photos</wp:Title>',
+            b'</wp:Tile>']), notification.requestBody)
+        self.assertEqual(
+            notification.requestBody,
+            CycleTileNotification(self.TEST_URI, cycleImage1='/1.png',
+                                  cycleImage2='/2.png',
+                                  title='Photos').requestBody)
+
+    def test_cycle_tile_too_many_images(self):
+        self.assertRaises(NotificationError, CycleTileNotification,
+                          self.TEST_URI, images=['/image.png'] * 10)
+
+    def test_template_tile_payload_size_limit(self):
+        self.assertRaises(NotificationError, FlipTileNotification,
+                          self.TEST_URI, backContent='x' * MAX_PAYLOAD_SIZE)
+
+    def test_template_tile_for_uri(self):
+        notification = FlipTileNotification(self.TEST_URI, title='foo',
+                                            tileId='/a.xaml')
+        clone = notification.forUri('http://foo/baz')
+        self.assertEqual(clone.requestUri, 'http://foo/baz')
+        self.assertIs(clone.requestBody, notification.requestBody)
+        self.assertEqual(clone.tileId, '/a.xaml')
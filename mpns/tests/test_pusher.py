@@ -1,14 +1,28 @@
 from mock import Mock
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+from twisted.internet.task import deferLater
 from twisted.trial.unittest import TestCase
 
+from mpns.admission import AdmissionController
+from mpns.exceptions import LoadSheddingError
+from mpns.expiry import ExpiredSubscriptionCache
+from mpns.metrics import Metrics
+from mpns.notifications import ToastNotification
 from mpns.pusher import (
     Pusher,
+    StringProducer,
+    _requestHeaders,
+    NotificationConnectionPool,
+    NotificationPolicyForHTTPS,
+    _ResumingConnectionCreator,
     InvalidResponseError,
     HTTPError,
     QueueFullError,
     SubscriptionExpiredError,
     DeviceDisconnectedError,
-    ThrottlingLimitError
+    ThrottlingLimitError,
+    RequestTimeoutError
 )
 
 
@@ -152,3 +166,382 @@ class PusherTestCase(TestCase):
 
         pusher._processErrorResponse.assert_called_once_with(response)
         self.assertFalse(pusher._processResponse.called)
+
+    def test_send_drains_body(self):
+        pusher = Pusher()
+        notification = self._create_mocked_notification()
+        response = self._create_mocked_response()
+
+        pusher._agent.request = Mock(return_value=response)
+
+        pusher.send(notification)
+
+        self.assertEqual(response.deliverBody.call_count, 1)
+
+    def test_pool_configuration(self):
+        pusher = Pusher(maxConnectionsPerHost=5, idleTimeout=30)
+        self.assertTrue(pusher.pool.persistent)
+        self.assertEqual(pusher.pool.maxPersistentPerHost, 5)
+        self.assertEqual(pusher.pool.cachedConnectionTimeout, 30)
+
+    def test_pool_not_persistent(self):
+        pusher = Pusher(persistent=False)
+        self.assertFalse(pusher.pool.persistent)
+
+    def test_pool_hits_and_misses(self):
+        pool = NotificationConnectionPool(Mock())
+        pool._newConnection = Mock()
+        connection = Mock()
+        connection.state = 'QUIESCENT'
+        key = ('https', 'foo', 443)
+
+        pool.getConnection(key, Mock())
+        pool._connections[key] = [connection]
+        pool._timeouts[connection] = Mock()
+        pool.getConnection(key, Mock())
+
+        self.assertEqual(pool.hits, 1)
+        self.assertEqual(pool.misses, 1)
+
+    def test_policy_caches_creators(self):
+        policy = NotificationPolicyForHTTPS(None)
+        creator = policy.creatorForNetloc(b'foo', 443)
+        self.assertIs(policy.creatorForNetloc(b'foo', 443), creator)
+        self.assertIsNot(policy.creatorForNetloc(b'foo', 8443), creator)
+        self.assertIsNot(policy.creatorForNetloc(b'bar', 443), creator)
+
+    def test_policy_reload(self):
+        pusher = Pusher()
+        creator = pusher._policy.creatorForNetloc(b'foo', 443)
+        pusher.reloadCertificate(None)
+        self.assertIsNot(pusher._policy.creatorForNetloc(b'foo', 443),
+                         creator)
+
+    def test_session_resumption(self):
+        connections = [Mock(), Mock(), Mock()]
+        connections[0].get_session.return_value = None
+        connections[1].get_session.return_value = None
+        creator = Mock()
+        creator.clientConnectionForTLS = Mock(side_effect=connections)
+        resuming = _ResumingConnectionCreator(creator)
+
+        resuming.clientConnectionForTLS(Mock())
+        self.assertFalse(connections[0].set_session.called)
+        connections[0].get_session.return_value = 'session'
+        resuming.clientConnectionForTLS(Mock())
+        connections[1].set_session.assert_called_once_with('session')
+        resuming.clientConnectionForTLS(Mock())
+        connections[2].set_session.assert_called_once_with('session')
+
+    def test_send_with_app_certificate(self):
+        registry = Mock()
+        registry.pem = Mock(return_value=None)
+        pusher = Pusher(certificates=registry)
+        pusher._agent.request = Mock()
+        response = self._create_mocked_response()
+        notification = self._create_mocked_notification()
+        for appId in ('foo', 'bar'):
+            agent = pusher._agentFor(appId)
+            agent.request = Mock(return_value=response)
+        self.assertIs(pusher._agentFor('foo'), pusher._agentFor('foo'))
+
+        pusher.send(notification, 'foo')
+        pusher.forApp('bar').send(notification)
+
+        def check(_):
+            self.assertFalse(pusher._agent.request.called)
+            self.assertEqual(sorted(pusher.pools), ['bar', 'foo'])
+            self.assertEqual(pusher._agentFor('foo').request.call_count, 1)
+            self.assertEqual(pusher._agentFor('bar').request.call_count, 2)
+            registry.pem.assert_any_call('bar')
+
+        d = pusher.sendMany([notification], appId='bar')
+        return d.addCallback(check)
+
+    def test_certificate_reload_retires_pool(self):
+        registry = Mock()
+        registry.pem = Mock(return_value=None)
+        pusher = Pusher(certificates=registry)
+        listener = registry.addListener.call_args[0][0]
+        pusher._agentFor('foo')
+        pool = pusher.pools['foo']
+
+        listener('foo', None)
+        self.assertEqual(pusher.pools, {})
+        connection = Mock()
+        pool._putConnection(('https', 'foo', 443), connection)
+        connection.transport.loseConnection.assert_called_once_with()
+        self.assertEqual(pool._connections, {})
+        self.assertIsNot(pusher._agentFor('foo'), None)
+        self.assertIsNot(pusher.pools['foo'], pool)
+
+    def test_send_without_registry(self):
+        pusher = Pusher()
+        self.assertFailure(pusher.send(self._create_mocked_notification(),
+                                       'foo'), ValueError)
+
+    def test_send_admission(self):
+        admission = AdmissionController(maxInFlight=1, maxQueuedBytes=20)
+        pusher = Pusher(admission=admission)
+        requests = []
+
+        def request(*args):
+            requests.append(Deferred())
+            return requests[-1]
+
+        pusher._agent.request = Mock(side_effect=request)
+        notification = self._create_mocked_notification()
+        results = []
+        for _ in range(3):
+            pusher.send(notification).addBoth(results.append)
+
+        self.assertEqual(len(requests), 1)
+        self.assertEqual(admission.queued, 1)
+        self.assertTrue(isinstance(results[0].value, LoadSheddingError))
+
+        requests[0].callback(self._create_mocked_response())
+        self.assertEqual(len(requests), 2)
+        requests[1].errback(ValueError('Connection lost'))
+        self.assertEqual(admission.inFlight, 0)
+        self.assertEqual(len(results), 3)
+        self.flushLoggedErrors(ValueError)
+
+    def test_send_expired_skips_admission(self):
+        admission = AdmissionController(maxInFlight=1)
+        cache = ExpiredSubscriptionCache()
+        cache.add('http://expired/')
+        pusher = Pusher(admission=admission, expiredCache=cache)
+        pusher._agent.request = Mock(return_value=Deferred())
+        pusher.send(self._create_mocked_notification())
+        notification = self._create_mocked_notification()
+        notification.requestUri = 'http://expired/'
+
+        self.assertFailure(pusher.send(notification),
+                           SubscriptionExpiredError)
+        self.assertEqual((admission.inFlight, admission.queued), (1, 0))
+
+    def test_send_timeout(self):
+        pusher = Pusher(timeout=0.01)
+        cancelled = []
+        pusher._agent.request = Mock(
+            return_value=Deferred(lambda d: cancelled.append(d)))
+        d = self.assertFailure(pusher.send(self._create_mocked_notification()),
+                               RequestTimeoutError)
+
+        def check(error):
+            self.assertEqual(len(cancelled), 1)
+            self.assertEqual(error.extra, {'timeout': 0.01})
+
+        return d.addCallback(check)
+
+    def test_send_per_call_timeout(self):
+        pusher = Pusher(timeout=60)
+        pusher._agent.request = Mock(return_value=Deferred())
+        return self.assertFailure(
+            pusher.send(self._create_mocked_notification(), timeout=0),
+            RequestTimeoutError)
+
+    def test_send_within_timeout(self):
+        pusher = Pusher(timeout=0.01)
+        request = Deferred()
+        pusher._agent.request = Mock(return_value=request)
+        d = pusher.send(self._create_mocked_notification())
+        request.callback(self._create_mocked_response())
+        d.addCallback(lambda status: deferLater(reactor, 0.02, lambda: status))
+        return d.addCallback(self.assertEqual, ('Received', 'Active',
+                                                'Connected'))
+
+    def test_send_timeout_while_rate_limited(self):
+        cancelled = []
+        limiter = Mock()
+        limiter.acquire = Mock(
+            return_value=Deferred(lambda d: cancelled.append(d)))
+        pusher = Pusher(limiter=limiter, timeout=0.01)
+        pusher._agent.request = Mock()
+        d = self.assertFailure(pusher.send(self._create_mocked_notification()),
+                               RequestTimeoutError)
+
+        def check(_):
+            self.assertEqual(len(cancelled), 1)
+            self.assertFalse(pusher._agent.request.called)
+
+        return d.addCallback(check)
+
+    def test_send_many(self):
+        pusher = Pusher()
+        state = {'inFlight': 0, 'maxInFlight': 0}
+        results = []
+
+        def send(notification):
+            state['inFlight'] += 1
+            state['maxInFlight'] = max(state['maxInFlight'],
+                                       state['inFlight'])
+
+            def finish():
+                state['inFlight'] -= 1
+                if notification == 3:
+                    raise QueueFullError('Queue full')
+                return notification
+
+            return deferLater(reactor, 0, finish)
+
+        pusher.send = send
+        d = pusher.sendMany(iter(range(10)), concurrency=3,
+                            callback=lambda n, r: results.append((n, r)))
+
+        def check(_):
+            self.assertEqual(state['maxInFlight'], 3)
+            self.assertEqual(len(results), 10)
+            errors = [n for n, r in results if isinstance(r, QueueFullError)]
+            self.assertEqual(errors, [3])
+
+        return d.addCallback(check)
+
+    def test_send_throttled_slows_down_limiter(self):
+        limiter = Mock()
+        limiter.acquire = Mock(return_value=None)
+        pusher = Pusher(limiter=limiter)
+        notification = self._create_mocked_notification()
+        response = self._create_mocked_response(code=406,
+                                                notification='Dropped')
+        pusher._agent.request = Mock(return_value=response)
+
+        self.assertFailure(pusher.send(notification), ThrottlingLimitError)
+        limiter.throttled.assert_called_once_with(self.TEST_URI, True)
+        self.assertFalse(limiter.accepted.called)
+
+    def test_send_received_speeds_up_limiter(self):
+        limiter = Mock()
+        limiter.acquire = Mock(return_value=None)
+        pusher = Pusher(limiter=limiter)
+        notification = self._create_mocked_notification()
+        pusher._agent.request = Mock(
+            return_value=self._create_mocked_response())
+
+        pusher.send(notification)
+        limiter.acquire.assert_called_once_with(self.TEST_URI)
+        limiter.accepted.assert_called_once_with(self.TEST_URI)
+
+    def test_send_expired_is_cached(self):
+        pusher = Pusher(expiredCache=ExpiredSubscriptionCache())
+        notification = self._create_mocked_notification()
+        response = self._create_mocked_response(code=404,
+                                                notification='Dropped',
+                                                subscription='Expired')
+        pusher._agent.request = Mock(return_value=response)
+
+        self.assertFailure(pusher.send(notification),
+                           SubscriptionExpiredError)
+        self.assertFailure(pusher.send(notification),
+                           SubscriptionExpiredError)
+        self.assertEqual(pusher._agent.request.call_count, 1)
+
+    def test_send_metrics(self):
+        metrics = Metrics()
+        pusher = Pusher(metrics=metrics)
+        notification = self._create_mocked_notification()
+        pusher._agent.request = Mock(side_effect=[
+            self._create_mocked_response(),
+            self._create_mocked_response(code=412, notification='Dropped',
+                                         device='Disconnected')])
+
+        pusher.send(notification)
+        self.assertFailure(pusher.send(notification), DeviceDisconnectedError)
+
+        self.assertEqual(metrics.inFlight, 0)
+        self.assertEqual(metrics.outcomes, {'Received': 1,
+                                            'DeviceDisconnectedError': 1})
+        self.assertEqual(metrics.statuses[('device', 'Disconnected')], 1)
+        self.assertEqual(metrics.latencies['total'].count, 2)
+
+    def test_send_shares_headers(self):
+        pusher = Pusher()
+        notification = ToastNotification(self.TEST_URI, text1='foo')
+        pusher._agent.request = Mock(
+            return_value=self._create_mocked_response())
+
+        pusher.send(notification)
+        pusher.send(notification.forUri('http://foo/baz'))
+
+        first, second = [args[0][2] for args in
+                         pusher._agent.request.call_args_list]
+        self.assertIs(first, second)
+        self.assertEqual(first.getRawHeaders('Host'), ['foo'])
+        self.assertEqual(first.getRawHeaders('X-WindowsPhone-Target'),
+                         ['toast'])
+
+
+class _Consumer(object):
+
+    def __init__(self, producer=None, pauseAfter=None):
+        self.producer = producer
+        self.pauseAfter = pauseAfter
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data)
+        if len(self.chunks) == self.pauseAfter:
+            self.producer.pauseProducing()
+
+
+class StringProducerTestCase(TestCase):
+
+    def test_write_at_once(self):
+        body = b'foo'
+        producer = StringProducer(body)
+        consumer = _Consumer()
+        finished = []
+        producer.startProducing(consumer).addCallback(finished.append)
+        self.assertEqual(producer.length, 3)
+        self.assertIs(consumer.chunks[0], body)
+        self.assertEqual(finished, [None])
+
+    def test_empty_body(self):
+        producer = StringProducer(None)
+        consumer = _Consumer()
+        producer.startProducing(consumer)
+        self.assertEqual(producer.length, 0)
+        self.assertEqual(consumer.chunks, [b''])
+
+    def test_chunks_with_pause(self):
+        body = b'x' * (StringProducer.CHUNK_SIZE * 2 + 1)
+        producer = StringProducer(body)
+        consumer = _Consumer(producer, pauseAfter=1)
+        finished = []
+        producer.startProducing(consumer).addCallback(finished.append)
+        self.assertEqual(len(consumer.chunks), 1)
+        self.assertEqual(finished, [])
+
+        producer.resumeProducing()
+        self.assertEqual([len(chunk) for chunk in consumer.chunks],
+                         [StringProducer.CHUNK_SIZE] * 2 + [1])
+        self.assertEqual(b''.join(consumer.chunks), body)
+        self.assertEqual(finished, [None])
+
+    def test_stop(self):
+        producer = StringProducer(b'x' * (StringProducer.CHUNK_SIZE + 1))
+        consumer = _Consumer(producer, pauseAfter=1)
+        finished = []
+        producer.startProducing(consumer).addBoth(finished.append)
+        producer.stopProducing()
+        producer.resumeProducing()
+        self.assertEqual(len(consumer.chunks), 1)
+        self.assertEqual(finished, [])
+
+
+class RequestHeadersTestCase(TestCase):
+
+    def test_cached_per_table_and_host(self):
+        notification = ToastNotification('https://foo:8443/bar', text1='a')
+        headers = _requestHeaders(notification)
+        self.assertEqual(headers.getRawHeaders('Host'), ['foo:8443'])
+        self.assertIs(_requestHeaders(notification.forUri(
+            'https://foo:8443/baz')), headers)
+        self.assertIsNot(_requestHeaders(notification.forUri(
+            'https://bar/baz')), headers)
+        self.assertIsNot(_requestHeaders(ToastNotification(
+            'https://foo:8443/bar', text1='a', uuid='1')), headers)
+
+    def test_uri_without_scheme(self):
+        headers = _requestHeaders(ToastNotification('foo', text1='a'))
+        self.assertEqual(headers.getRawHeaders('Host'), ['foo'])
@@ -0,0 +1,90 @@
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from mpns.ratelimit import AdaptiveRateLimiter
+from mpns.utils import gatewayHost
+
+
+class AdaptiveRateLimiterTestCase(TestCase):
+
+    TEST_URI = 'http://foo/bar'
+
+    def setUp(self):
+        self.clock = Clock()
+        self.clock.advance(100)
+
+    def _acquired(self, limiter, uri=TEST_URI):
+        fired = []
+        limiter.acquire(uri).addCallback(fired.append)
+        return fired
+
+    def test_gateway_host(self):
+        self.assertEqual(gatewayHost('https://foo:443/bar/baz'), 'foo:443')
+        self.assertEqual(gatewayHost('http://foo'), 'foo')
+
+    def test_unlimited(self):
+        limiter = AdaptiveRateLimiter(clock=self.clock)
+        for _ in range(10):
+            self.assertTrue(self._acquired(limiter))
+
+    def test_subscription_rate_spacing(self):
+        limiter = AdaptiveRateLimiter(subscriptionRate=2, clock=self.clock)
+        first = self._acquired(limiter)
+        second = self._acquired(limiter)
+        other = self._acquired(limiter, 'http://foo/baz')
+        self.assertTrue(first)
+        self.assertFalse(second)
+        self.assertTrue(other)
+        self.clock.advance(0.5)
+        self.assertTrue(second)
+
+    def test_host_rate_spacing(self):
+        limiter = AdaptiveRateLimiter(hostRate=1, clock=self.clock)
+        self.assertTrue(self._acquired(limiter))
+        self.assertFalse(self._acquired(limiter, 'http://foo/baz'))
+        self.assertTrue(self._acquired(limiter, 'http://qux/baz'))
+
+    def test_burst(self):
+        limiter = AdaptiveRateLimiter(subscriptionRate=1, burst=3,
+                                      clock=self.clock)
+        results = [self._acquired(limiter) for _ in range(4)]
+        self.assertEqual([bool(r) for r in results],
+                         [True, True, True, False])
+
+    def test_throttled_and_accepted(self):
+        limiter = AdaptiveRateLimiter(hostRate=10, subscriptionRate=4,
+                                      increase=1, decrease=0.5,
+                                      clock=self.clock)
+        self._acquired(limiter)
+        limiter.throttled(self.TEST_URI)
+        self.assertEqual(limiter.subscriptionRate(self.TEST_URI), 2)
+        self.assertEqual(limiter.hostRate(self.TEST_URI), 5)
+        self.assertEqual(limiter.hostRates, {'foo': 5})
+
+        limiter.throttled(self.TEST_URI, hostWide=False)
+        self.assertEqual(limiter.subscriptionRate(self.TEST_URI), 1)
+        self.assertEqual(limiter.hostRate(self.TEST_URI), 5)
+
+        for _ in range(5):
+            limiter.accepted(self.TEST_URI)
+        self.assertEqual(limiter.subscriptionRate(self.TEST_URI), 4)
+        self.assertEqual(limiter.hostRate(self.TEST_URI), 10)
+
+    def test_min_rate(self):
+        limiter = AdaptiveRateLimiter(subscriptionRate=1, minRate=0.5,
+                                      clock=self.clock)
+        self._acquired(limiter)
+        for _ in range(5):
+            limiter.throttled(self.TEST_URI)
+        self.assertEqual(limiter.subscriptionRate(self.TEST_URI), 0.5)
+
+    def test_prune_idle_subscriptions(self):
+        limiter = AdaptiveRateLimiter(subscriptionRate=1, maxSubscriptions=2,
+                                      clock=self.clock)
+        self._acquired(limiter, 'http://foo/1')
+        self._acquired(limiter, 'http://foo/2')
+        limiter.throttled('http://foo/2')
+        self.clock.advance(10)
+        self._acquired(limiter, 'http://foo/3')
+        self.assertEqual(sorted(limiter._subscriptions),
+                         ['http://foo/2', 'http://foo/3'])
@@ -0,0 +1,42 @@
+from twisted.trial.unittest import TestCase
+
+from mpns.responses import (
+    NotificationStatus,
+    classifyResponse,
+    EXPIRED_OUTCOME,
+    DROPPED_OUTCOME,
+    INVALID_OUTCOME
+)
+from mpns.exceptions import QueueFullError, ThrottlingLimitError
+
+
+class ClassifyResponseTestCase(TestCase):
+
+    def _classify(self, code, notification, subscription='Active',
+                  device='Connected'):
+        return classifyResponse(code, NotificationStatus(
+            notification, subscription, device))
+
+    def test_received(self):
+        self.assertIsNone(self._classify(200, 'Received'))
+        self.assertIsNone(self._classify(200, 'Suppressed'))
+
+    def test_queue_full(self):
+        self.assertEqual(self._classify(200, 'QueueFull')[0], QueueFullError)
+
+    def test_throttled_regardless_of_status(self):
+        self.assertEqual(self._classify(406, 'Dropped')[0],
+                         ThrottlingLimitError)
+        self.assertEqual(self._classify(406, 'foo')[0], ThrottlingLimitError)
+
+    def test_expired(self):
+        self.assertIs(self._classify(404, 'Dropped', 'Expired'),
+                      EXPIRED_OUTCOME)
+
+    def test_dropped(self):
+        self.assertIs(self._classify(404, 'Dropped'), DROPPED_OUTCOME)
+        self.assertIs(self._classify(200, 'Dropped'), DROPPED_OUTCOME)
+
+    def test_invalid(self):
+        self.assertIs(self._classify(200, 'foo'), INVALID_OUTCOME)
+        self.assertIs(self._classify(404, ''), INVALID_OUTCOME)
@@ -0,0 +1,109 @@
+from mock import Mock
+from twisted.internet.defer import succeed, fail
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from mpns.exceptions import (
+    HTTPError,
+    QueueFullError,
+    SubscriptionExpiredError
+)
+from mpns.retry import RetryRule, RetryingPusher
+
+
+class RetryingPusherTestCase(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.pusher = Mock()
+        self.rules = ((HTTPError, RetryRule(maxAttempts=3, initialDelay=1,
+                                            jitter=0, codes=(503,))),
+                      (QueueFullError, RetryRule(initialDelay=10, jitter=0)))
+
+    def _respond(self, *results):
+        results = list(results)
+
+        def send(notification):
+            result = results.pop(0)
+            if isinstance(result, Exception):
+                return fail(result)
+            return succeed(result)
+
+        self.pusher.send = Mock(side_effect=send)
+
+    def _send(self, retrying, deadline=None):
+        results = []
+        retrying.send('foo', deadline).addBoth(results.append)
+        return results
+
+    def test_rule_delay(self):
+        rule = RetryRule(initialDelay=1, maxDelay=5, multiplier=2, jitter=0)
+        self.assertEqual([rule.delay(a) for a in range(1, 6)],
+                         [1, 2, 4, 5, 5])
+
+    def test_rule_jitter(self):
+        rule = RetryRule(initialDelay=10, jitter=0.5)
+        for _ in range(100):
+            self.assertTrue(5 <= rule.delay(1) <= 10)
+
+    def test_success_without_retry(self):
+        self._respond('status')
+        retrying = RetryingPusher(self.pusher, self.rules, clock=self.clock)
+        self.assertEqual(self._send(retrying), ['status'])
+
+    def test_retry_until_success(self):
+        error = HTTPError('Service unavailable', {'response code': 503})
+        self._respond(error, error, 'status')
+        retrying = RetryingPusher(self.pusher, self.rules, clock=self.clock)
+        results = self._send(retrying)
+
+        self.assertEqual(retrying.pending, 1)
+        self.clock.advance(1)
+        self.assertEqual(self.pusher.send.call_count, 2)
+        self.clock.advance(1)
+        self.assertEqual(self.pusher.send.call_count, 2)
+        self.clock.advance(1)
+        self.assertEqual(results, ['status'])
+        self.assertEqual(retrying.pending, 0)
+
+    def test_max_attempts(self):
+        error = HTTPError('Service unavailable', {'response code': 503})
+        self._respond(error, error, error)
+        retrying = RetryingPusher(self.pusher, self.rules, clock=self.clock)
+        results = self._send(retrying)
+        self.clock.pump([1, 2])
+        self.assertEqual(self.pusher.send.call_count, 3)
+        self.assertTrue(results[0].check(HTTPError))
+
+    def test_not_retried_code(self):
+        self._respond(HTTPError('Unauthorized', {'response code': 401}))
+        retrying = RetryingPusher(self.pusher, self.rules, clock=self.clock)
+        results = self._send(retrying)
+        self.assertTrue(results[0].check(HTTPError))
+
+    def test_not_retried_error(self):
+        self._respond(SubscriptionExpiredError('Subscription expired'))
+        retrying = RetryingPusher(self.pusher, self.rules, clock=self.clock)
+        results = self._send(retrying)
+        self.assertTrue(results[0].check(SubscriptionExpiredError))
+        self.assertEqual(retrying.pending, 0)
+
+    def test_deadline(self):
+        self._respond(QueueFullError('Queue full'))
+        retrying = RetryingPusher(self.pusher, self.rules, clock=self.clock)
+        results = self._send(retrying, deadline=5)
+        self.assertTrue(results[0].check(QueueFullError))
+
+    def test_single_timer(self):
+        error = QueueFullError('Queue full')
+        self._respond(error, error, 'status', 'status')
+        retrying = RetryingPusher(self.pusher, self.rules, clock=self.clock)
+        first = self._send(retrying)
+        self.clock.advance(5)
+        second = self._send(retrying)
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        self.clock.advance(5)
+        self.assertEqual(first, ['status'])
+        self.assertEqual(second, [])
+        self.clock.advance(5)
+        self.assertEqual(second, ['status'])
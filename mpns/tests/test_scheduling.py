@@ -0,0 +1,122 @@
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from mpns.exceptions import QueueFullError, SubscriptionExpiredError
+from mpns.notifications import (
+    DELIVER_IMMEDIATELY,
+    DELIVER_WITHIN_450_S,
+    DELIVER_WITHIN_950_S,
+    PreparedNotification,
+    RawNotification,
+    TileNotification,
+    ToastNotification
+)
+from mpns.scheduling import PriorityScheduler, priorityOf
+from helpers import PendingPusherMixin
+
+
+class PriorityOfTestCase(TestCase):
+
+    def test_priority(self):
+        for cls in (RawNotification, ToastNotification, TileNotification):
+            for priority in (DELIVER_IMMEDIATELY, DELIVER_WITHIN_450_S,
+                             DELIVER_WITHIN_950_S):
+                notification = cls('http://foo/bar', priority=priority)
+                self.assertEqual(priorityOf(notification), priority)
+
+    def test_missing_header(self):
+        notification = PreparedNotification('http://foo/bar', {})
+        self.assertEqual(priorityOf(notification), DELIVER_IMMEDIATELY)
+
+
+class PrioritySchedulerTestCase(PendingPusherMixin, TestCase):
+
+    def setUp(self):
+        super(PrioritySchedulerTestCase, self).setUp()
+        self.clock = Clock()
+
+    def _uris(self):
+        return [n.requestUri for n, _ in self.requests]
+
+    def _finish(self, index, result='status'):
+        self.requests[index][1].callback(result)
+
+    def test_immediate_first(self):
+        scheduler = PriorityScheduler(self.pusher, concurrency=1,
+                                      clock=self.clock)
+        scheduler.send(RawNotification('http://foo/0'))
+        scheduler.send(RawNotification('http://foo/950',
+                                       priority=DELIVER_WITHIN_950_S))
+        scheduler.send(RawNotification('http://foo/450',
+                                       priority=DELIVER_WITHIN_450_S))
+        scheduler.send(RawNotification('http://foo/1'))
+        self.assertEqual(scheduler.depths,
+                         {DELIVER_IMMEDIATELY: 1, DELIVER_WITHIN_450_S: 1,
+                          DELIVER_WITHIN_950_S: 1})
+
+        for i in range(3):
+            self._finish(i)
+        self.assertEqual(self._uris(), ['http://foo/0', 'http://foo/1',
+                                        'http://foo/450', 'http://foo/950'])
+
+    def test_reserved_capacity(self):
+        scheduler = PriorityScheduler(self.pusher, concurrency=3, reserved=1,
+                                      clock=self.clock)
+        for i in range(3):
+            scheduler.send(TileNotification('http://foo/{0}'.format(i),
+                                            priority=DELIVER_WITHIN_950_S))
+        self.assertEqual(scheduler.inFlight, 2)
+        scheduler.send(ToastNotification('http://foo/toast'))
+        self.assertEqual(self._uris()[-1], 'http://foo/toast')
+        self.assertEqual(scheduler.inFlight, 3)
+
+    def test_earliest_deadline_first(self):
+        scheduler = PriorityScheduler(self.pusher, concurrency=2, reserved=0,
+                                      slack=0, clock=self.clock)
+        scheduler.send(RawNotification('http://foo/busy'))
+        scheduler.send(RawNotification('http://foo/busy'))
+        scheduler.send(RawNotification('http://foo/950',
+                                       priority=DELIVER_WITHIN_950_S))
+        self.clock.advance(600)
+        scheduler.send(RawNotification('http://foo/450',
+                                       priority=DELIVER_WITHIN_450_S))
+        self._finish(0)
+        self.assertEqual(self._uris()[-1], 'http://foo/950')
+
+    def test_urgent_deferred_preempts_immediate(self):
+        scheduler = PriorityScheduler(self.pusher, concurrency=1, slack=50,
+                                      clock=self.clock)
+        scheduler.send(RawNotification('http://foo/busy'))
+        scheduler.send(RawNotification('http://foo/450',
+                                       priority=DELIVER_WITHIN_450_S))
+        self.clock.advance(460)
+        scheduler.send(RawNotification('http://foo/0'))
+        self._finish(0)
+        self.assertEqual(self._uris()[1], 'http://foo/450')
+        self.assertEqual(scheduler.missed[DELIVER_WITHIN_450_S], 1)
+        self.assertEqual(scheduler.sent[DELIVER_WITHIN_450_S], 1)
+
+    def test_results(self):
+        scheduler = PriorityScheduler(self.pusher, clock=self.clock)
+        results = []
+        scheduler.send(RawNotification('http://foo/1')).addBoth(
+            results.append)
+        scheduler.send(RawNotification('http://foo/2')).addBoth(
+            results.append)
+        error = QueueFullError('Queue full')
+        self._finish(0)
+        self.requests[1][1].errback(error)
+        self.assertEqual(results[0], 'status')
+        self.assertEqual(results[1].value, error)
+        self.assertEqual(scheduler.inFlight, 0)
+
+    def test_synchronous_failures(self):
+        scheduler = PriorityScheduler(self.pusher, clock=self.clock)
+        results = self._sendAll(scheduler, *[
+            RawNotification('http://foo/{0}'.format(i)) for i in range(3010)])
+        self._failSynchronously(SubscriptionExpiredError('Expired'))
+        for _, d in self.requests:
+            d.callback('status')
+        self.assertEqual(len(results), 3010)
+        self.assertEqual(scheduler.inFlight, 0)
+        self.assertEqual(sum(scheduler.depths.values()), 0)
@@ -0,0 +1,118 @@
+from mock import Mock
+from twisted.internet import reactor
+from twisted.internet.defer import inlineCallbacks, succeed, fail
+from twisted.trial.unittest import TestCase
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+
+from mpns.exceptions import (
+    NotificationPusherError,
+    HTTPError,
+    SubscriptionExpiredError
+)
+from mpns.notifications import RawNotification
+from mpns.responses import NotificationStatus
+from mpns.sharding import ShardedPusher, ShardWorker
+
+
+class ShardingTestCase(TestCase):
+
+    STATUS = NotificationStatus('Dropped', 'Expired', 'Disconnected')
+
+    def _worker(self, result):
+        worker = ShardWorker()
+        worker._pusher = Mock()
+        worker._pusher.send = Mock(return_value=result)
+        return worker
+
+    def _roundTrip(self, result):
+        results = []
+        self._worker(result).send(b'http://foo/bar', b'{}').addCallback(
+            ShardedPusher._processResult).addBoth(results.append)
+        return results[0]
+
+    def test_shard_of(self):
+        pusher = ShardedPusher(workers=3)
+        shards = set(pusher.shardOf('http://foo/bar{0}'.format(i))
+                     for i in range(100))
+        self.assertEqual(shards, set([0, 1, 2]))
+        self.assertEqual(pusher.shardOf('http://foo/bar'),
+                         pusher.shardOf('http://foo/bar'))
+
+    def test_worker_prepares_notification(self):
+        worker = self._worker(succeed(NotificationStatus('', '', '')))
+        worker.send(b'http://foo/bar', b'{"X-NotificationClass": ["3"]}',
+                    b'body')
+        notification = worker._pusher.send.call_args[0][0]
+        self.assertEqual(notification.requestUri, b'http://foo/bar')
+        self.assertEqual(notification.requestHeaders,
+                         {'X-NotificationClass': ('3',)})
+        self.assertEqual(notification.requestBody, b'body')
+
+    def test_status(self):
+        status = NotificationStatus('Received', 'Active', 'Connected')
+        self.assertEqual(self._roundTrip(succeed(status)), status)
+
+    def test_known_error(self):
+        error = SubscriptionExpiredError(
+            'Subscription expired',
+            extra={'response code': 404, 'status': self.STATUS})
+        result = self._roundTrip(fail(error)).value
+        self.assertIsInstance(result, SubscriptionExpiredError)
+        self.assertEqual(str(result), 'Subscription expired')
+        self.assertEqual(result.extra, error.extra)
+
+    def test_error_without_status(self):
+        error = HTTPError('Service unavailable', {'response code': 503})
+        result = self._roundTrip(fail(error)).value
+        self.assertIsInstance(result, HTTPError)
+        self.assertEqual(result.extra, {'response code': 503})
+
+    def test_unknown_error(self):
+        result = self._roundTrip(fail(ValueError('foo'))).value
+        self.assertEqual(type(result), NotificationPusherError)
+        self.assertEqual(result.extra, {'error class': 'ValueError'})
+
+
+class _Gateway(Resource):
+
+    isLeaf = True
+
+    def render_POST(self, request):
+        request.setHeader(b'X-NotificationStatus', b'Received')
+        request.setHeader(b'X-SubscriptionStatus', b'Active')
+        request.setHeader(b'X-DeviceConnectionStatus', b'Connected')
+        return b''
+
+
+class ShardedPusherTestCase(TestCase):
+
+    STATUS = NotificationStatus('Received', 'Active', 'Connected')
+
+    def setUp(self):
+        site = Site(_Gateway())
+        site.noisy = False
+        port = reactor.listenTCP(0, site, interface='127.0.0.1')
+        self.addCleanup(port.stopListening)
+        self.uri = 'http://127.0.0.1:{0}/'.format(port.getHost().port)
+
+    @inlineCallbacks
+    def test_workers(self):
+        pusher = ShardedPusher(workers=2, persistent=False)
+        yield pusher.start()
+        uris = [self.uri + str(i) for i in range(8)]
+        self.assertEqual(set(map(pusher.shardOf, uris)), set([0, 1]))
+        results = []
+        yield pusher.sendMany((RawNotification(uri) for uri in uris),
+                              callback=lambda _, result:
+                              results.append(result))
+        self.assertEqual(results, [self.STATUS] * len(uris))
+
+        crashed = pusher._workers[0]
+        crashed.transport.signalProcess('KILL')
+        yield crashed.ended
+        self.assertIsNot(pusher._workers[0], crashed)
+        yield pusher._workers[0].started
+        status = yield pusher.send(RawNotification(uris[0]))
+        self.assertEqual(status, self.STATUS)
+        yield pusher.stop()
@@ -0,0 +1,9 @@
+def gatewayHost(uri):
+    """
+    Return network location (host and optional port) of the gateway server
+    a subscription URI points to.
+    """
+    start = uri.find('://')
+    start = 0 if start < 0 else start + 3
+    end = uri.find('/', start)
+    return uri[start:] if end < 0 else uri[start:end]
@@ -16,5 +16,6 @@ setup(
     download_url=DOWNLOAD_URL,
     keywords=['mpns', 'twisted'],
     license='MIT',
-    install_requires=['Twisted>=15.0.0']
+    install_requires=['Twisted>=15.0.0'],
+    extras_require={'asyncio': ['aiohttp>=3.0']}
 )